@@ -1,21 +1,22 @@
 import datetime as dt
+import hashlib
 import os
 from glob import glob
 
 from django.conf import settings
 from django.core.cache import cache
+from django.utils.functional import cached_property
 
 import iso8601
 import numpy as np
 import pandas as pd
 import pytz
-from hspatial import PointTimeseries, extract_point_from_raster
-from osgeo import gdal
-from swb import (
-    calculate_crop_evapotranspiration,
-    calculate_soil_water,
-    get_effective_precipitation,
-)
+from swb import calculate_soil_water, get_effective_precipitation
+
+from . import kc_curves, profiling
+from .model_results import decode_model_results, encode_model_results
+from .rasters import raster_pool
+from .timeseries_store import TimeseriesStore
 
 
 class AgrifieldSWBMixin:
@@ -31,30 +32,17 @@ class AgrifieldSWBMixin:
 
     @property
     def draintime(self):
-        raster_a = os.path.join(settings.AIRA_DATA_SOIL, "a_1d.tif")
-        a = extract_point_from_raster(self.location, gdal.Open(raster_a))
-        raster_b = os.path.join(settings.AIRA_DATA_SOIL, "b.tif")
-        b = extract_point_from_raster(self.location, gdal.Open(raster_b))
-        return round(a * self.root_depth ** b)
-
-    def _point_timeseries(self, category, varname):
-        return PointTimeseries(
-            self.location,
-            prefix=os.path.join(
-                getattr(settings, "AIRA_DATA_" + category), "daily_" + varname
-            ),
-            start_date=InitialConditions(self).date,
-            default_time=dt.time(23, 59),
-        ).get()
+        # Calculated when needed, so that a gap in the draintime rasters affects
+        # only the model and not the rest of the soil parameters.
+        soil = self.soil
+        return round(soil.draintime_a * self.root_depth ** soil.draintime_b)
 
     def _get_timeseries_from_rasters(self, var):
-        historical = self._point_timeseries("HISTORICAL", var)
-        forecast = self._point_timeseries("FORECAST", var)
-        self.historical_end_date = historical.data.index[-1]
-        forecast_start_date = self.historical_end_date + dt.timedelta(minutes=1)
-        forecast.data = forecast.data[forecast_start_date:]
-        self.forecast_start_date = forecast.data.index[0]
-        return pd.concat((historical.data["value"], forecast.data["value"]))
+        forcing, column = self._meteo_forcing
+        index, values = forcing.get(var)
+        self.historical_end_date = forcing.historical_end_date[var]
+        self.forecast_start_date = forcing.forecast_start_date[var]
+        return pd.Series(values[:, column], index=index)
 
     def _determine_effective_precipitation(self):
         self.timeseries["precipitation"] = self._get_timeseries_from_rasters("rain")
@@ -66,80 +54,99 @@ class AgrifieldSWBMixin:
         )
 
     def _determine_irrigation(self):
-        self.timeseries["applied_irrigation"] = 0  # Zero is the default
-        self.timeseries["applied_irrigation"] = self.timeseries[
-            "applied_irrigation"
-        ].astype("object")
-        self.timeseries["actual_net_irrigation"] = 0  # Zero is the default
-        self.timeseries["actual_net_irrigation"] = self.timeseries[
-            "actual_net_irrigation"
-        ].astype("object")
+        # The irrigations are summed per day in the database. When an irrigation
+        # event has been logged but we don't know how much, we assume we reached
+        # field capacity (or saturation if we were already at field capacity); this
+        # is marked in irrigate_to_fc, and the applied irrigation of that day is NaN.
+        index = self.timeseries.index
+        applied = np.zeros(len(index))
+        unknown = np.zeros(len(index), dtype=bool)
         tz = pytz.timezone(settings.TIME_ZONE)
-        start = tz.localize(
-            self.timeseries.index[0] - dt.timedelta(hours=23, minutes=59)
-        )
-        end = tz.localize(self.timeseries.index[-1])
-        applied_irrigations = self.appliedirrigation_set.filter(
+        start = tz.localize(index[0] - dt.timedelta(hours=23, minutes=59))
+        end = tz.localize(index[-1])
+        rows = dict(zip(index.date, range(len(index))))
+        daily_totals = self.appliedirrigation_set.filter(
             timestamp__range=(start, end)
-        ).order_by("timestamp")
-        for applied_irrigation in applied_irrigations:
-            date = dt.datetime.combine(
-                applied_irrigation.timestamp.astimezone(tz).date(), dt.time(23, 59)
-            )
-            if tz.localize(date) < start or tz.localize(date) > end:
+        ).daily_totals(tz)
+        for daily_total in daily_totals:
+            i = rows.get(daily_total["date"])
+            if i is None:
                 continue
-            volume = applied_irrigation.volume
-            if volume is None or self.timeseries.at[date, "applied_irrigation"] is None:
-                # When an irrigation event has been logged but we don't know how
-                # much, we assume we reached field capacity (or saturation if we were
-                # already at field capacity). At that point we use "fc" instead of a
-                # number, which signals to swb.calculate_soil_water() to assume we
-                # irrigated with such an amount.
-                self.timeseries.at[date, "actual_net_irrigation"] = "fc"
-                self.timeseries.at[date, "applied_irrigation"] = None
+            if daily_total["nunknown"]:
+                unknown[i] = True
             else:
-                applied_water_mm = float(volume / self.wetted_area * 1000)
-                self.timeseries.at[date, "actual_net_irrigation"] += (
-                    applied_water_mm * self.irrigation_efficiency
-                )
-                self.timeseries.at[date, "applied_irrigation"] += applied_water_mm
+                applied[i] = daily_total["volume"] / self.wetted_area * 1000
+        self.timeseries["applied_irrigation"] = np.where(unknown, np.nan, applied)
+        self.timeseries["actual_net_irrigation"] = np.where(
+            unknown, 0, applied * self.irrigation_efficiency
+        )
+        self.timeseries["irrigate_to_fc"] = unknown
 
     def _determine_crop_evapotranspiration(self):
-        calculate_crop_evapotranspiration(
-            timeseries=self.timeseries,
-            planting_date=self.most_recent_planting_date,
-            kc_offseason=self.crop_type.kc_offseason,
-            kc_plantingdate=self.crop_type.kc_plantingdate,
-            kc_stages=self.crop_type.kc_stages,
+        kc = kc_curves.get_kc(
+            self.crop_type, self.most_recent_planting_date, self.timeseries.index
         )
+        self.timeseries["kc"] = kc
+        self.timeseries["crop_evapotranspiration"] = (
+            self.timeseries["ref_evapotranspiration"].values * kc
+        )
+
+    def prepare_timeseries(self, meteo_forcing=None, column=0):
+        """Setup self.timeseries, a DataFrame with the data needed to run the model.
 
-    def prepare_timeseries(self):
-        """Setup self.timeseries, a DataFrame with the data needed to run the model."""
+        The meteorological data are taken from column "column" of meteo_forcing, a
+        MeteoForcing object; if it is not specified, one is created for this
+        agrifield alone.
+        """
+        if meteo_forcing is None:
+            meteo_forcing = MeteoForcing([self.location], InitialConditions(self).date)
+        self._meteo_forcing = (meteo_forcing, column)
         self.timeseries = pd.DataFrame()
-        self._determine_evaporation()
-        self._determine_effective_precipitation()
+        with profiling.span("determine_evaporation"):
+            self._determine_evaporation()
+        with profiling.span("determine_effective_precipitation"):
+            self._determine_effective_precipitation()
         self.timeseries.dropna()
-        self._determine_crop_evapotranspiration()
-        self._determine_irrigation()
+        with profiling.span("determine_crop_evapotranspiration"):
+            self._determine_crop_evapotranspiration()
+        with profiling.span("determine_irrigation"):
+            self._determine_irrigation()
+
+    def get_swb_parameters(self):
+        """Return the parameters of swb.calculate_soil_water() except timeseries."""
+        return {
+            "theta_s": float(self.theta_s),
+            "theta_fc": self.field_capacity,
+            "theta_wp": self.wilting_point,
+            "zr": self.root_depth,
+            "zr_factor": 1000,
+            "p": float(self.p),
+            "draintime": self.draintime,
+            "theta_init": InitialConditions(self).theta,
+            "mif": self.irrigation_optimizer,
+        }
 
     def run_swb_model(self):
-        return calculate_soil_water(
-            timeseries=self.timeseries,
-            theta_s=float(self.theta_s),
-            theta_fc=self.field_capacity,
-            theta_wp=self.wilting_point,
-            zr=self.root_depth,
-            zr_factor=1000,
-            p=float(self.p),
-            draintime=self.draintime,
-            theta_init=InitialConditions(self).theta,
-            mif=self.irrigation_optimizer,
-        )
+        # swb.calculate_soil_water() wants "fc" in actual_net_irrigation on the days
+        # the soil is to be brought to field capacity.
+        actual_net_irrigation = self.timeseries["actual_net_irrigation"]
+        self.timeseries["actual_net_irrigation"] = actual_net_irrigation.astype(
+            object
+        ).where(~self.timeseries["irrigate_to_fc"], "fc")
+        try:
+            return calculate_soil_water(
+                timeseries=self.timeseries, **self.get_swb_parameters()
+            )
+        finally:
+            self.timeseries["actual_net_irrigation"] = actual_net_irrigation
 
     def run_swb_model_normally(self):
         d = self.run_swb_model()
-        self.raw = d["raw"]
-        self.taw = d["taw"]
+        self._process_normal_run_results(d["raw"], d["taw"])
+
+    def _process_normal_run_results(self, raw, taw):
+        self.raw = raw
+        self.taw = taw
         self.timeseries["ifinal"] = (
             self.timeseries["recommended_net_irrigation"] / self.irrigation_efficiency
         )
@@ -151,64 +158,344 @@ class AgrifieldSWBMixin:
             self.timeseries["assumed_net_irrigation"] / self.irrigation_efficiency
         )
 
-    def _extract_columns_from_timeseries(self, *cols):
-        result = {}
-        for col in cols:
-            result[col] = self.timeseries[col].copy()
-        return result
+    # The columns of the run for the performance chart (see calculate_performance())
+    _performance_columns = (
+        "dr_theoretical",
+        "theta_theoretical",
+        "ks_theoretical",
+        "recommended_net_irrigation_theoretical",
+        "ifinal_theoretical",
+    )
 
-    def _import_columns_to_timeseries(self, saved_columns):
-        for col, value in saved_columns.items():
-            self.timeseries[col] = value
-
-    def _rename_result_columns_in_timeseries(self, suffix):
-        self.timeseries.rename(
-            columns={
-                "dr": "dr" + suffix,
-                "theta": "theta" + suffix,
-                "ks": "ks" + suffix,
-                "recommended_net_irrigation": "recommended_net_irrigation" + suffix,
+    def calculate_performance(self, results=None):
+        """Run the model for the performance chart and cache its results.
+
+        This run assumes that the field has been irrigated as recommended. Its
+        inputs are taken from results (by default self.results), so it doesn't read
+        any rasters. Returns a DataFrame with the index of the timeseries of results
+        and the columns in _performance_columns.
+
+        Only a few users look at the performance chart, so this run is not part of
+        execute_model(); it is made when first needed (see performance_results) and
+        cached until the results change.
+        """
+        timeseries = (results or self.results)["timeseries"]
+        run = calculate_soil_water_in_batch(
+            **self.get_swb_parameters(),
+            effective_precipitation=timeseries[["effective_precipitation"]].values,
+            crop_evapotranspiration=timeseries[["crop_evapotranspiration"]].values,
+            actual_net_irrigation=np.zeros((len(timeseries), 1)),
+            irrigate_as_recommended=True,
+        )
+        performance = pd.DataFrame(
+            {
+                name + "_theoretical": run[name][:, 0]
+                for name in ("dr", "theta", "ks", "recommended_net_irrigation")
             },
-            inplace=True,
+            index=timeseries.index,
         )
-
-    def run_swb_model_for_performance_chart(self):
-        saved_columns = self._extract_columns_from_timeseries(
-            "actual_net_irrigation", "dr", "theta", "ks", "recommended_net_irrigation"
+        performance["ifinal_theoretical"] = (
+            performance["recommended_net_irrigation_theoretical"]
+            / self.irrigation_efficiency
         )
+        cache.set(self._performance_cache_key, performance, None)
+        return performance
 
-        # We want the model to run ignoring the actual net irrigation, and instead
-        # assume that the actual irrigation equals recommended irrigation.
-        self.timeseries["actual_net_irrigation"] = "model"
+    def _get_stored_model_inputs(self, ncolumns):
+        """Return the inputs of the model, taken from the stored results.
 
-        self.run_swb_model()
-        self._rename_result_columns_in_timeseries(suffix="_theoretical")
-        self._import_columns_to_timeseries(saved_columns)
-        self.timeseries["ifinal_theoretical"] = self.timeseries.apply(
-            lambda x: (
-                x.recommended_net_irrigation_theoretical / self.irrigation_efficiency
+        The result is a tuple (index, kwargs), where kwargs are the arguments of
+        calculate_soil_water_in_batch() for ncolumns copies of the normal run.
+        """
+        timeseries = self.results["timeseries"]
+        actual_net_irrigation = timeseries["actual_net_irrigation"].values.astype(float)
+        if "irrigate_to_fc" in timeseries:
+            irrigate_to_fc = timeseries["irrigate_to_fc"].values.astype(bool)
+        else:
+            # Results stored when "fc" was a value of actual_net_irrigation
+            irrigate_to_fc = np.isnan(actual_net_irrigation)
+        kwargs = self.get_swb_parameters()
+        kwargs.update(
+            effective_precipitation=timeseries[["effective_precipitation"]].values,
+            crop_evapotranspiration=timeseries[["crop_evapotranspiration"]].values,
+            actual_net_irrigation=np.repeat(
+                np.nan_to_num(actual_net_irrigation)[:, np.newaxis], ncolumns, axis=1
             ),
-            axis=1,
+            irrigate_to_fc=irrigate_to_fc[:, np.newaxis],
+        )
+        return timeseries.index, kwargs
+
+    def evaluate_scenarios(self, scenarios):
+        """Run the model for hypothetical irrigation schedules.
+
+        scenarios is a list of schedules; each schedule is a dictionary mapping dates
+        to an amount of irrigation water (in mm, like applied_irrigation) that is
+        assumed to be applied on that date in addition to the logged irrigations.
+        All scenarios are calculated in a single batch run with the inputs of the
+        stored results, so nothing is read from the rasters or written to the
+        database. Returns a dictionary with "index" (the dates) and with "theta" and
+        "ks", which are arrays with one row per date and one column per scenario.
+        Raises ValueError if a date is outside the period of the results.
+        """
+        index, kwargs = self._get_stored_model_inputs(len(scenarios))
+        rows = dict(zip(index.date, range(len(index))))
+        for j, schedule in enumerate(scenarios):
+            for date, amount in schedule.items():
+                if date not in rows:
+                    raise ValueError(
+                        "{} is outside the period of the results".format(date)
+                    )
+                kwargs["actual_net_irrigation"][rows[date], j] += (
+                    amount * self.irrigation_efficiency
+                )
+        run = calculate_soil_water_in_batch(**kwargs)
+        return {"index": index, "theta": run["theta"], "ks": run["ks"]}
+
+    def sweep_irrigation_parameters(self, mifs, ps=None):
+        """Evaluate settings of the irrigation optimizer and max allowed depletion.
+
+        For each combination of an irrigation optimizer in mifs and a max allowed
+        depletion in ps (by default only the current one), the model is run
+        assuming that the field is irrigated as recommended, like the run for the
+        performance chart. All combinations are calculated in a single batch run with
+        the inputs of the stored results. Returns a list with a dictionary for each
+        combination, with "mif", "p", "water_use" (the total irrigation water, in
+        mm), "water_use_m3" and "stress_days" (the number of days with ks < 1).
+        """
+        if ps is None:
+            ps = [float(self.p)]
+        combinations = [(mif, p) for p in ps for mif in mifs]
+        index, kwargs = self._get_stored_model_inputs(len(combinations))
+        kwargs["mif"] = [mif for mif, p in combinations]
+        kwargs["p"] = [p for mif, p in combinations]
+        run = calculate_soil_water_in_batch(**kwargs, irrigate_as_recommended=True)
+        water_use = (
+            run["recommended_net_irrigation"].sum(axis=0) / self.irrigation_efficiency
         )
-        filter = self.timeseries["applied_irrigation"].isnull()
-        self.timeseries.loc[filter, "applied_irrigation"] = self.timeseries.loc[
-            filter, "ifinal_theoretical"
+        stress_days = (run["ks"] < 1).sum(axis=0)
+        return [
+            {
+                "mif": mif,
+                "p": p,
+                "water_use": float(water_use[j]),
+                "water_use_m3": float(water_use[j]) / 1000 * self.wetted_area,
+                "stress_days": int(stress_days[j]),
+            }
+            for j, (mif, p) in enumerate(combinations)
         ]
 
     def execute_model(self):
-        if not self.in_covered_area:
-            return
-        self.prepare_timeseries()
-        self.run_swb_model_normally()
-        self.run_swb_model_for_performance_chart()
+        """Run the model and store its results, which are also returned.
+
+        The results include the profile of the run (see the profiling module), which
+        is also logged.
+        """
+        with profiling.profiling() as profile:
+            if not self.in_covered_area:
+                return
+            self.prepare_timeseries()
+            with profiling.span("resume_from_checkpoint"):
+                resumed = self.resume_from_checkpoint()
+            with profiling.span("swb"):
+                if resumed:
+                    _run_swb_models_in_batch([self])
+                else:
+                    self.run_swb_model_normally()
+            with profiling.span("save_checkpoint"):
+                self.save_checkpoint()
+            result = self.store_results()
+        profiling.log_profile(profile, run="execute_model", agrifield_id=self.id)
+        return result
+
+    # The columns of self.timeseries that are not affected by the model runs
+    _model_input_columns = (
+        "ref_evapotranspiration",
+        "precipitation",
+        "effective_precipitation",
+        "kc",
+        "crop_evapotranspiration",
+        "actual_net_irrigation",
+        "irrigate_to_fc",
+        "applied_irrigation",
+    )
+
+    checkpoint_head = None
+
+    @property
+    def _checkpoint_cache_key(self):
+        return "model_checkpoint_{}".format(self.id)
+
+    def resume_from_checkpoint(self, historical_rasters_version=None):
+        """Skip the part of self.timeseries that has already been calculated.
+
+        This must be called after prepare_timeseries(). Each model run saves a
+        checkpoint with the results up to the historical end date (see
+        save_checkpoint()). If the inputs up to that date haven't changed since (i.e.
+        the parameters, irrigations and meteorological data are the same), the model
+        only needs to run for the days after it. In that case self.timeseries is
+        truncated to these days, the part up to the checkpoint (with the results) is
+        kept in self.checkpoint_head, and True is returned. The model runs should
+        then be made with _run_swb_models_in_batch(), which starts from the state of
+        the checkpoint.
+
+        historical_rasters_version is the result of get_historical_rasters_version();
+        when many agrifields are processed together, it should be calculated once
+        and passed to each of them.
+        """
+        self.checkpoint_head = None
+        self._checkpoint_fingerprint = self._get_inputs_fingerprint(
+            self.historical_end_date
+        )
+        self._checkpoint_refresh_key = self._get_refresh_key(
+            self.historical_end_date, historical_rasters_version
+        )
+        checkpoint = cache.get(self._checkpoint_cache_key)
+        if checkpoint is None:
+            return False
+        date = checkpoint["date"]
+        if date not in self.timeseries.index or date >= self.timeseries.index[-1]:
+            return False
+        if self._get_inputs_fingerprint(date) != checkpoint["fingerprint"]:
+            return False
+        head = self.timeseries.loc[:date].copy()
+        for column, values in checkpoint["results"].items():
+            head[column] = values
+        self.checkpoint_head = head
+        self.timeseries = self.timeseries.loc[self.timeseries.index > date].copy()
+        return True
+
+    def save_checkpoint(self):
+        """Save the results up to the historical end date for the next model run.
+
+        If the run has resumed from a checkpoint, the part of the timeseries up to it
+        is first put back in self.timeseries.
+        """
+        if self.checkpoint_head is not None:
+            self.timeseries = pd.concat((self.checkpoint_head, self.timeseries))
+            self.checkpoint_head = None
+        head = self.timeseries.loc[: self.historical_end_date]
+        input_columns = list(self._model_input_columns)
+        checkpoint = {
+            "date": self.historical_end_date,
+            "fingerprint": self._checkpoint_fingerprint,
+            "refresh_key": self._checkpoint_refresh_key,
+            "inputs": head[input_columns],
+            "results": head.drop(columns=input_columns),
+        }
+        cache.set(self._checkpoint_cache_key, checkpoint, None)
+
+    def _get_inputs_fingerprint(self, date):
+        inputs = self.timeseries.loc[
+            :date,
+            [
+                "effective_precipitation",
+                "crop_evapotranspiration",
+                "actual_net_irrigation",
+                "irrigate_to_fc",
+                "applied_irrigation",
+            ],
+        ]
+        parameters = sorted(self.get_swb_parameters().items())
+        fingerprint = repr(
+            (parameters, self.irrigation_efficiency, self.wetted_area, inputs.to_csv())
+        )
+        return hashlib.md5(fingerprint.encode()).hexdigest()
+
+    def _get_refresh_key(self, date, historical_rasters_version=None):
+        # Identifies everything the part of the run up to date depends on, without
+        # reading the meteorological data: the parameters, the crop coefficients,
+        # the daily irrigation totals and the historical rasters.
+        if historical_rasters_version is None:
+            historical_rasters_version = get_historical_rasters_version()
+        tz = pytz.timezone(settings.TIME_ZONE)
+        irrigations = self.appliedirrigation_set.filter(
+            timestamp__lte=tz.localize(date)
+        ).daily_totals(tz)
+        key = repr(
+            (
+                sorted(self.get_swb_parameters().items()),
+                self.irrigation_efficiency,
+                self.wetted_area,
+                InitialConditions(self).date,
+                self.most_recent_planting_date,
+                self.crop_type_id,
+                kc_curves.get_version(),
+                [(x["date"], x["volume"], x["nunknown"]) for x in irrigations],
+                historical_rasters_version,
+                date,
+                self._model_input_columns,
+            )
+        )
+        return hashlib.md5(key.encode()).hexdigest()
+
+    def get_refreshable_checkpoint(self, historical_rasters_version=None):
+        """Return the checkpoint if a forecast refresh can start from it, else None.
+
+        This is the case if nothing but the forecast rasters has changed since the
+        checkpoint was saved. historical_rasters_version is as in
+        resume_from_checkpoint().
+        """
+        checkpoint = cache.get(self._checkpoint_cache_key)
+        if checkpoint is None or "refresh_key" not in checkpoint:
+            return None
+        refresh_key = self._get_refresh_key(
+            checkpoint["date"], historical_rasters_version
+        )
+        if checkpoint["refresh_key"] != refresh_key:
+            return None
+        return checkpoint
+
+    def prepare_forecast_timeseries(self, checkpoint, meteo_forcing=None, column=0):
+        """Like prepare_timeseries(), but only for the days after the checkpoint.
+
+        checkpoint is the result of get_refreshable_checkpoint(), and meteo_forcing,
+        if specified, a ForecastForcing object for its date. The part of the run up
+        to the checkpoint (inputs and results) is put in self.checkpoint_head, as in
+        resume_from_checkpoint(), so that _run_swb_models_in_batch() continues from
+        it, and store_refreshed_results() then stores the whole run. Returns False if
+        there are no forecast data after the checkpoint.
+        """
+        if meteo_forcing is None:
+            meteo_forcing = ForecastForcing([self.location], checkpoint["date"])
+        self._meteo_forcing = (meteo_forcing, column)
+        self.timeseries = pd.DataFrame()
+        with profiling.span("determine_evaporation"):
+            self._determine_evaporation()
+        with profiling.span("determine_effective_precipitation"):
+            self._determine_effective_precipitation()
+        if self.timeseries.empty:
+            return False
+        head = pd.concat((checkpoint["inputs"], checkpoint["results"]), axis=1)
+        tail = self.timeseries
+        # kc depends on the days since the planting date, and swb only calculates
+        # it correctly for a timeseries that starts at the start of the season.
+        self.timeseries = pd.concat((head[tail.columns], tail))
+        with profiling.span("determine_crop_evapotranspiration"):
+            self._determine_crop_evapotranspiration()
+        self.timeseries = self.timeseries.loc[tail.index].copy()
+        with profiling.span("determine_irrigation"):
+            self._determine_irrigation()
+        self.checkpoint_head = head
+        return True
+
+    def store_refreshed_results(self):
+        self.timeseries = pd.concat((self.checkpoint_head, self.timeseries))
+        self.checkpoint_head = None
+        return self.store_results()
+
+    def store_results(self):
+        profile = profiling.get_current_profile()
         result = {
             "raw": self.raw,
             "taw": self.taw,
             "timeseries": self.timeseries,
             "historical_end_date": self.historical_end_date,
             "forecast_start_date": self.forecast_start_date,
+            "profile": profile.as_dict() if profile else None,
         }
-        cache.set("model_run_{}".format(self.id), result, None)
+        cache.set(self._results_cache_key, encode_model_results(result), None)
+        cache.delete(self._performance_cache_key)
+        self.forget_results()
         return result
 
 
@@ -217,35 +504,84 @@ class AgrifieldSWBResultsMixin:
 
     This class is to be mixed in models.Agrifield; it contains mostly properties
     accessing the results of the SWB model run. They are mostly useful in templates.
+
+    The results are read from the cache once per instance (and therefore normally
+    once per request), and the properties derived from them are also calculated
+    once; forget_results() makes them be read again.
     """
 
+    _memoized_results_properties = (
+        "results",
+        "needs_irrigation",
+        "alternative_irrigations",
+        "forecast_data",
+        "performance_results",
+    )
+
+    @property
+    def _results_cache_key(self):
+        return "model_run_{}".format(self.id)
+
     @property
+    def _performance_cache_key(self):
+        return "model_performance_{}".format(self.id)
+
+    def forget_results(self):
+        for name in self._memoized_results_properties:
+            self.__dict__.pop(name, None)
+
+    @cached_property
     def results(self):
         if self.in_covered_area:
-            return cache.get("model_run_{}".format(self.id))
+            return decode_model_results(cache.get(self._results_cache_key))
         else:
             return None
 
-    @property
+    @cached_property
+    def performance_results(self):
+        """The results, with those of the run for the performance chart added.
+
+        The timeseries also has the columns of calculate_performance(), and the
+        missing values of "applied_irrigation" (i.e. irrigations of unknown volume)
+        are filled in from "ifinal_theoretical". The run is made if it isn't cached.
+        """
+        if not self.results:
+            return None
+        timeseries = self.results["timeseries"]
+        performance = cache.get(self._performance_cache_key)
+        if performance is None or not performance.index.equals(timeseries.index):
+            performance = self.calculate_performance()
+        timeseries = timeseries.drop(
+            columns=list(self._performance_columns), errors="ignore"
+        ).join(performance)
+        missing = timeseries["applied_irrigation"].isnull()
+        timeseries.loc[missing, "applied_irrigation"] = timeseries.loc[
+            missing, "ifinal_theoretical"
+        ]
+        return {**self.results, "timeseries": timeseries}
+
+    @cached_property
     def needs_irrigation(self):
         if not self.results:
             return None
         forecast_start_date = self.results["forecast_start_date"]
         return self.results["timeseries"]["ifinal"][forecast_start_date:].sum() > 0
 
-    @property
+    @cached_property
     def alternative_irrigations(self):
         forecast_start_date = self.results["forecast_start_date"]
         timeseries = self.results["timeseries"]
         return timeseries.loc[timeseries["ifinal"] > 0][forecast_start_date:]
 
-    @property
+    @cached_property
     def forecast_data(self):
         forecast_start_date = self.results["forecast_start_date"]
-        timeseries = self.results["timeseries"]
-        if "theta" in timeseries:
-            timeseries["theta_actual"] = np.minimum(timeseries["theta"], self.theta_s)
-        return timeseries.loc[forecast_start_date:]
+        result = self.results["timeseries"].loc[forecast_start_date:]
+        if "theta" in result:
+            result = result.assign(
+                theta_actual=np.minimum(result["theta"], self.theta_s)
+            )
+        return result
 
     @property
     def last_irrigation_is_outdated(self):
@@ -258,6 +594,72 @@ class AgrifieldSWBResultsMixin:
             return True
 
 
+class MeteoForcing:
+    """The meteorological time series of many points, extracted from the rasters.
+
+    For each variable ("rain" or "evaporation"), the historical data since start_date
+    and the forecast data that follow them are read once for all the points from the
+    TimeseriesStore of the rasters. get(var) returns a tuple (index, values), where
+    values is an array with one row per date and one column per point. After get(var)
+    has been called, historical_end_date[var] and forecast_start_date[var] are also
+    available.
+    """
+
+    def __init__(self, points, start_date):
+        self.points = points
+        self.start_date = start_date
+        self.historical_end_date = {}
+        self.forecast_start_date = {}
+        self._data = {}
+
+    def get(self, var):
+        if var not in self._data:
+            self._data[var] = self._extract(var)
+        return self._data[var]
+
+    def _extract(self, var):
+        hindex, hvalues = self._extract_category("HISTORICAL", var)
+        findex, fvalues = self._extract_category("FORECAST", var)
+        self.historical_end_date[var] = hindex[-1]
+        is_forecast = findex > hindex[-1]
+        self.forecast_start_date[var] = findex[is_forecast][0]
+        return (
+            hindex.append(findex[is_forecast]),
+            np.concatenate((hvalues, fvalues[is_forecast])),
+        )
+
+    def _extract_category(self, category, var):
+        prefix = os.path.join(
+            getattr(settings, "AIRA_DATA_" + category), "daily_" + var
+        )
+        return TimeseriesStore(prefix).get(
+            self.points, start_date=self.start_date, default_time=dt.time(23, 59)
+        )
+
+
+class ForecastForcing(MeteoForcing):
+    """Like MeteoForcing, but only with the forecast data after historical_end_date.
+
+    The historical rasters are not read at all; historical_end_date (the date of a
+    model checkpoint) is taken as given.
+    """
+
+    def __init__(self, points, historical_end_date):
+        # TimeseriesStore compares start_date with the raster dates as datetimes.
+        start_date = pd.Timestamp(historical_end_date).normalize().to_pydatetime()
+        super().__init__(points, start_date)
+        self._historical_end_date = historical_end_date
+
+    def _extract(self, var):
+        findex, fvalues = self._extract_category("FORECAST", var)
+        is_forecast = findex > self._historical_end_date
+        self.historical_end_date[var] = self._historical_end_date
+        self.forecast_start_date[var] = (
+            findex[is_forecast][0] if is_forecast.any() else None
+        )
+        return findex[is_forecast], fvalues[is_forecast]
+
+
 class InitialConditions:
     """Helper class that determines initial conditions for swb.
 
@@ -299,18 +701,28 @@ class InitialConditions:
 
     @property
     def theta(self):
-        itrd = self._get_initial_theta_raster_date()
-        if itrd is not None and itrd > self._start_of_season:
+        if self.theta_raster_file is not None:
             return self._get_theta_init_from_raster()
         else:
             return self.agrifield.field_capacity
 
+    @property
+    def theta_raster_file(self):
+        """The theta-YYYY-MM-DD.tif file that provides the initial theta, or None.
+
+        It is None if the initial theta is the field capacity.
+        """
+        itrd = self._get_initial_theta_raster_date()
+        if itrd is not None and itrd > self._start_of_season:
+            return self._initial_theta_raster_file
+        return None
+
     def _get_theta_init_from_raster(self):
         if not self.agrifield.in_covered_area:
             return None
         else:
-            return extract_point_from_raster(
-                self.agrifield.location, gdal.Open(self._initial_theta_raster_file)
+            return raster_pool.extract_point(
+                self.agrifield.location, self._initial_theta_raster_file
             )
 
     @property
@@ -329,3 +741,305 @@ class InitialConditions:
             return True
         except iso8601.ParseError:
             return False
+
+
+def calculate_soil_water_in_batch(**kwargs):
+    model = BatchSoilWaterBalance(**kwargs)
+    model.calculate()
+    return model.results
+
+
+class BatchSoilWaterBalance:
+    """Runs the soil water balance for many columns at once.
+
+    This performs the same calculation as swb.SoilWaterBalance, but for many columns
+    (normally agrifields) simultaneously, advancing all of them one day at a time
+    with NumPy operations. The parameters (theta_s, theta_fc, theta_wp, zr, p,
+    draintime, theta_init, mif) are arrays with one item per column, or scalars that
+    apply to all columns. effective_precipitation, crop_evapotranspiration and
+    actual_net_irrigation are arrays with one row per day and one column per column.
+
+    Instead of the "fc" and "model" strings swb accepts in the actual net irrigation,
+    there are the boolean arrays irrigate_to_fc and irrigate_as_recommended, which
+    are broadcast to the shape of actual_net_irrigation.
+
+    The optional dr_init is the initial root zone depletion of each column; where
+    it is omitted or NaN, it is derived from theta_init.
+
+    After calculate(), "results" is a dictionary with "raw" and "taw" (one item per
+    column) and with "dr", "theta", "ks", "recommended_net_irrigation" and
+    "assumed_net_irrigation" (one row per day and one column per column).
+    """
+
+    def __init__(self, **kwargs):
+        for name in (
+            "theta_s",
+            "theta_fc",
+            "theta_wp",
+            "zr",
+            "p",
+            "draintime",
+            "theta_init",
+            "mif",
+        ):
+            setattr(self, name, np.asarray(kwargs[name], dtype=float))
+        self.dr_init = np.asarray(kwargs.get("dr_init", np.nan), dtype=float)
+        self.zr_factor = kwargs["zr_factor"]
+        self.effective_precipitation = np.asarray(kwargs["effective_precipitation"])
+        self.crop_evapotranspiration = np.asarray(kwargs["crop_evapotranspiration"])
+        self.actual_net_irrigation = np.asarray(kwargs["actual_net_irrigation"])
+        shape = self.actual_net_irrigation.shape
+        self.irrigate_to_fc = np.broadcast_to(
+            kwargs.get("irrigate_to_fc", False), shape
+        )
+        self.irrigate_as_recommended = np.broadcast_to(
+            kwargs.get("irrigate_as_recommended", False), shape
+        )
+
+        self.taw = (self.theta_fc - self.theta_wp) * self.zr * self.zr_factor
+        self.raw = self.p * self.taw
+
+    def calculate(self):
+        shape = self.actual_net_irrigation.shape
+        self.results = {"raw": self.raw, "taw": self.taw}
+        for name in (
+            "dr",
+            "theta",
+            "ks",
+            "recommended_net_irrigation",
+            "assumed_net_irrigation",
+        ):
+            self.results[name] = np.full(shape, np.nan)
+        theta_prev = np.broadcast_to(self.theta_init, shape[1:])
+        dr_prev = np.where(
+            np.isnan(self.dr_init), self.dr_from_theta(theta_prev), self.dr_init
+        )
+        dr_saturation = (self.theta_fc - self.theta_s) * self.zr * self.zr_factor
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for i in range(shape[0]):
+                dr_prev, theta_prev = self._calculate_day(
+                    i, dr_prev, theta_prev, dr_saturation
+                )
+
+    def _calculate_day(self, i, dr_prev, theta_prev, dr_saturation):
+        ks = self.ks(dr_prev)
+        effective_precipitation = self.effective_precipitation[i]
+        dr_without_irrig = (
+            dr_prev
+            - (effective_precipitation - self.ro(effective_precipitation, theta_prev))
+            + self.crop_evapotranspiration[i] * ks
+            + self.dp(theta_prev, effective_precipitation)
+        )
+        recommended_net_irrigation = np.where(
+            dr_without_irrig > self.raw, dr_without_irrig * self.mif, 0
+        )
+        irrigation_to_fc = np.where(
+            dr_without_irrig > 0,
+            dr_without_irrig,
+            np.where(
+                dr_without_irrig > dr_saturation, dr_without_irrig - dr_saturation, 0
+            ),
+        )
+        assumed_net_irrigation = np.where(
+            self.irrigate_as_recommended[i],
+            recommended_net_irrigation,
+            np.where(
+                self.irrigate_to_fc[i],
+                irrigation_to_fc,
+                self.actual_net_irrigation[i],
+            ),
+        )
+        dr = np.minimum(dr_without_irrig - assumed_net_irrigation, self.taw)
+        theta = self.theta_from_dr(dr)
+        self.results["dr"][i] = dr
+        self.results["theta"][i] = theta
+        self.results["ks"][i] = ks
+        self.results["recommended_net_irrigation"][i] = recommended_net_irrigation
+        self.results["assumed_net_irrigation"][i] = assumed_net_irrigation
+        return dr, theta
+
+    def dr_from_theta(self, theta):
+        return (self.theta_fc - theta) * self.zr * self.zr_factor
+
+    def theta_from_dr(self, dr):
+        return self.theta_fc - dr / (self.zr * self.zr_factor)
+
+    def ks(self, dr):
+        result = (self.taw - dr) / ((1 - self.p) * self.taw)
+        return np.minimum(result, 1)
+
+    def ro(self, effective_precipitation, theta_prev):
+        result = (
+            effective_precipitation
+            + (theta_prev - self.theta_s) * self.zr * self.zr_factor
+        )
+        return np.maximum(result, 0)
+
+    def dp(self, theta_prev, peff):
+        theta = np.minimum(theta_prev, self.theta_s)
+        theta_mm = theta * self.zr * self.zr_factor
+        theta_fc_mm = self.theta_fc * self.zr * self.zr_factor
+        excess_water = theta_mm - theta_fc_mm + peff
+        return np.maximum(excess_water, 0) / self.draintime
+
+
+def execute_model_in_batch(agrifields):
+    """Execute the model for many agrifields at once.
+
+    The meteorological data of all agrifields are read from the rasters at once, with
+    MeteoForcing, and the timeseries of each agrifield are prepared from them. Then
+    the model runs for all agrifields that have the same dates simultaneously, with
+    BatchSoilWaterBalance. The results are the same as those of execute_model() and
+    they are stored in the cache in the same way. Returns a dictionary mapping the
+    ids of the agrifields to their results.
+
+    The whole batch is profiled as one run; the results of each agrifield include
+    the profile of the batch up to the storing of the results.
+    """
+    with profiling.profiling() as profile:
+        agrifields = [f for f in agrifields if f.in_covered_area]
+        if not agrifields:
+            return {}
+        meteo_forcing = MeteoForcing(
+            [f.location for f in agrifields], InitialConditions(agrifields[0]).date
+        )
+        historical_rasters_version = get_historical_rasters_version()
+        groups = {}
+        for i, agrifield in enumerate(agrifields):
+            agrifield.prepare_timeseries(meteo_forcing, column=i)
+            with profiling.span("resume_from_checkpoint"):
+                agrifield.resume_from_checkpoint(historical_rasters_version)
+            groups.setdefault(tuple(agrifield.timeseries.index), []).append(agrifield)
+        with profiling.span("swb"):
+            for group in groups.values():
+                _run_swb_models_in_batch(group)
+        with profiling.span("save_checkpoint"):
+            for agrifield in agrifields:
+                agrifield.save_checkpoint()
+        result = {}
+        for agrifield in agrifields:
+            result[agrifield.id] = agrifield.store_results()
+    profiling.log_profile(
+        profile, run="execute_model_in_batch", agrifields=len(agrifields)
+    )
+    return result
+
+
+def refresh_forecasts_in_batch(agrifields):
+    """Recalculate the forecast part of the results of many agrifields.
+
+    This is for when only the forecast rasters have changed. For the agrifields
+    whose checkpoint is still valid (see get_refreshable_checkpoint()), only the
+    forecast rasters are read, at once with ForecastForcing, and the model runs only
+    for the forecast days, continuing from the state at the checkpoint; the new
+    results are spliced after the historical part of the checkpoint. The rest of the
+    agrifields are calculated with execute_model_in_batch(), which is profiled
+    separately. Returns a dictionary mapping the ids of the agrifields to their
+    results.
+    """
+    with profiling.profiling() as profile:
+        agrifields = [f for f in agrifields if f.in_covered_area]
+        checkpoints = {}
+        rest = []
+        with profiling.span("get_refreshable_checkpoint"):
+            historical_rasters_version = get_historical_rasters_version()
+            for agrifield in agrifields:
+                checkpoint = agrifield.get_refreshable_checkpoint(
+                    historical_rasters_version
+                )
+                if checkpoint is None:
+                    rest.append(agrifield)
+                else:
+                    checkpoints.setdefault(checkpoint["date"], []).append(
+                        (agrifield, checkpoint)
+                    )
+        result = {}
+        for date, items in checkpoints.items():
+            meteo_forcing = ForecastForcing([f.location for f, _ in items], date)
+            groups = {}
+            for i, (agrifield, checkpoint) in enumerate(items):
+                if agrifield.prepare_forecast_timeseries(checkpoint, meteo_forcing, i):
+                    index = tuple(agrifield.timeseries.index)
+                    groups.setdefault(index, []).append(agrifield)
+                else:
+                    rest.append(agrifield)
+            for group in groups.values():
+                with profiling.span("swb"):
+                    _run_swb_models_in_batch(group)
+                for agrifield in group:
+                    result[agrifield.id] = agrifield.store_refreshed_results()
+    profiling.log_profile(
+        profile, run="refresh_forecasts_in_batch", agrifields=len(result)
+    )
+    result.update(execute_model_in_batch(rest))
+    return result
+
+
+def get_historical_rasters_version():
+    """Return a digest that changes whenever the historical rasters change.
+
+    This is part of the key that determines whether a checkpoint can be used for a
+    forecast refresh (see AgrifieldSWBMixin.get_refreshable_checkpoint()). It
+    requires scanning the raster directories, so the functions that process many
+    agrifields calculate it once for all of them.
+    """
+    catalogs = [
+        TimeseriesStore(
+            os.path.join(settings.AIRA_DATA_HISTORICAL, "daily_" + var)
+        ).update()["rasters"]
+        for var in ("evaporation", "rain")
+    ]
+    return hashlib.md5(repr(catalogs).encode()).hexdigest()
+
+
+def _run_swb_models_in_batch(agrifields):
+    parameters = [f.get_swb_parameters() for f in agrifields]
+    kwargs = {name: [p[name] for p in parameters] for name in parameters[0].keys()}
+    kwargs["zr_factor"] = parameters[0]["zr_factor"]
+    kwargs["effective_precipitation"] = _stack_columns(
+        agrifields, "effective_precipitation"
+    )
+    kwargs["crop_evapotranspiration"] = _stack_columns(
+        agrifields, "crop_evapotranspiration"
+    )
+    kwargs["irrigate_to_fc"] = _stack_columns(agrifields, "irrigate_to_fc")
+    kwargs["actual_net_irrigation"] = _stack_columns(
+        agrifields, "actual_net_irrigation"
+    )
+
+    kwargs.update(_get_initial_state(agrifields, kwargs["theta_init"]))
+    normal = calculate_soil_water_in_batch(**kwargs)
+
+    result_columns = (
+        "dr",
+        "theta",
+        "ks",
+        "recommended_net_irrigation",
+        "assumed_net_irrigation",
+    )
+    for i, agrifield in enumerate(agrifields):
+        for name in result_columns:
+            agrifield.timeseries[name] = normal[name][:, i]
+        agrifield._process_normal_run_results(
+            float(normal["raw"][i]), float(normal["taw"][i])
+        )
+
+
+def _get_initial_state(agrifields, theta_init):
+    """Return the theta_init and dr_init of a batch run.
+
+    For agrifields that resume from a checkpoint, these are the theta and dr at the
+    end of the checkpoint; for the rest, theta_init is left as is and dr_init is NaN.
+    """
+    theta_init = list(theta_init)
+    dr_init = [np.nan] * len(agrifields)
+    for i, agrifield in enumerate(agrifields):
+        head = agrifield.checkpoint_head
+        if head is not None:
+            theta_init[i] = head["theta"].iloc[-1]
+            dr_init[i] = head["dr"].iloc[-1]
+    return {"theta_init": theta_init, "dr_init": dr_init}
+
+
+def _stack_columns(agrifields, column):
+    return np.column_stack([f.timeseries[column].values for f in agrifields])
@@ -0,0 +1,83 @@
+"""Priority lanes for the calculation of the model.
+
+Recalculations caused by a user's action (saving an agrifield or an irrigation) go
+to the INTERACTIVE lane, and mass recalculations (such as runswb) go to the BULK
+lane. Each lane is a separate Celery queue with the same name, so a worker that
+consumes only the interactive queue serves users even while thousands of bulk
+tasks are waiting.
+
+For each lane, counters in the cache record how many tasks are waiting (depth) and
+how long the tasks waited between being due and starting (latency).
+"""
+
+import time
+
+from django.core.cache import cache
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+
+
+def _key(lane, name):
+    return "calculation_lane_{}_{}".format(lane, name)
+
+
+def _incr(key, delta):
+    cache.add(key, 0, None)
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        # The key was evicted between add() and incr()
+        cache.set(key, delta, None)
+        return delta
+
+
+def get_dispatch_options(lane, countdown):
+    """Return the keyword arguments and options for dispatching a task to lane.
+
+    The result is a tuple (kwargs, options); kwargs must be passed to the task, and
+    options to apply_async() or to the signature. It also counts the task as
+    waiting in the lane.
+    """
+    _incr(_key(lane, "depth"), 1)
+    kwargs = {"lane": lane, "due": time.time() + countdown}
+    options = {"queue": lane, "countdown": countdown}
+    return kwargs, options
+
+
+def record_start(lane, due):
+    """Record that a task of lane that was due at the Unix timestamp due started."""
+    if lane not in LANES:
+        return
+    _incr(_key(lane, "depth"), -1)
+    latency = max(time.time() - due, 0) if due is not None else 0
+    _incr(_key(lane, "started"), 1)
+    _incr(_key(lane, "latency_ms"), int(latency * 1000))
+    cache.set(_key(lane, "last_latency_ms"), int(latency * 1000), None)
+
+
+def get_stats():
+    """Return a dictionary with the counters of each lane.
+
+    The keys are the lane names and the values are dictionaries with "depth" (the
+    number of tasks waiting), "started" (the number of tasks started), and
+    "mean_latency" and "last_latency" (in seconds).
+    """
+    keys = [
+        _key(lane, name)
+        for lane in LANES
+        for name in ("depth", "started", "latency_ms", "last_latency_ms")
+    ]
+    values = cache.get_many(keys)
+    result = {}
+    for lane in LANES:
+        started = values.get(_key(lane, "started"), 0)
+        total_latency = values.get(_key(lane, "latency_ms"), 0) / 1000
+        result[lane] = {
+            "depth": max(values.get(_key(lane, "depth"), 0), 0),
+            "started": started,
+            "mean_latency": total_latency / started if started else None,
+            "last_latency": values.get(_key(lane, "last_latency_ms"), 0) / 1000,
+        }
+    return result
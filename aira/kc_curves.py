@@ -0,0 +1,61 @@
+"""Cache of the daily crop coefficient (Kc) curves of the crop types.
+
+Thousands of agrifields share a few dozen crop types, and, for the same meteorological
+data, the same dates. get_kc() calculates the daily Kc of a crop type once for each
+planting date and time series index and keeps it in memory, so that the crop
+evapotranspiration of an agrifield is a single multiplication.
+
+The key of the cache includes a version token stored in the Django cache, which
+invalidate() replaces; the signal handlers in models call it whenever a crop type
+or its Kc stages change, so that all processes stop using their stale curves.
+"""
+
+import functools
+import uuid
+
+from django.core.cache import cache
+
+import numpy as np
+import pandas as pd
+from swb import calculate_crop_evapotranspiration
+
+VERSION_CACHE_KEY = "kc_curves_version"
+
+
+def get_version():
+    """Return the current version token of the curves."""
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        cache.add(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_CACHE_KEY)
+    return version
+
+
+def invalidate():
+    cache.set(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+    _get_kc.cache_clear()
+
+
+def get_kc(crop_type, planting_date, index):
+    """Return the Kc of crop_type for each item of index (a DatetimeIndex).
+
+    The result is a read-only array.
+    """
+    index_key = index.values.astype("datetime64[ns]").tobytes()
+    return _get_kc(crop_type, get_version(), planting_date, index_key)
+
+
+@functools.lru_cache(maxsize=1000)
+def _get_kc(crop_type, version, planting_date, index_key):
+    index = pd.DatetimeIndex(np.frombuffer(index_key, dtype="datetime64[ns]"))
+    timeseries = pd.DataFrame({"ref_evapotranspiration": 1.0}, index=index)
+    calculate_crop_evapotranspiration(
+        timeseries=timeseries,
+        planting_date=planting_date,
+        kc_offseason=crop_type.kc_offseason,
+        kc_plantingdate=crop_type.kc_plantingdate,
+        kc_stages=crop_type.kc_stages,
+    )
+    result = timeseries["kc"].values.astype(float)
+    result.setflags(write=False)
+    return result
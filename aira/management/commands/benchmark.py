@@ -0,0 +1,385 @@
+import datetime as dt
+import json
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.gis.geos import Point
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+
+import numpy as np
+from osgeo import osr
+
+from aira import models
+from aira.rasters import SOIL_RASTERS, RasterGrid, write_raster
+
+
+class Command(BaseCommand):
+    """Times the main operations of aira on synthetic data of realistic size.
+
+    The command generates, in a temporary directory, the daily rain and evaporation
+    rasters of a season (historical up to yesterday and forecast from today) and the
+    soil rasters, and, in the database, users with agrifields and irrigation logs.
+    It then times execute_model(), a full runswb, the agrifield list view, the
+    performance CSV and send_notifications, and writes the timings as JSON, so that
+    runs can be compared with --compare.
+
+    The data depend only on the options (including --seed). They are created in a
+    transaction that is rolled back at the end, and the settings that point to the
+    data directories, the cache and the email backend are overridden while the
+    benchmark runs, so the installation it runs in is not affected. However, runswb
+    and send_notifications also go through the agrifields and users that already
+    exist in the database, so the timings are comparable only between runs on
+    databases with the same contents (ideally empty); the number of the existing
+    agrifields is included in the results.
+    """
+
+    help = "Times the model, runswb, views and notifications on synthetic data"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fields", type=int, default=2000)
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument(
+            "--raster-size",
+            type=int,
+            default=500,
+            help="Number of rows and columns of the rasters",
+        )
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=None,
+            help="Number of historical days (default: since the start of the season)",
+        )
+        parser.add_argument("--forecast-days", type=int, default=5)
+        parser.add_argument(
+            "--irrigations",
+            type=int,
+            default=20,
+            help="Number of irrigations logged for each field",
+        )
+        parser.add_argument(
+            "--sample",
+            type=int,
+            default=20,
+            help="Number of times operations on a single field or user are timed",
+        )
+        parser.add_argument("--chunk-size", type=int, default=100)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument(
+            "--output",
+            default="aira-benchmark.json",
+            help="File to which the results are written as JSON",
+        )
+        parser.add_argument(
+            "--compare",
+            metavar="FILE",
+            help="Results of a previous run to compare with",
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = np.random.default_rng(options["seed"])
+        self.tempdir = tempfile.mkdtemp()
+        try:
+            with self._isolated_settings(), transaction.atomic():
+                timings = self._run()
+                transaction.set_rollback(True)
+                cache.clear()
+        finally:
+            shutil.rmtree(self.tempdir)
+        result = {
+            "time": dt.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "parameters": {
+                name: options[name]
+                for name in (
+                    "fields",
+                    "users",
+                    "raster_size",
+                    "days",
+                    "forecast_days",
+                    "irrigations",
+                    "sample",
+                    "chunk_size",
+                    "seed",
+                )
+            },
+            "existing_fields": self.existing_fields,
+            "timings": timings,
+            "execute_model_profile": self.execute_model_profile,
+        }
+        with open(options["output"], "w") as f:
+            json.dump(result, f, indent=2)
+        self._report(timings)
+
+    def _isolated_settings(self):
+        return override_settings(
+            AIRA_DATA_HISTORICAL=os.path.join(self.tempdir, "historical"),
+            AIRA_DATA_FORECAST=os.path.join(self.tempdir, "forecast"),
+            AIRA_DATA_SOIL=os.path.join(self.tempdir, "soil"),
+            AIRA_TIMESERIES_CACHE_DIR=os.path.join(self.tempdir, "timeseries_cache"),
+            CACHES={
+                "default": {
+                    "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                    "LOCATION": "aira-benchmark",
+                }
+            },
+            EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+            ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ["testserver"],
+        )
+
+    def _run(self):
+        self.existing_fields = models.Agrifield.objects.count()
+        timings = {}
+        timings["generate_data"] = self._time(self._generate_data)
+        self.stdout.write(f"Generated data in {timings['generate_data']:.1f} s")
+        timings.update(self._time_execute_model())
+        timings["runswb"] = self._time(
+            call_command,
+            "runswb",
+            workers=1,
+            chunk_size=self.options["chunk_size"],
+            stdout=StringIO(),
+        )
+        timings["agrifield_list_view"] = self._time_views(
+            self.users, self._get_agrifield_list_url
+        )
+        timings["performance_csv"] = self._time_views(
+            self.agrifields, self._get_performance_csv_url
+        )
+        models.Profile.objects.filter(user__in=self.users).update(notification="D")
+        timings["send_notifications"] = self._time(
+            call_command, "send_notifications", stdout=StringIO()
+        )
+        return timings
+
+    def _time(self, func, *args, **kwargs):
+        start_time = time.perf_counter()
+        func(*args, **kwargs)
+        return time.perf_counter() - start_time
+
+    def _generate_data(self):
+        self._generate_rasters()
+        self._generate_database()
+
+    def _generate_rasters(self):
+        size = self.options["raster_size"]
+        spatial_reference = osr.SpatialReference()
+        spatial_reference.ImportFromEPSG(4326)
+        self.grid = RasterGrid(
+            (20.5, 0.0025, 0, 39.5, 0, -0.0025),
+            spatial_reference.ExportToWkt(),
+            (size, size),
+        )
+        for subdir in ("historical", "forecast", "soil"):
+            os.mkdir(os.path.join(self.tempdir, subdir))
+        self._generate_soil_rasters()
+        today = dt.date.today()
+        dates = self._get_historical_dates(today)
+        if not dates:
+            raise CommandError("There must be at least one historical day")
+        for date in dates:
+            self._generate_meteo_rasters("historical", date)
+        for i in range(self.options["forecast_days"]):
+            self._generate_meteo_rasters("forecast", today + dt.timedelta(days=i))
+
+    def _get_historical_dates(self, today):
+        start_of_season = dt.date(today.year, 3, 15)
+        if start_of_season > today:
+            start_of_season = dt.date(today.year - 1, 3, 15)
+        ndays = (today - start_of_season).days
+        if self.options["days"] is not None:
+            ndays = min(ndays, self.options["days"])
+        return [today - dt.timedelta(days=i) for i in range(ndays, 0, -1)]
+
+    def _generate_soil_rasters(self):
+        shape = self.grid.size
+        field_capacity = self.rng.uniform(0.25, 0.40, shape)
+        values = {
+            "field_capacity": field_capacity,
+            "theta_s": field_capacity + self.rng.uniform(0.08, 0.15, shape),
+            "wilting_point": field_capacity - self.rng.uniform(0.10, 0.18, shape),
+            "draintime_a": self.rng.uniform(10, 60, shape),
+            "draintime_b": self.rng.uniform(0.8, 1.0, shape),
+        }
+        for name, filename in SOIL_RASTERS.items():
+            filename = os.path.join(self.tempdir, "soil", filename)
+            write_raster(filename, self.grid, values[name])
+
+    def _generate_meteo_rasters(self, subdir, date):
+        shape = self.grid.size
+        datestr = date.isoformat()
+        # Rain falls on about one day in six; evaporation follows the season.
+        rain = np.zeros(shape)
+        if self.rng.random() < 0.17:
+            rain = self.rng.gamma(0.8, 8, shape)
+        season_factor = np.sin(np.pi * (date.timetuple().tm_yday - 15) / 365)
+        evaporation = (1 + 6 * max(season_factor, 0)) * self.rng.uniform(
+            0.85, 1.15, shape
+        )
+        for var, values in (("rain", rain), ("evaporation", evaporation)):
+            filename = os.path.join(self.tempdir, subdir, f"daily_{var}-{datestr}.tif")
+            write_raster(filename, self.grid, values, timestamp=datestr)
+
+    def _generate_database(self):
+        crop_types = self._create_crop_types()
+        irrigation_types = [
+            models.IrrigationType.objects.create(name=name, efficiency=efficiency)
+            for name, efficiency in (("Drip", 0.9), ("Sprinkler", 0.75), ("Flood", 0.6))
+        ]
+        self.users = [
+            User.objects.create_user(
+                username=f"aira-benchmark-{i}",
+                email=f"aira-benchmark-{i}@example.com",
+            )
+            for i in range(self.options["users"])
+        ]
+        nfields = self.options["fields"]
+        (x0, dx, _, y0, _, dy) = self.grid.geotransform
+        nrows, ncols = self.grid.size
+        xs = self.rng.uniform(x0, x0 + dx * ncols, nfields)
+        ys = self.rng.uniform(y0 + dy * nrows, y0, nfields)
+        self.agrifields = models.Agrifield.objects.bulk_create(
+            [
+                models.Agrifield(
+                    owner=self.users[i % len(self.users)],
+                    name=f"Field {i}",
+                    location=Point(float(xs[i]), float(ys[i])),
+                    crop_type=crop_types[self.rng.integers(len(crop_types))],
+                    irrigation_type=irrigation_types[
+                        self.rng.integers(len(irrigation_types))
+                    ],
+                    wetted_area=int(self.rng.integers(1000, 20000)),
+                )
+                for i in range(nfields)
+            ],
+            batch_size=1000,
+        )
+        self._create_irrigations()
+
+    def _create_crop_types(self):
+        result = []
+        for i, (name, kc_stages) in enumerate(
+            (
+                ("Maize", ((20, 0.4), (35, 0.8), (40, 1.2), (30, 0.6))),
+                ("Cotton", ((30, 0.35), (50, 0.75), (55, 1.15), (45, 0.7))),
+                ("Tomato", ((30, 0.6), (40, 0.9), (40, 1.15), (25, 0.8))),
+                ("Alfalfa", ((10, 0.4), (30, 0.8), (25, 0.95), (10, 0.9))),
+                ("Olive", ((30, 0.65), (90, 0.7), (60, 0.7), (90, 0.7))),
+            )
+        ):
+            crop_type = models.CropType.objects.create(
+                name=name,
+                root_depth_max=1.2,
+                root_depth_min=0.3,
+                max_allowed_depletion=0.5,
+                kc_plantingdate=0.4,
+                kc_offseason=0.3,
+                planting_date=models.DayAndMonth(1 + 5 * i, 4),
+                fek_category=4,
+            )
+            models.CropTypeKcStage.objects.bulk_create(
+                [
+                    models.CropTypeKcStage(
+                        crop_type=crop_type, order=j + 1, ndays=ndays, kc_end=kc_end
+                    )
+                    for j, (ndays, kc_end) in enumerate(kc_stages)
+                ]
+            )
+            result.append(crop_type)
+        return result
+
+    def _create_irrigations(self):
+        dates = self._get_historical_dates(dt.date.today())
+        if not dates:
+            return
+        irrigations = []
+        for agrifield in self.agrifields:
+            for i in self.rng.integers(len(dates), size=self.options["irrigations"]):
+                # About one in twenty irrigations is logged without the volume.
+                volume = None
+                if self.rng.random() >= 0.05:
+                    volume = agrifield.wetted_area * self.rng.uniform(0.01, 0.04)
+                timestamp = dt.datetime.combine(
+                    dates[i], dt.time(int(self.rng.integers(5, 20))), dt.timezone.utc
+                )
+                irrigations.append(
+                    models.AppliedIrrigation(
+                        agrifield=agrifield,
+                        timestamp=timestamp,
+                        supplied_water_volume=volume,
+                    )
+                )
+        models.AppliedIrrigation.objects.bulk_create(irrigations, batch_size=5000)
+
+    def _time_execute_model(self):
+        # The first run also builds the cache of the rasters (see TimeseriesStore),
+        # so it is reported separately.
+        agrifields = self._get_sample(self.agrifields)
+        first = self._time(self._execute_model, agrifields[0])
+        durations = [self._time(self._execute_model, f) for f in agrifields]
+        # Remove the checkpoints, so that runswb calculates everything.
+        cache.delete_many([f._checkpoint_cache_key for f in agrifields])
+        return {
+            "execute_model_first": first,
+            "execute_model": statistics.mean(durations),
+        }
+
+    def _execute_model(self, agrifield):
+        agrifield = models.Agrifield.objects.get(id=agrifield.id)
+        results = agrifield.execute_model()
+        if results is None:
+            raise CommandError(f"Agrifield {agrifield.id} is not in the covered area")
+        self.execute_model_profile = results["profile"]
+
+    def _time_views(self, objects, get_url):
+        client = Client()
+        durations = []
+        for obj in self._get_sample(objects):
+            user, url = get_url(obj)
+            client.force_login(user)
+            start_time = time.perf_counter()
+            response = client.get(url)
+            durations.append(time.perf_counter() - start_time)
+            if response.status_code != 200:
+                raise CommandError(f"{url} returned {response.status_code}")
+        return statistics.mean(durations)
+
+    def _get_sample(self, objects):
+        size = max(self.options["sample"], 1)
+        return objects[:size]
+
+    def _get_agrifield_list_url(self, user):
+        return user, reverse("agrifield-list", kwargs={"username": user.username})
+
+    def _get_performance_csv_url(self, agrifield):
+        url = reverse(
+            "agrifield-irrigation-performance-download",
+            kwargs={"username": agrifield.owner.username, "pk": agrifield.id},
+        )
+        return agrifield.owner, url
+
+    def _report(self, timings):
+        previous = {}
+        if self.options["compare"]:
+            with open(self.options["compare"]) as f:
+                previous = json.load(f)["timings"]
+        for name, duration in timings.items():
+            line = f"{name}: {duration:.3f} s"
+            if previous.get(name):
+                line += " (was {:.3f} s, {:+.1f}%)".format(
+                    previous[name], 100 * (duration / previous[name] - 1)
+                )
+            self.stdout.write(line)
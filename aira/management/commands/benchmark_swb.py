@@ -0,0 +1,109 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+import numpy as np
+import pandas as pd
+from swb import calculate_soil_water
+
+from aira.agrifield import calculate_soil_water_in_batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the speed of running the soil water balance for each field "
+        "separately with that of running it for all fields in one batch"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fields", type=int, default=1000)
+        parser.add_argument("--days", type=int, default=200)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        self._create_synthetic_data(options["fields"], options["days"], options["seed"])
+        loop_duration, loop_results = self._time(self._run_loop)
+        batch_duration, batch_results = self._time(self._run_batch)
+        nfields = options["fields"]
+        self.stdout.write(
+            f"Per-field loop: {loop_duration:.3f} s "
+            f"({nfields / loop_duration:.1f} fields/s)"
+        )
+        self.stdout.write(
+            f"Batch: {batch_duration:.3f} s ({nfields / batch_duration:.1f} fields/s)"
+        )
+        self.stdout.write(f"Speedup: {loop_duration / batch_duration:.1f}x")
+        self.stdout.write(
+            "Maximum absolute difference: {:g}".format(
+                self._max_difference(loop_results, batch_results)
+            )
+        )
+
+    def _create_synthetic_data(self, nfields, ndays, seed):
+        rng = np.random.default_rng(seed)
+        shape = (ndays, nfields)
+        self.dates = pd.date_range("2020-03-15 23:59", periods=ndays, freq="D")
+        self.effective_precipitation = np.where(
+            rng.random(shape) < 0.2, rng.uniform(0, 20, shape), 0
+        )
+        self.crop_evapotranspiration = rng.uniform(1, 8, shape)
+        self.actual_net_irrigation = np.where(
+            rng.random(shape) < 0.05, rng.uniform(10, 60, shape), 0
+        )
+        self.irrigate_to_fc = rng.random(shape) < 0.01
+        theta_fc = rng.uniform(0.25, 0.40, nfields)
+        self.parameters = {
+            "theta_s": theta_fc + rng.uniform(0.08, 0.15, nfields),
+            "theta_fc": theta_fc,
+            "theta_wp": theta_fc - rng.uniform(0.10, 0.18, nfields),
+            "zr": rng.uniform(0.3, 1.5, nfields),
+            "p": rng.uniform(0.3, 0.7, nfields),
+            "draintime": rng.integers(10, 60, nfields).astype(float),
+            "theta_init": theta_fc,
+            "mif": rng.uniform(0.5, 1.0, nfields),
+        }
+
+    def _time(self, func):
+        start = time.perf_counter()
+        result = func()
+        return time.perf_counter() - start, result
+
+    def _run_loop(self):
+        nfields = self.actual_net_irrigation.shape[1]
+        result = np.empty((2,) + self.actual_net_irrigation.shape)
+        for i in range(nfields):
+            parameters = {k: float(v[i]) for k, v in self.parameters.items()}
+            actual_net_irrigation = self.actual_net_irrigation[:, i].astype(object)
+            actual_net_irrigation[self.irrigate_to_fc[:, i]] = "fc"
+            for j, irrigation in enumerate((actual_net_irrigation, "model")):
+                timeseries = pd.DataFrame(
+                    {
+                        "effective_precipitation": self.effective_precipitation[:, i],
+                        "crop_evapotranspiration": self.crop_evapotranspiration[:, i],
+                        "actual_net_irrigation": irrigation,
+                    },
+                    index=self.dates,
+                )
+                calculate_soil_water(
+                    timeseries=timeseries, zr_factor=1000, **parameters
+                )
+                result[j, :, i] = timeseries["theta"]
+        return result
+
+    def _run_batch(self):
+        result = np.empty((2,) + self.actual_net_irrigation.shape)
+        for j, irrigate_as_recommended in enumerate((False, True)):
+            d = calculate_soil_water_in_batch(
+                zr_factor=1000,
+                effective_precipitation=self.effective_precipitation,
+                crop_evapotranspiration=self.crop_evapotranspiration,
+                actual_net_irrigation=self.actual_net_irrigation,
+                irrigate_to_fc=self.irrigate_to_fc,
+                irrigate_as_recommended=irrigate_as_recommended,
+                **self.parameters,
+            )
+            result[j] = d["theta"]
+        return result
+
+    def _max_difference(self, a, b):
+        return float(np.nanmax(np.abs(a - b)))
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from aira.models import CropType
+from aira.swb_grid import SWBGrid
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the soil water balance with default parameters for every pixel of the "
+        "soil rasters and for each crop type, and writes the results as rasters"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--crop-type",
+            type=int,
+            nargs="*",
+            dest="crop_type_ids",
+            help="Ids of the crop types to calculate (default: all)",
+        )
+        parser.add_argument(
+            "--block-rows",
+            type=int,
+            default=256,
+            help="Number of rows of the grid calculated at a time",
+        )
+
+    def handle(self, *args, **options):
+        crop_types = CropType.objects.prefetch_related("croptypekcstage_set")
+        if options["crop_type_ids"]:
+            crop_types = crop_types.filter(id__in=options["crop_type_ids"])
+        swb_grid = SWBGrid(block_rows=max(options["block_rows"], 1))
+        for crop_type in crop_types:
+            start_time = time.monotonic()
+            npixels = swb_grid.write(crop_type)
+            self.stdout.write(
+                "{}: {} pixels, {} days, {:.1f} s".format(
+                    crop_type,
+                    npixels,
+                    len(swb_grid.index),
+                    time.monotonic() - start_time,
+                )
+            )
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from aira.calculation_lanes import get_stats
+
+
+class Command(BaseCommand):
+    help = "Shows the queue depth and latency of each calculation lane"
+
+    def handle(self, *args, **options):
+        for lane, stats in get_stats().items():
+            mean_latency = stats["mean_latency"]
+            self.stdout.write(
+                "{}: {} waiting, {} started, "
+                "mean latency {}, last latency {:.1f} s".format(
+                    lane,
+                    stats["depth"],
+                    stats["started"],
+                    "-" if mean_latency is None else "{:.1f} s".format(mean_latency),
+                    stats["last_latency"],
+                )
+            )
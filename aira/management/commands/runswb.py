@@ -1,11 +1,69 @@
+import multiprocessing
+import time
+
 from django.core.management.base import BaseCommand
+from django.db import connections
 
-from aira.models import Agrifield
+from aira.calculation_lanes import BULK
+from aira.models import Agrifield, queue_for_calculation
+from aira.tasks import calculate_agrifields, chunk_ids
 
 
 class Command(BaseCommand):
     help = "Initiates a recalculation of the model for all fields"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=0,
+            help=(
+                "Calculate the fields in a pool of that many local processes instead "
+                "of queueing them to Celery"
+            ),
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=100,
+            help="Number of fields calculated together by each worker",
+        )
+
     def handle(self, *args, **options):
-        for agrifield in Agrifield.objects.all():
-            agrifield._queue_for_calculation()
+        if options["workers"] <= 0:
+            queue_for_calculation(Agrifield.objects.all(), lane=BULK)
+            return
+        ids = list(Agrifield.objects.order_by("id").values_list("id", flat=True))
+        chunk_size = max(options["chunk_size"], 1)
+        chunks = chunk_ids(ids, chunk_size)
+        self._calculate(chunks, len(ids), options["workers"])
+
+    def _calculate(self, chunks, nfields, nworkers):
+        start_time = time.monotonic()
+        ndone = 0
+        for nchunk in self._map(calculate_chunk, chunks, nworkers):
+            ndone += nchunk
+            elapsed = time.monotonic() - start_time
+            self.stdout.write(
+                "Calculated {}/{} fields in {:.1f} s ({:.1f} fields/s)".format(
+                    ndone, nfields, elapsed, ndone / elapsed if elapsed else 0
+                )
+            )
+
+    def _map(self, func, chunks, nworkers):
+        if nworkers == 1:
+            yield from map(func, chunks)
+            return
+        # The database connections must not be shared with the forked workers.
+        connections.close_all()
+        with multiprocessing.Pool(nworkers, initializer=_init_worker) as pool:
+            yield from pool.imap_unordered(func, chunks)
+
+
+def _init_worker():
+    connections.close_all()
+
+
+def calculate_chunk(ids):
+    # A plain function, so that the pool can pickle it.
+    return calculate_agrifields(ids)
@@ -1,41 +1,122 @@
 import logging
+import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
 
 from django.conf import settings
-from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
-from django.core.mail import send_mail
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.core.management.base import BaseCommand
+from django.db import connections
 from django.template.loader import render_to_string
 from django.utils import translation
 from django.utils.translation import ugettext_lazy as _
 
-from aira.models import Profile, notification_options
+from aira.models import Agrifield, Profile, notification_options
+
+Notification = namedtuple("Notification", ("user", "owner", "language", "context"))
 
 
 class Command(BaseCommand):
+    """Emails irrigation recommendation notifications to users.
+
+    The command works as a pipeline. First, the profiles for which a notification is
+    due today are selected with a single query, and the agrifields of their users and
+    supervisees are fetched in bulk along with their cached results. Then the emails
+    are rendered in a pool of threads (rendering shouldn't need the database, since
+    everything it needs has been prefetched; any connection a thread opens is closed
+    anyway). Finally, the emails are sent in batches through a single connection to
+    the mail server.
+    """
+
     help = "Emails irrigation recommendation notifications to users."
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Render the notifications without sending them and report throughput",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Number of threads that render the notifications",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of messages sent at a time through the connection",
+        )
+
     def handle(self, *args, **options):
-        for user in User.objects.all():
-            if not self.must_send_notification(user):
-                continue
+        start_time = time.monotonic()
+        notifications = self.get_notifications(date.today())
+        with ThreadPoolExecutor(max_workers=max(options["workers"], 1)) as executor:
+            messages = list(executor.map(self.render_message_in_thread, notifications))
+        if options["dry_run"]:
+            self.report_throughput(len(messages), time.monotonic() - start_time)
+            return
+        self.send_messages(messages, options["batch_size"])
 
-            # Send notification for user's own agrifields
-            self.notify_user(user, user.agrifield_set.all(), user)
+    def get_notifications(self, today):
+        """Return the notifications that are due today, ready to be rendered."""
+        due_options = [
+            key
+            for key, (_label, is_due) in notification_options.items()
+            if is_due(today)
+        ]
+        due_profiles = list(
+            Profile.objects.filter(notification__in=due_options)
+            .select_related("user")
+            .order_by("user_id")
+        )
+        due_users = [profile.user for profile in due_profiles]
+        supervisees = defaultdict(list)
+        for profile in (
+            Profile.objects.filter(supervisor__in=due_users)
+            .select_related("user")
+            .order_by("user_id")
+        ):
+            supervisees[profile.supervisor_id].append(profile.user)
+        owner_ids = {user.id for user in due_users}
+        owner_ids.update(u.id for users in supervisees.values() for u in users)
+        agrifields = defaultdict(list)
+        for agrifield in Agrifield.objects.filter(
+            owner_id__in=owner_ids
+        ).with_cached_results():
+            agrifields[agrifield.owner_id].append(agrifield)
 
-            # If user is a supervisor, send an additional notification to him
-            # for each of the supervised users.
-            for supervisee in User.objects.filter(profile__supervisor=user):
-                self.notify_user(user, supervisee.agrifield_set.all(), supervisee)
+        site = Site.objects.get_current()
+        result = []
+        for profile in due_profiles:
+            user = profile.user
+            # Notification for the user's own agrifields, followed by one for each of
+            # the users they supervise.
+            for owner in [user] + supervisees[user.id]:
+                notification = self.get_notification(
+                    profile, agrifields[owner.id], owner, site
+                )
+                if notification is not None:
+                    result.append(notification)
+        return result
 
-    def must_send_notification(self, user):
-        try:
-            return notification_options[user.profile.notification][1](date.today())
-        except (Profile.DoesNotExist, KeyError):
-            return False
+    def get_notification(self, profile, agrifields, owner, site):
+        user = profile.user
+        agrifields = [f for f in agrifields if f.in_covered_area]
+        if not agrifields:
+            return None
+        logging.info(
+            "Notifying user {} about the agrifields of user {}".format(user, owner)
+        )
+        context = self.get_email_context(agrifields, user, owner, site)
+        if context is None:
+            return None
+        return Notification(user, owner, profile.email_language, context)
 
-    def get_email_context(self, agrifields, user, owner):
+    def get_email_context(self, agrifields, user, owner, site):
         context = {}
         if agrifields[0].results is None:
             logging.error(
@@ -47,31 +128,49 @@ class Command(BaseCommand):
             return None
         context["owner"] = owner
         context["agrifields"] = agrifields
-        context["site"] = Site.objects.get_current()
+        context["site"] = site
         context["user"] = user
         context["timestamp"] = datetime.now()
         context["header"] = settings.AIRA_EMAIL_HEADER
         context["footer"] = settings.AIRA_EMAIL_FOOTER
         return context
 
-    def notify_user(self, user, agrifields, owner):
-        agrifields = [f for f in agrifields if f.in_covered_area]
-        if not agrifields:
-            return
-        logging.info(
-            "Notifying user {} about the agrifields of user {}".format(user, owner)
-        )
-        translation.activate(user.profile.email_language)
-        context = self.get_email_context(agrifields, user, owner)
-        if context is None:
-            return
-        msg_html = render_to_string(
-            "aira/email_notification/email_notification.html", context
+    def render_message_in_thread(self, notification):
+        # Everything needed has been prefetched, but if a template does access the
+        # database, the worker thread gets its own connection, which Django would
+        # not close; so we close it here.
+        try:
+            return self.render_message(notification)
+        finally:
+            connections.close_all()
+
+    def render_message(self, notification):
+        # translation.override() is thread-local, so the workers don't interfere
+        # with one another.
+        with translation.override(notification.language):
+            msg_html = render_to_string(
+                "aira/email_notification/email_notification.html",
+                notification.context,
+            )
+            subject = str(
+                _("Irrigation status for user {}".format(str(notification.owner)))
+            )
+        message = EmailMultiAlternatives(
+            subject, "", settings.DEFAULT_FROM_EMAIL, [notification.user.email]
         )
-        send_mail(
-            _("Irrigation status for user {}".format(str(owner))),
-            "",
-            settings.DEFAULT_FROM_EMAIL,
-            [user.email],
-            html_message=msg_html,
+        message.attach_alternative(msg_html, "text/html")
+        return message
+
+    def send_messages(self, messages, batch_size):
+        batch_size = max(batch_size, 1)
+        with get_connection() as connection:
+            for start in range(0, len(messages), batch_size):
+                end = start + batch_size
+                connection.send_messages(messages[start:end])
+
+    def report_throughput(self, count, elapsed):
+        rate = count / elapsed if elapsed > 0 else float("inf")
+        self.stdout.write(
+            "Rendered {} notifications in {:.2f} s ({:.1f} notifications/s); "
+            "none sent (dry run)".format(count, elapsed, rate)
         )
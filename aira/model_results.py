@@ -0,0 +1,139 @@
+"""Compact binary format for the results of the soil water balance model.
+
+The results of a model run (see AgrifieldSWBMixin.store_results()) are a dictionary
+with "raw", "taw", "historical_end_date", "forecast_start_date", "profile" and
+"timeseries", the latter being a DataFrame. Pickling that DataFrame is slow and
+bulky, mostly because some of its columns have object dtype. Instead,
+encode_model_results() converts the results to bytes consisting of:
+
+  * The magic bytes b"AIRARES1".
+  * The length of the header, as a little-endian 32-bit unsigned integer.
+  * The header, which is JSON with the scalar results, the profile (see the
+    profiling module) and the column names, padded to a multiple of 8 bytes.
+  * The index of the timeseries, as int64 nanoseconds since the epoch.
+  * The other columns, as a float64 matrix with one row per column.
+  * The boolean columns, as a bool matrix with one row per column.
+
+Object columns are converted to float64; any non-numeric items (such as the "fc"
+marker in actual_net_irrigation) become NaN.
+
+decode_model_results() reverses this. The arrays are created with np.frombuffer(),
+so they don't copy the data, and the float64 matrix becomes the single block of the
+DataFrame.
+"""
+
+import json
+import struct
+
+import numpy as np
+import pandas as pd
+
+MAGIC = b"AIRARES1"
+_HEADER_LENGTH = struct.Struct("<I")
+_ALIGNMENT = 8
+
+
+def encode_model_results(results):
+    timeseries = results["timeseries"]
+    float_columns = [c for c in timeseries.columns if timeseries[c].dtype != bool]
+    bool_columns = [c for c in timeseries.columns if timeseries[c].dtype == bool]
+    index = timeseries.index.values.astype("datetime64[ns]").view(np.int64)
+    floats = np.empty((len(float_columns), len(timeseries)), dtype=np.float64)
+    for i, column in enumerate(float_columns):
+        floats[i] = pd.to_numeric(timeseries[column], errors="coerce")
+    bools = np.empty((len(bool_columns), len(timeseries)), dtype=bool)
+    for i, column in enumerate(bool_columns):
+        bools[i] = timeseries[column]
+
+    header = {
+        "raw": _to_json_float(results["raw"]),
+        "taw": _to_json_float(results["taw"]),
+        "historical_end_date": _to_json_timestamp(results["historical_end_date"]),
+        "forecast_start_date": _to_json_timestamp(results["forecast_start_date"]),
+        "profile": results.get("profile"),
+        "nrows": len(timeseries),
+        "float_columns": float_columns,
+        "bool_columns": bool_columns,
+    }
+    header_bytes = json.dumps(header).encode()
+    header_bytes += b" " * (-(len(MAGIC) + 4 + len(header_bytes)) % _ALIGNMENT)
+    return b"".join(
+        (
+            MAGIC,
+            _HEADER_LENGTH.pack(len(header_bytes)),
+            header_bytes,
+            index.tobytes(),
+            floats.tobytes(),
+            bools.tobytes(),
+        )
+    )
+
+
+def decode_model_results(data):
+    """Convert the output of encode_model_results() back to a results dictionary.
+
+    For compatibility with results stored in the cache before this format was
+    introduced, anything other than bytes (such as None or a dictionary) is returned
+    unchanged.
+    """
+    if not isinstance(data, bytes):
+        return data
+    header, index, floats, bools = decode_model_results_arrays(data)
+    timeseries = pd.DataFrame(
+        floats.T,
+        index=pd.DatetimeIndex(index.view("datetime64[ns]")),
+        columns=header["float_columns"],
+        copy=False,
+    )
+    for i, column in enumerate(header["bool_columns"]):
+        timeseries[column] = bools[i]
+    return {
+        "raw": header["raw"],
+        "taw": header["taw"],
+        "historical_end_date": _from_json_timestamp(header["historical_end_date"]),
+        "forecast_start_date": _from_json_timestamp(header["forecast_start_date"]),
+        "profile": header.get("profile"),
+        "timeseries": timeseries,
+    }
+
+
+def decode_model_results_arrays(data):
+    """Return the header and arrays of encoded results without creating a DataFrame.
+
+    The result is a tuple (header, index, floats, bools). index is the int64 index,
+    floats is a two-dimensional array with one row for each item of
+    header["float_columns"], and likewise for bools. The arrays are read-only and
+    share memory with data.
+    """
+    if not data.startswith(MAGIC):
+        raise ValueError("Not encoded model results")
+    (header_length,) = _HEADER_LENGTH.unpack_from(data, len(MAGIC))
+    header_offset = len(MAGIC) + _HEADER_LENGTH.size
+    offset = header_offset + header_length
+    header = json.loads(data[header_offset:offset])
+    nrows = header["nrows"]
+    index = np.frombuffer(data, dtype=np.int64, count=nrows, offset=offset)
+    offset += index.nbytes
+    nfloats = len(header["float_columns"])
+    floats = np.frombuffer(data, dtype=np.float64, count=nfloats * nrows, offset=offset)
+    offset += floats.nbytes
+    nbools = len(header["bool_columns"])
+    bools = np.frombuffer(data, dtype=bool, count=nbools * nrows, offset=offset)
+    return (
+        header,
+        index,
+        floats.reshape(nfloats, nrows),
+        bools.reshape(nbools, nrows),
+    )
+
+
+def _to_json_float(value):
+    return None if value is None else float(value)
+
+
+def _to_json_timestamp(value):
+    return None if value is None else pd.Timestamp(value).isoformat()
+
+
+def _from_json_timestamp(value):
+    return None if value is None else pd.Timestamp(value)
@@ -1,8 +1,9 @@
 import datetime as dt
-import math
+import hashlib
 import os
 import sys
-from collections import OrderedDict
+import tempfile
+from collections import OrderedDict, namedtuple
 from decimal import Decimal
 from glob import iglob
 from io import StringIO
@@ -15,17 +16,33 @@ from django.core.exceptions import ValidationError
 from django.core.files.storage import FileSystemStorage
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import IntegrityError
-from django.db.models import Q, UniqueConstraint
-from django.db.models.signals import post_save
+from django.db.models import (
+    Case,
+    Count,
+    F,
+    FloatField,
+    Q,
+    Sum,
+    UniqueConstraint,
+    Value,
+    When,
+)
+from django.db.models.functions import Cast, TruncDate
+from django.db.models.query import ModelIterable
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.urls import reverse
 from django.utils.translation import ugettext_lazy as _
 
+import pandas as pd
 import swb
-from hspatial import PointTimeseries, extract_point_from_raster
-from osgeo import gdal
+from htimeseries import HTimeseries
 
+from . import calculation_lanes, kc_curves, profiling
 from .agrifield import AgrifieldSWBMixin, AgrifieldSWBResultsMixin
+from .model_results import decode_model_results
+from .rasters import extract_soil_point, get_soil_rasters_version
+from .timeseries_store import TimeseriesStore
 
 # notification_options is the list of options the user can select for
 # notifications, e.g. be notified every day, every two days, every week, and so
@@ -51,8 +68,25 @@ notification_options = OrderedDict(
 
 YES_OR_NO = ((True, _("Yes")), (False, _("No")))
 
+DEFAULT_IRRIGATION_OPTIMIZER = 0.5
+
 EMAIL_LANGUAGE_CHOICES = (("en", "English"), ("el", "Ελληνικά"))
 
+SoilParameters = namedtuple(
+    "SoilParameters",
+    (
+        "in_covered_area",
+        "default_field_capacity",
+        "default_theta_s",
+        "default_wilting_point",
+        "field_capacity",
+        "theta_s",
+        "wilting_point",
+        "draintime_a",
+        "draintime_b",
+    ),
+)
+
 
 class DayAndMonth:
     _month_days = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
@@ -175,6 +209,15 @@ def create__or_update_user_profile(sender, instance, created, **kwargs):
         instance.profile.save()
 
 
+def get_most_recent_date(day_and_month):
+    """Return the most recent date (today or earlier) with the given day and month."""
+    today = dt.date.today()
+    result = today.replace(month=day_and_month.month, day=day_and_month.day)
+    if result <= today:
+        return result
+    return result.replace(year=today.year - 1)
+
+
 class CropType(models.Model):
     name = models.CharField(max_length=100)
     custom = models.BooleanField(
@@ -234,6 +277,12 @@ class CropTypeKcStage(KcStage):
     crop_type = models.ForeignKey(CropType, on_delete=models.CASCADE)
 
 
+@receiver([post_save, post_delete], sender=CropType)
+@receiver([post_save, post_delete], sender=CropTypeKcStage)
+def invalidate_kc_curves(sender, **kwargs):
+    kc_curves.invalidate()
+
+
 class IrrigationType(models.Model):
     name = models.CharField(max_length=100)
     efficiency = models.FloatField()
@@ -255,6 +304,113 @@ class SoilAnalysisStorage(FileSystemStorage):
         )
 
 
+def prefetch_cached_results(agrifields):
+    """Fetch the cached data of many agrifields with a single cache access.
+
+    The soil parameters, model results and status of the agrifields are fetched with
+    one cache.get_many() and attached to the instances, so that Agrifield.soil,
+    Agrifield.results (and the properties derived from it) and Agrifield.status
+    don't need to access the cache again. Soil parameters that are not in the cache
+    are calculated and cached. The soil rasters are stat()ed only once for all the
+    agrifields.
+    """
+    agrifields = list(agrifields)
+    soil_rasters_version = get_soil_rasters_version()
+    soil_keys = [f._get_soil_cache_key(soil_rasters_version) for f in agrifields]
+    keys = soil_keys.copy()
+    for agrifield in agrifields:
+        keys.append(agrifield._results_cache_key)
+        keys.append(agrifield._status_cache_key)
+    values = cache.get_many(keys)
+    for agrifield, soil_key in zip(agrifields, soil_keys):
+        soil = agrifield._get_soil(soil_key, values.get(soil_key))
+        agrifield._prefetched_status = values.get(agrifield._status_cache_key)
+        agrifield.forget_results()
+        if soil.in_covered_area:
+            agrifield.results = decode_model_results(
+                values.get(agrifield._results_cache_key)
+            )
+        else:
+            agrifield.results = None
+
+
+# How long the "scheduled" marker of an agrifield may outlive the debounce window
+# before it expires. It normally lasts until the task starts; the expiry only
+# matters if the task is lost, in which case the next change schedules a new one.
+SCHEDULED_MARKER_GRACE_PERIOD = 3600
+
+
+def queue_for_calculation(agrifields, lane=calculation_lanes.INTERACTIVE):
+    """Schedule the recalculation of the model for the specified agrifields.
+
+    Recalculation is debounced and coalesced. The first change to an agrifield
+    atomically sets a "scheduled" marker in the cache (with cache.add()) and
+    dispatches a task that starts AIRA_RECALCULATION_DEBOUNCE seconds later; further
+    changes before the task starts find the marker and dispatch nothing. The task
+    removes the marker before it loads the agrifield from the database, so any
+    change it might miss schedules another run. The agrifields that need a new task
+    are dispatched in chunks with tasks.calculate_agrifields_in_chunks() if they are
+    more than one. The tasks receive agrifield ids, not model instances.
+
+    The tasks go to the specified lane (see calculation_lanes); changes made by
+    users use the default, INTERACTIVE, so that they don't wait behind mass
+    recalculations, which should use BULK.
+    """
+    from aira import tasks
+
+    statuses = {}
+    newly_scheduled = []
+    debounce = settings.AIRA_RECALCULATION_DEBOUNCE
+    for agrifield in agrifields:
+        agrifield.__dict__.pop("_prefetched_status", None)
+        if not agrifield.in_covered_area:
+            statuses[agrifield._status_cache_key] = "done"
+            continue
+        statuses[agrifield._status_cache_key] = "queued"
+        marker_timeout = debounce + SCHEDULED_MARKER_GRACE_PERIOD
+        if cache.add(agrifield._scheduled_cache_key, True, marker_timeout):
+            newly_scheduled.append(agrifield)
+    cache.set_many(statuses, None)
+    ids = [agrifield.id for agrifield in newly_scheduled]
+    if len(ids) == 1:
+        kwargs, options = calculation_lanes.get_dispatch_options(lane, debounce)
+        tasks.calculate_agrifield.apply_async(ids, kwargs, **options)
+    elif ids:
+        tasks.calculate_agrifields_in_chunks(ids, countdown=debounce, lane=lane)
+
+
+class AgrifieldQuerySet(models.QuerySet):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._with_cached_results = False
+        self._cached_results_done = False
+
+    def with_cached_results(self):
+        """Make the agrifields be fetched with prefetch_cached_results().
+
+        The crop types are fetched in the same query, since the pages that show
+        the results also show the root depth and other crop parameters.
+        """
+        clone = self.select_related("crop_type")
+        clone._with_cached_results = True
+        return clone
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._with_cached_results = self._with_cached_results
+        return clone
+
+    def _fetch_all(self):
+        super()._fetch_all()
+        if (
+            self._with_cached_results
+            and not self._cached_results_done
+            and self._iterable_class is ModelIterable
+        ):
+            prefetch_cached_results(self._result_cache)
+            self._cached_results_done = True
+
+
 class Agrifield(models.Model, AgrifieldSWBMixin, AgrifieldSWBResultsMixin):
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     name = models.CharField(max_length=255)
@@ -352,56 +508,117 @@ class Agrifield(models.Model, AgrifieldSWBMixin, AgrifieldSWBResultsMixin):
         default=False,
     )
 
+    objects = AgrifieldQuerySet.as_manager()
+
     @property
-    def wilting_point(self):
-        if self.use_custom_parameters and self.custom_wilting_point:
-            return self.custom_wilting_point
+    def soil(self):
+        """The soil parameters of the agrifield, as a SoilParameters named tuple.
+
+        All soil rasters are read in one pass. The result is cached, both in the
+        instance and in the Django cache, under a key that changes whenever the
+        location, the soil rasters or the custom parameters change.
+        """
+        return self._get_soil(self._get_soil_cache_key())
+
+    def _get_soil(self, cache_key, soil=None):
+        memo = getattr(self, "_soil_memo", None)
+        if memo is not None and memo[0] == cache_key:
+            return memo[1]
+        if soil is None:
+            soil = cache.get(cache_key)
+        if soil is None:
+            with profiling.span("read_soil_rasters"):
+                soil = self._get_soil_parameters()
+            cache.set(cache_key, soil, None)
+        self._soil_memo = (cache_key, soil)
+        return soil
+
+    def _get_soil_cache_key(self, soil_rasters_version=None):
+        # When many agrifields are processed together, the caller can find the
+        # rasters version once and specify it, instead of having the files stat()ed
+        # for each agrifield.
+        if soil_rasters_version is None:
+            soil_rasters_version = get_soil_rasters_version()
+        key_items = (
+            self.location.ewkt,
+            settings.AIRA_DATA_SOIL,
+            soil_rasters_version,
+            self.use_custom_parameters,
+            self.custom_field_capacity,
+            self.custom_thetaS,
+            self.custom_wilting_point,
+        )
+        return "soil_" + hashlib.md5(repr(key_items).encode()).hexdigest()
+
+    def _get_soil_parameters(self):
+        values = extract_soil_point(self.location)
+        if values is None:
+            return SoilParameters(
+                in_covered_area=False,
+                default_field_capacity=None,
+                default_theta_s=None,
+                default_wilting_point=None,
+                field_capacity=self._get_custom_parameter("field_capacity"),
+                theta_s=self._get_custom_parameter("thetaS"),
+                wilting_point=self._get_custom_parameter("wilting_point"),
+                draintime_a=None,
+                draintime_b=None,
+            )
+        return SoilParameters(
+            in_covered_area=True,
+            default_field_capacity=values["field_capacity"],
+            default_theta_s=values["theta_s"],
+            default_wilting_point=values["wilting_point"],
+            field_capacity=self._get_custom_parameter(
+                "field_capacity", values["field_capacity"]
+            ),
+            theta_s=self._get_custom_parameter("thetaS", values["theta_s"]),
+            wilting_point=self._get_custom_parameter(
+                "wilting_point", values["wilting_point"]
+            ),
+            draintime_a=values["draintime_a"],
+            draintime_b=values["draintime_b"],
+        )
+
+    def _get_custom_parameter(self, name, default=None):
+        custom_value = getattr(self, "custom_" + name)
+        if self.use_custom_parameters and custom_value:
+            return custom_value
         else:
-            return self.default_wilting_point
+            return default
+
+    @property
+    def wilting_point(self):
+        return self.soil.wilting_point
 
     @property
     def default_wilting_point(self):
         if not self.in_covered_area:
             return None
         else:
-            return extract_point_from_raster(
-                self.location,
-                gdal.Open(os.path.join(settings.AIRA_DATA_SOIL, "pwp.tif")),
-            )
+            return self.soil.default_wilting_point
 
     @property
     def theta_s(self):
-        if self.use_custom_parameters and self.custom_thetaS:
-            return self.custom_thetaS
-        else:
-            return self.default_theta_s
+        return self.soil.theta_s
 
     @property
     def default_theta_s(self):
         if not self.in_covered_area:
             return None
         else:
-            return extract_point_from_raster(
-                self.location,
-                gdal.Open(os.path.join(settings.AIRA_DATA_SOIL, "theta_s.tif")),
-            )
+            return self.soil.default_theta_s
 
     @property
     def field_capacity(self):
-        if self.use_custom_parameters and self.custom_field_capacity:
-            return self.custom_field_capacity
-        else:
-            return self.default_field_capacity
+        return self.soil.field_capacity
 
     @property
     def default_field_capacity(self):
         if not self.in_covered_area:
             return None
         else:
-            return extract_point_from_raster(
-                self.location,
-                gdal.Open(os.path.join(settings.AIRA_DATA_SOIL, "fc.tif")),
-            )
+            return self.soil.default_field_capacity
 
     @property
     def irrigation_efficiency(self):
@@ -440,7 +657,7 @@ class Agrifield(models.Model, AgrifieldSWBMixin, AgrifieldSWBResultsMixin):
         if self.use_custom_parameters and self.custom_irrigation_optimizer:
             return self.custom_irrigation_optimizer
         else:
-            return 0.5
+            return DEFAULT_IRRIGATION_OPTIMIZER
 
     @property
     def last_irrigation(self):
@@ -465,43 +682,44 @@ class Agrifield(models.Model, AgrifieldSWBMixin, AgrifieldSWBResultsMixin):
         self._delete_cached_point_timeseries()
 
     def _queue_for_calculation(self):
-        from aira import tasks
-
-        cache_key = f"agrifield_{self.id}_status"
-        if not self.in_covered_area:
-            cache.set(cache_key, "done", None)
-            return
+        queue_for_calculation([self])
 
-        # If the agrifield is already in the Celery queue for calculation,
-        # return without doing anything.
-        if cache.get(cache_key) == "queued":
-            return
+    @property
+    def _status_cache_key(self):
+        return "agrifield_{}_status".format(self.id)
 
-        tasks.calculate_agrifield.delay(self)
-        cache.set(cache_key, "queued", None)
+    @property
+    def _scheduled_cache_key(self):
+        return "agrifield_{}_scheduled".format(self.id)
 
     @property
     def status(self):
-        return cache.get("agrifield_{}_status".format(self.id))
+        if "_prefetched_status" in self.__dict__:
+            return self._prefetched_status
+        return cache.get(self._status_cache_key)
 
     @property
     def in_covered_area(self):
-        mask = os.path.join(settings.AIRA_DATA_SOIL, "fc.tif")
-        try:
-            tmp_check = extract_point_from_raster(self.location, gdal.Open(mask))
-        except (RuntimeError, ValueError):
-            tmp_check = float("nan")
-        return not math.isnan(tmp_check)
+        return self.soil.in_covered_area
 
     def get_point_timeseries(self, variable):
-        prefix = os.path.join(settings.AIRA_DATA_HISTORICAL, "daily_" + variable)
+        store = TimeseriesStore(
+            os.path.join(settings.AIRA_DATA_HISTORICAL, "daily_" + variable)
+        )
+        series = store.get_series(self.location, default_time=dt.time(23, 59))
+        timeseries = HTimeseries(pd.DataFrame({"value": series, "flags": ""}))
+        timeseries.unit = store.unit
         dest = os.path.join(
             settings.AIRA_TIMESERIES_CACHE_DIR,
             "agrifield{}-{}.hts".format(self.id, variable),
         )
-        PointTimeseries(
-            point=self.location, prefix=prefix, default_time=dt.time(23, 59)
-        ).get_cached(dest, version=2)
+        # Concurrent downloads may be reading dest, so the file is written under
+        # another name and then atomically replaces it.
+        with tempfile.NamedTemporaryFile(
+            "w", newline="", dir=settings.AIRA_TIMESERIES_CACHE_DIR, delete=False
+        ) as f:
+            timeseries.write(f, format=HTimeseries.FILE, version=2)
+        os.replace(f.name, dest)
         return dest
 
     def _delete_cached_point_timeseries(self):
@@ -599,19 +817,60 @@ class Agrifield(models.Model, AgrifieldSWBMixin, AgrifieldSWBResultsMixin):
 
     @property
     def most_recent_planting_date(self):
-        today = dt.date.today()
-        result = today.replace(
-            month=self.planting_date.month, day=self.planting_date.day
-        )
-        if result <= today:
-            return result
-        return result.replace(year=today.year - 1)
+        return get_most_recent_date(self.planting_date)
 
 
 class AgrifieldCustomKcStage(KcStage):
     agrifield = models.ForeignKey(Agrifield, on_delete=models.CASCADE)
 
 
+class AppliedIrrigationQuerySet(models.QuerySet):
+    def with_volume(self):
+        """Annotate each irrigation with "irrigation_volume", calculated in SQL.
+
+        This is the same as the volume property; it is null if the volume is
+        unknown.
+        """
+        return self.annotate(
+            irrigation_volume=Case(
+                When(
+                    irrigation_type="VOLUME_OF_WATER", then=F("supplied_water_volume")
+                ),
+                When(
+                    irrigation_type="DURATION_OF_IRRIGATION",
+                    then=Cast("supplied_duration", FloatField())
+                    / Value(60.0)
+                    * F("supplied_flow_rate"),
+                ),
+                When(
+                    irrigation_type="FLOWMETER_READINGS",
+                    then=(F("flowmeter_reading_end") - F("flowmeter_reading_start"))
+                    * (Value(100.0) / Cast("flowmeter_water_percentage", FloatField())),
+                ),
+                output_field=FloatField(),
+            )
+        )
+
+    def daily_totals(self, tz):
+        """Return the irrigations aggregated by day in a single query.
+
+        The result is an iterable of dictionaries, one per day, in chronological
+        order, with "date" (the date of the timestamps in timezone tz), "volume" (the
+        sum of the known volumes) and "nunknown" (the number of irrigations of
+        unknown volume).
+        """
+        return (
+            self.with_volume()
+            .annotate(date=TruncDate("timestamp", tzinfo=tz))
+            .values("date")
+            .annotate(
+                volume=Sum("irrigation_volume"),
+                nunknown=Count("id", filter=Q(irrigation_volume__isnull=True)),
+            )
+            .order_by("date")
+        )
+
+
 class AppliedIrrigation(models.Model):
     IRRIGATION_TYPES = [
         ("VOLUME_OF_WATER", _("Volume of water")),
@@ -656,6 +915,8 @@ class AppliedIrrigation(models.Model):
         default=100,
     )
 
+    objects = AppliedIrrigationQuerySet.as_manager()
+
     @property
     def volume(self):
         if self.irrigation_type == "VOLUME_OF_WATER":
@@ -0,0 +1,98 @@
+"""Timing of the stages of the model calculation.
+
+While a profiling() block is active, span(name) blocks add the time they take to
+the span with that name, and count(name) increments a counter. The code that
+opens raster files counts them under "rasters_opened", and the database queries
+are counted under "db_queries". Outside a profiling() block, span() and count()
+do nothing, so the instrumented code costs practically nothing when it isn't
+being profiled.
+
+The profile of a model run (Profile.as_dict()) is stored with its results (see
+AgrifieldSWBMixin.store_results()) and logged as a line of JSON to the
+"aira.profiling" logger, so that it can be collected by whatever collects the logs.
+"""
+
+import contextvars
+import functools
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+_current_profile = contextvars.ContextVar("aira_profile", default=None)
+
+
+class Profile:
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.spans = {}
+        self.counters = {}
+
+    def add_time(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0) + seconds
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def as_dict(self):
+        """Return the profile as a dictionary that can be converted to JSON.
+
+        It has "total" (the time since the start of the profile), "spans" (the
+        total time of each span) and "counters"; times are in seconds. Spans may
+        be nested, so their times don't add up to the total.
+        """
+        return {
+            "total": round(time.perf_counter() - self.start_time, 6),
+            "spans": {name: round(t, 6) for name, t in self.spans.items()},
+            "counters": dict(self.counters),
+        }
+
+
+def get_current_profile():
+    """Return the Profile of the active profiling() block, or None."""
+    return _current_profile.get()
+
+
+@contextmanager
+def profiling():
+    """Profile the enclosed code; the block gets the Profile object."""
+    profile = Profile()
+    token = _current_profile.set(profile)
+    try:
+        with connection.execute_wrapper(functools.partial(_count_query, profile)):
+            yield profile
+    finally:
+        _current_profile.reset(token)
+
+
+def _count_query(profile, execute, sql, params, many, context):
+    profile.count("db_queries")
+    return execute(sql, params, many, context)
+
+
+@contextmanager
+def span(name):
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_time(name, time.perf_counter() - start_time)
+
+
+def count(name, n=1):
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.count(name, n)
+
+
+def log_profile(profile, **context):
+    """Log profile as JSON, together with the items of context."""
+    logger.info(json.dumps({**context, **profile.as_dict()}, sort_keys=True))
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+
+from django.conf import settings
+
+import numpy as np
+
+from .models import Agrifield
+from .rasters import get_dated_raster_filenames, get_file_version
+from .timeseries_store import TimeseriesStore
+
+MODEL_VARIABLES = ("rain", "evaporation")
+
+
+class RasterWatcher:
+    """Finds the agrifields affected by new, replaced or removed meteorological rasters.
+
+    The watcher keeps a catalog of the rasters used by the model (i.e. the "rain" and
+    "evaporation" rasters of AIRA_DATA_HISTORICAL and AIRA_DATA_FORECAST), with the
+    version (see rasters.get_file_version()) and the checksum of each one, in
+    "raster_catalog.json" in AIRA_TIMESERIES_CACHE_DIR. find_affected_agrifields()
+    compares the rasters on disk with the catalog:
+
+      * If a raster has been added or removed, all agrifields are affected.
+      * If a raster has been replaced with one that has different contents, only
+        the agrifields in the pixels whose values have changed are affected; these
+        are found by comparing the new raster with the values of the old one in its
+        TimeseriesStore (which keeps them even if it has been updated since). If
+        that isn't possible (e.g. the raster has been replaced twice), all
+        agrifields are affected.
+      * Rasters whose modification time has changed but whose checksum hasn't (e.g.
+        because they have been copied again) don't affect anything.
+
+    After find_affected_agrifields(), forecast_only is True if only forecast rasters
+    have changed, in which case the agrifields only need a forecast refresh (see
+    agrifield.refresh_forecasts_in_batch()).
+
+    save() then records the current rasters in the catalog. The first time, when
+    there is no catalog, no agrifields are affected; the current rasters are taken
+    as the baseline.
+    """
+
+    def __init__(self):
+        self.catalog_filename = os.path.join(
+            settings.AIRA_TIMESERIES_CACHE_DIR, "raster_catalog.json"
+        )
+        self.new_catalog = None
+        self.forecast_only = False
+
+    def find_affected_agrifields(self):
+        old_catalog = self._read_catalog()
+        self.new_catalog = {}
+        all_affected = False
+        changed_pixels = []
+        historical_changed = False
+        historical_prefixes = self._get_prefixes(settings.AIRA_DATA_HISTORICAL)
+        for prefix in self._get_prefixes():
+            old_rasters = (old_catalog or {}).get(prefix, {})
+            rasters, replaced = self._check_prefix(prefix, old_rasters)
+            self.new_catalog[prefix] = rasters
+            added_or_removed = rasters.keys() != old_rasters.keys()
+            if prefix in historical_prefixes and (added_or_removed or replaced):
+                historical_changed = True
+            if added_or_removed:
+                all_affected = True
+            elif replaced:
+                changed = TimeseriesStore(prefix).get_changed_pixels(replaced)
+                if changed is None:
+                    all_affected = True
+                else:
+                    changed_pixels.append(changed)
+        self.forecast_only = not historical_changed
+        if old_catalog is None:
+            return []
+        if all_affected:
+            return list(Agrifield.objects.all())
+        if not changed_pixels:
+            return []
+        return self._get_agrifields_in_pixels(changed_pixels)
+
+    def save(self):
+        """Record the rasters examined by find_affected_agrifields()."""
+        os.makedirs(os.path.dirname(self.catalog_filename), exist_ok=True)
+        tmp_filename = self.catalog_filename + ".new"
+        with open(tmp_filename, "w") as f:
+            json.dump(self.new_catalog, f)
+        os.replace(tmp_filename, self.catalog_filename)
+
+    def _read_catalog(self):
+        try:
+            with open(self.catalog_filename) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _get_prefixes(self, *directories):
+        directories = directories or (
+            settings.AIRA_DATA_HISTORICAL,
+            settings.AIRA_DATA_FORECAST,
+        )
+        return [
+            os.path.join(directory, "daily_" + var)
+            for directory in directories
+            for var in MODEL_VARIABLES
+        ]
+
+    def _check_prefix(self, prefix, old_rasters):
+        """Return the current rasters of prefix and those that have been replaced.
+
+        The result is a tuple (rasters, replaced). rasters is a dictionary like
+        old_rasters, i.e. mapping base names to dictionaries with "version" and
+        "checksum". replaced maps the base names of rasters whose contents have
+        changed to their old versions.
+        """
+        rasters = {}
+        replaced = {}
+        for filename, date in get_dated_raster_filenames(prefix):
+            basename = os.path.basename(filename)
+            version = list(get_file_version(filename) or ())
+            old = old_rasters.get(basename)
+            if old is not None and old["version"] == version:
+                rasters[basename] = old
+                continue
+            checksum = _get_checksum(filename)
+            rasters[basename] = {"version": version, "checksum": checksum}
+            if old is not None and old["checksum"] != checksum:
+                replaced[basename] = old["version"]
+        return rasters, replaced
+
+    def _get_agrifields_in_pixels(self, changed_pixels):
+        agrifields = list(Agrifield.objects.all())
+        points = [agrifield.location for agrifield in agrifields]
+        affected = np.zeros(len(agrifields), dtype=bool)
+        for grid, changed in changed_pixels:
+            rows, cols = grid.get_pixels(points)
+            inside = rows >= 0
+            pixels = rows[inside] * grid.size[1] + cols[inside]
+            affected[inside] |= changed[pixels]
+        return [agrifield for agrifield, a in zip(agrifields, affected) if a]
+
+
+def _get_checksum(filename):
+    md5 = hashlib.md5()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            md5.update(block)
+    return md5.hexdigest()
@@ -0,0 +1,334 @@
+import datetime as dt
+import math
+import os
+import threading
+from collections import namedtuple
+from glob import glob
+
+from django.conf import settings
+from django.contrib.gis.gdal.error import GDALException
+
+import iso8601
+import numpy as np
+import pandas as pd
+from hspatial import (
+    FilenameWithDateFormat,
+    PassepartoutPoint,
+    extract_point_from_raster,
+)
+from osgeo import gdal, osr
+
+from . import profiling
+
+PooledRaster = namedtuple("PooledRaster", ("dataset", "version"))
+
+
+def get_file_version(filename):
+    """Return something that changes whenever the file is modified.
+
+    It is a tuple with the modification time, size and inode of the file, or None if
+    the file does not exist.
+    """
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+class RasterPool:
+    """Keeps raster files open so that they don't need to be reopened on each access.
+
+    Opening a GeoTIFF and parsing its header costs much more than reading a pixel
+    from it. The pool opens each file the first time it is requested and keeps it
+    open for the lifetime of the process. If the file is modified (which is
+    determined from its modification time, size and inode), it is reopened.
+
+    GDAL datasets must not be used by many threads at the same time, so all access
+    to the pooled datasets must be made while holding the pool's lock; the
+    convenience method extract_point() does this.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self._rasters = {}
+        self.lock = threading.RLock()
+
+    def get(self, filename):
+        version = get_file_version(filename)
+        with self.lock:
+            pooled = self._rasters.get(filename)
+            if pooled is None or pooled.version != version:
+                pooled = self._open(filename, version)
+                self._rasters[filename] = pooled
+            return pooled
+
+    def _open(self, filename, version):
+        profiling.count("rasters_opened")
+        dataset = gdal.Open(filename)
+        if dataset is None:
+            raise RuntimeError(f"Could not open {filename}")
+        return PooledRaster(dataset, version)
+
+    def extract_point(self, point, filename):
+        with self.lock:
+            return extract_point_from_raster(point, self.get(filename).dataset)
+
+    def clear(self):
+        with self.lock:
+            self._rasters.clear()
+
+
+raster_pool = RasterPool()
+
+# A forked child (e.g. a Celery worker) must not share the parent's file handles,
+# because the file offsets would be shared as well.
+os.register_at_fork(after_in_child=raster_pool._reset)
+
+
+def get_soil_raster_filename(name):
+    return os.path.join(settings.AIRA_DATA_SOIL, name)
+
+
+SOIL_RASTERS = {
+    "field_capacity": "fc.tif",
+    "theta_s": "theta_s.tif",
+    "wilting_point": "pwp.tif",
+    "draintime_a": "a_1d.tif",
+    "draintime_b": "b.tif",
+}
+
+
+def get_soil_rasters_version():
+    return tuple(
+        get_file_version(get_soil_raster_filename(x)) for x in SOIL_RASTERS.values()
+    )
+
+
+def extract_soil_point(point):
+    """Return the values of all soil rasters at a point.
+
+    The result is a dictionary whose keys are the keys of SOIL_RASTERS. If the point
+    is outside the area covered by fc.tif, the result is None. Whether the point is
+    covered depends only on fc.tif; where another raster has no value (or doesn't
+    cover the point), its value is NaN, so that only the parameters derived from it
+    are affected.
+    """
+    fc_filename = get_soil_raster_filename(SOIL_RASTERS["field_capacity"])
+    with raster_pool.lock:
+        try:
+            field_capacity = raster_pool.extract_point(point, fc_filename)
+        except (RuntimeError, ValueError):
+            return None
+        if math.isnan(field_capacity):
+            return None
+        result = {"field_capacity": field_capacity}
+        for name, filename in SOIL_RASTERS.items():
+            if name not in result:
+                filename = get_soil_raster_filename(filename)
+                try:
+                    result[name] = raster_pool.extract_point(point, filename)
+                except (RuntimeError, ValueError):
+                    result[name] = math.nan
+        return result
+
+
+def extract_points_from_rasters(points, prefix, start_date=None, default_time=None):
+    """Extract the time series of many points from a set of rasters.
+
+    This is like hspatial.PointTimeseries, but for many points at once. The rasters
+    are the files named "{prefix}-{date}.tif"; those before start_date are ignored.
+    Each raster is opened only once, and all points are sampled from it with pixel
+    indexes that are calculated once for each grid. Points outside a raster get NaN.
+
+    Returns a tuple (index, values), where index is a pandas DatetimeIndex and values
+    is an array with one row per date and one column per point.
+    """
+    default_time = default_time or dt.time(0, 0)
+    filenames = _get_raster_filenames(prefix, start_date)
+    values = np.full((len(filenames), len(points)), np.nan)
+    timestamps = []
+    grids = {}
+    for i, filename in enumerate(filenames):
+        profiling.count("rasters_opened")
+        dataset = gdal.Open(filename)
+        try:
+            isostring = dataset.GetMetadata()["TIMESTAMP"]
+            timestamps.append(parse_raster_timestamp(isostring, default_time))
+            grid = RasterGrid.from_dataset(dataset)
+            if grid not in grids:
+                grids[grid] = grid.get_pixels(points)
+            grid.read_pixels(dataset, grids[grid], out=values[i])
+        finally:
+            dataset = None
+    index = pd.DatetimeIndex(timestamps)
+    order = np.argsort(index.values, kind="stable")
+    return index[order], values[order]
+
+
+def _get_raster_filenames(prefix, start_date):
+    return [
+        filename
+        for filename, date in get_dated_raster_filenames(prefix)
+        if start_date is None or date >= start_date
+    ]
+
+
+def get_dated_raster_filenames(prefix):
+    """Return the rasters "{prefix}-{date}.tif" as a list of (filename, date) tuples.
+
+    The list is sorted by date.
+    """
+    filename_format = FilenameWithDateFormat(prefix)
+    result = [
+        (filename, filename_format.get_date(filename))
+        for filename in glob(prefix + "-*.tif")
+    ]
+    return sorted(result, key=lambda x: x[1])
+
+
+def parse_raster_timestamp(isostring, default_time):
+    """Convert the TIMESTAMP metadata item of a raster to a datetime.
+
+    If it only contains a date, the time is default_time.
+    """
+    timestamp = iso8601.parse_date(isostring, default_timezone=None)
+    if len(isostring) <= 10:
+        timestamp = dt.datetime.combine(timestamp.date(), default_time)
+    return timestamp
+
+
+class RasterGrid(namedtuple("RasterGrid", ("geotransform", "projection", "size"))):
+    """The geometry of a raster, i.e. everything needed to locate its pixels."""
+
+    @classmethod
+    def from_dataset(cls, dataset):
+        return cls(
+            tuple(dataset.GetGeoTransform()),
+            dataset.GetProjection(),
+            (dataset.RasterYSize, dataset.RasterXSize),
+        )
+
+    def get_pixels(self, points):
+        """Return the (row, col) pixel indexes of points as two integer arrays.
+
+        Points outside the grid get -1 for both row and col.
+        """
+        inverse_geotransform = gdal.InvGeoTransform(self.geotransform)
+        rows = np.full(len(points), -1, dtype=int)
+        cols = np.full(len(points), -1, dtype=int)
+        for i, point in enumerate(points):
+            try:
+                pppoint = PassepartoutPoint(point).transform_to(self.projection)
+            except GDALException:
+                continue
+            px, py = gdal.ApplyGeoTransform(inverse_geotransform, pppoint.x, pppoint.y)
+            if 0 <= px < self.size[1] and 0 <= py < self.size[0]:
+                rows[i], cols[i] = int(py), int(px)
+        return rows, cols
+
+    def read_pixels(self, dataset, pixels, out):
+        """Read the values of pixels from dataset into the one-dimensional out.
+
+        Only the window that contains the pixels is read. Nodata becomes NaN.
+        """
+        rows, cols = pixels
+        inside = rows >= 0
+        if not inside.any():
+            return
+        top, left = rows[inside].min(), cols[inside].min()
+        height = rows[inside].max() - top + 1
+        width = cols[inside].max() - left + 1
+        band = dataset.GetRasterBand(1)
+        window = band.ReadAsArray(
+            int(left), int(top), int(width), int(height), buf_type=gdal.GDT_Float32
+        ).astype(float)
+        nodata = band.GetNoDataValue()
+        if nodata is not None:
+            window[window == nodata] = np.nan
+        out[inside] = window[rows[inside] - top, cols[inside] - left]
+
+    def get_pixels_of_grid(self, other):
+        """Find the pixel of this grid that contains the center of each pixel of other.
+
+        The result is an integer array with one item per pixel of other (in
+        row-major order), which is the (row-major) index of the pixel of this grid,
+        or -1 if the center is outside this grid.
+        """
+        if other == self:
+            return np.arange(self.size[0] * self.size[1])
+        height, width = other.size
+        cols, rows = np.meshgrid(np.arange(width) + 0.5, np.arange(height) + 0.5)
+        cols, rows = cols.ravel(), rows.ravel()
+        gt = other.geotransform
+        x = gt[0] + cols * gt[1] + rows * gt[2]
+        y = gt[3] + cols * gt[4] + rows * gt[5]
+        if other.projection != self.projection:
+            x, y = _transform_coordinates(x, y, other.projection, self.projection)
+        inv = gdal.InvGeoTransform(self.geotransform)
+        px = np.floor(inv[0] + x * inv[1] + y * inv[2])
+        py = np.floor(inv[3] + x * inv[4] + y * inv[5])
+        inside = (px >= 0) & (px < self.size[1]) & (py >= 0) & (py < self.size[0])
+        result = np.full(len(x), -1)
+        result[inside] = py[inside].astype(int) * self.size[1] + px[inside].astype(int)
+        return result
+
+
+def _transform_coordinates(x, y, source_wkt, target_wkt):
+    spatial_references = []
+    for wkt in (source_wkt, target_wkt):
+        spatial_reference = osr.SpatialReference()
+        spatial_reference.ImportFromWkt(wkt)
+        try:
+            spatial_reference.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        except AttributeError:
+            pass
+        spatial_references.append(spatial_reference)
+    transformation = osr.CoordinateTransformation(*spatial_references)
+    points = np.array(transformation.TransformPoints(np.column_stack((x, y)).tolist()))
+    return points[:, 0], points[:, 1]
+
+
+def read_raster(filename):
+    """Read a whole single-band raster.
+
+    Returns a tuple (grid, values), where values is a two-dimensional float array in
+    which nodata is NaN.
+    """
+    profiling.count("rasters_opened")
+    dataset = gdal.Open(filename)
+    if dataset is None:
+        raise RuntimeError(f"Could not open {filename}")
+    try:
+        band = dataset.GetRasterBand(1)
+        values = band.ReadAsArray().astype(float)
+        nodata = band.GetNoDataValue()
+        if nodata is not None:
+            values[values == nodata] = np.nan
+        return RasterGrid.from_dataset(dataset), values
+    finally:
+        dataset = None
+
+
+def write_raster(filename, grid, values, timestamp=None, nodata=1e8):
+    """Write a two-dimensional array to a single-band float32 GeoTIFF.
+
+    NaN in values is written as nodata. timestamp, if specified, is stored in the
+    TIMESTAMP metadata item, like in the meteorological rasters.
+    """
+    height, width = grid.size
+    dataset = gdal.GetDriverByName("GTiff").Create(
+        filename, width, height, 1, gdal.GDT_Float32
+    )
+    try:
+        dataset.SetGeoTransform(grid.geotransform)
+        dataset.SetProjection(grid.projection)
+        if timestamp is not None:
+            dataset.SetMetadataItem("TIMESTAMP", timestamp)
+        band = dataset.GetRasterBand(1)
+        band.SetNoDataValue(nodata)
+        band.WriteArray(np.where(np.isnan(values), nodata, values))
+    finally:
+        dataset = None
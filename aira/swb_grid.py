@@ -0,0 +1,209 @@
+import datetime as dt
+import os
+import tempfile
+
+from django.conf import settings
+
+import numpy as np
+from swb import get_effective_precipitation
+
+from . import kc_curves
+from .agrifield import InitialConditions, calculate_soil_water_in_batch
+from .models import DEFAULT_IRRIGATION_OPTIMIZER, get_most_recent_date
+from .rasters import SOIL_RASTERS, get_soil_raster_filename, read_raster, write_raster
+from .timeseries_store import TimeseriesStore
+
+# The rasters written for each crop type, and the model results they contain
+OUTPUT_VARIABLES = {
+    "theta": "theta",
+    "dr": "dr",
+    "irrigation_need": "recommended_net_irrigation",
+}
+
+
+def get_output_prefix(directory, crop_type, variable):
+    """Return the prefix of the output rasters of a crop type and variable.
+
+    The rasters are "{prefix}-{date}.tif", like the meteorological rasters.
+    """
+    return os.path.join(directory, "swb_crop{}_{}".format(crop_type.id, variable))
+
+
+class SWBGrid:
+    """Runs the soil water balance for every covered pixel of the soil rasters.
+
+    For a crop type, the model is run with the parameters that an agrifield of that
+    crop type with no custom parameters would have at each pixel of fc.tif (pixels
+    where fc.tif has no data are skipped), assuming that it has been irrigated as
+    recommended, i.e. like the run for the performance chart. All pixels are
+    calculated at once with BatchSoilWaterBalance, in blocks of block_rows rows of
+    the grid to limit memory usage.
+
+    write(crop_type) writes the daily theta, dr and irrigation need (the
+    recommended net irrigation, in mm) of each pixel to GeoTIFFs with the grid of
+    fc.tif, named "swb_crop{crop_type_id}_{variable}-{date}.tif", in
+    AIRA_DATA_HISTORICAL or AIRA_DATA_FORECAST, depending on the date.
+    """
+
+    def __init__(self, block_rows=256):
+        self.block_rows = block_rows
+        self.grid, self.soil = self._read_soil()
+        initial_conditions = InitialConditions(None)
+        self.theta_init = self._read_theta_init(initial_conditions.theta_raster_file)
+        self._read_meteo(initial_conditions.date)
+
+    def _read_soil(self):
+        result = {}
+        grid = None
+        for name, filename in SOIL_RASTERS.items():
+            raster_grid, values = read_raster(get_soil_raster_filename(filename))
+            if name == "field_capacity":
+                grid = raster_grid
+            result[name] = (raster_grid, values.ravel())
+        soil = {}
+        for name, (raster_grid, values) in result.items():
+            if raster_grid == grid:
+                soil[name] = values
+            else:
+                soil[name] = _resample(values, raster_grid, grid)
+        return grid, soil
+
+    def _read_theta_init(self, theta_raster_file):
+        if theta_raster_file is None:
+            return self.soil["field_capacity"]
+        raster_grid, values = read_raster(theta_raster_file)
+        return _resample(values.ravel(), raster_grid, self.grid)
+
+    def _read_meteo(self, start_date):
+        # Like MeteoForcing, but for the pixels of the soil grid and without reading
+        # the values yet.
+        self._meteo = {}
+        for var in ("evaporation", "rain"):
+            hindex, hdata, hpixels = self._get_store("HISTORICAL", var, start_date)
+            findex, fdata, fpixels = self._get_store("FORECAST", var, start_date)
+            nhistorical = np.searchsorted(findex, hindex[-1], side="right")
+            parts = [(hdata, hpixels, 0), (fdata, fpixels, nhistorical)]
+            index = hindex.append(findex[nhistorical:])
+            self._meteo[var] = (index, parts)
+            if var == "evaporation":
+                self.index = index
+                self.historical_end_date = hindex[-1]
+        rain_index = self._meteo["rain"][0]
+        self._rain_rows = rain_index.get_indexer(self.index)
+
+    def _get_store(self, category, var, start_date):
+        prefix = os.path.join(
+            getattr(settings, "AIRA_DATA_" + category), "daily_" + var
+        )
+        return TimeseriesStore(prefix).get_for_grid(
+            self.grid, start_date=start_date, default_time=dt.time(23, 59)
+        )
+
+    def _read_meteo_block(self, var, pixels):
+        parts = self._meteo[var][1]
+        result = []
+        for data, store_pixels, first_row in parts:
+            nrows = 0 if data is None else len(data) - first_row
+            values = np.full((nrows, len(pixels)), np.nan)
+            columns = store_pixels[pixels]
+            inside = columns >= 0
+            if nrows and inside.any():
+                values[:, inside] = data[first_row:, columns[inside]]
+            result.append(values)
+        return np.concatenate(result)
+
+    def get_kc(self, crop_type):
+        """Return the crop coefficient of crop_type for each day of self.index."""
+        return kc_curves.get_kc(
+            crop_type, get_most_recent_date(crop_type.planting_date), self.index
+        )
+
+    def calculate(self, crop_type, out):
+        """Run the model for crop_type and store the results in out.
+
+        out is a dictionary whose keys are the keys of OUTPUT_VARIABLES and whose
+        values are arrays with one row per day and one column per pixel of the grid;
+        the columns of covered pixels are filled in. Returns the number of covered
+        pixels.
+        """
+        kc = self.get_kc(crop_type)
+        zr = (float(crop_type.root_depth_min) + float(crop_type.root_depth_max)) / 2
+        width = self.grid.size[1]
+        ncovered = 0
+        for top in range(0, self.grid.size[0], self.block_rows):
+            bottom = min(top + self.block_rows, self.grid.size[0])
+            pixels = np.arange(top * width, bottom * width)
+            pixels = pixels[~np.isnan(self.soil["field_capacity"][pixels])]
+            if not len(pixels):
+                continue
+            results = self._calculate_block(crop_type, kc, zr, pixels)
+            for name, result_name in OUTPUT_VARIABLES.items():
+                out[name][:, pixels] = results[result_name]
+            ncovered += len(pixels)
+        return ncovered
+
+    def _calculate_block(self, crop_type, kc, zr, pixels):
+        evaporation = self._read_meteo_block("evaporation", pixels)
+        rain = self._read_meteo_block("rain", pixels)
+        precipitation = np.full(evaporation.shape, np.nan)
+        found = self._rain_rows >= 0
+        precipitation[found] = rain[self._rain_rows[found]]
+        # swb.get_effective_precipitation() only needs item access, so it works
+        # with a dictionary of arrays as well as with a DataFrame.
+        meteo = {"ref_evapotranspiration": evaporation, "precipitation": precipitation}
+        get_effective_precipitation(meteo)
+        soil = {name: values[pixels] for name, values in self.soil.items()}
+        return calculate_soil_water_in_batch(
+            theta_s=soil["theta_s"],
+            theta_fc=soil["field_capacity"],
+            theta_wp=soil["wilting_point"],
+            zr=zr,
+            zr_factor=1000,
+            p=float(crop_type.max_allowed_depletion),
+            draintime=np.round(soil["draintime_a"] * zr ** soil["draintime_b"]),
+            theta_init=self.theta_init[pixels],
+            mif=DEFAULT_IRRIGATION_OPTIMIZER,
+            effective_precipitation=meteo["effective_precipitation"],
+            crop_evapotranspiration=evaporation * kc[:, np.newaxis],
+            actual_net_irrigation=np.zeros(evaporation.shape),
+            irrigate_as_recommended=True,
+        )
+
+    def write(self, crop_type):
+        """Calculate crop_type and write its rasters. Returns the number of pixels."""
+        height, width = self.grid.size
+        shape = (len(self.index), height * width)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            out = {
+                name: np.memmap(
+                    os.path.join(tmpdir, name), dtype=np.float32, mode="w+", shape=shape
+                )
+                for name in OUTPUT_VARIABLES
+            }
+            for values in out.values():
+                values[:] = np.nan
+            ncovered = self.calculate(crop_type, out)
+            for i, date in enumerate(self.index):
+                directory = (
+                    settings.AIRA_DATA_HISTORICAL
+                    if date <= self.historical_end_date
+                    else settings.AIRA_DATA_FORECAST
+                )
+                datestr = date.strftime("%Y-%m-%d")
+                for name, values in out.items():
+                    filename = "{}-{}.tif".format(
+                        get_output_prefix(directory, crop_type, name), datestr
+                    )
+                    write_raster(
+                        filename, self.grid, values[i].reshape(height, width), datestr
+                    )
+        return ncovered
+
+
+def _resample(values, source_grid, target_grid):
+    """Return the values of the source pixels at the centers of the target pixels."""
+    pixels = source_grid.get_pixels_of_grid(target_grid)
+    result = np.full(len(pixels), np.nan)
+    inside = pixels >= 0
+    result[inside] = values[pixels[inside]]
+    return result
@@ -1,25 +1,156 @@
 import json
 import logging
+import time
 
 from django.conf import settings
 from django.core.cache import cache
 
 import requests
+from celery import chord, group
 
+from aira import calculation_lanes
+from aira.agrifield import execute_model_in_batch, refresh_forecasts_in_batch
 from aira.celery import app
-from aira.models import LoRA_ARTAFlowmeter
+from aira.models import Agrifield, LoRA_ARTAFlowmeter, queue_for_calculation
+from aira.raster_watcher import RasterWatcher
 
 logger = logging.getLogger(__name__)
 
 
 @app.task
-def calculate_agrifield(agrifield):
-    cache_key = "agrifield_{}_status".format(agrifield.id)
+def calculate_agrifield(agrifield_id, lane=None, due=None):
+    calculation_lanes.record_start(lane, due)
+    # The marker must be removed before the agrifield is loaded, so that a change
+    # made after loading schedules another calculation (see
+    # models.queue_for_calculation()).
+    cache.delete("agrifield_{}_scheduled".format(agrifield_id))
+    try:
+        agrifield = Agrifield.objects.select_related(
+            "owner", "crop_type", "irrigation_type"
+        ).get(id=agrifield_id)
+    except Agrifield.DoesNotExist:
+        return
+    cache_key = agrifield._status_cache_key
     cache.set(cache_key, "being processed", None)
     agrifield.execute_model()
     cache.set(cache_key, "done", None)
 
 
+@app.task
+def calculate_agrifields(agrifield_ids, lane=None, due=None):
+    """Calculate many agrifields at once with execute_model_in_batch().
+
+    Returns the number of agrifields calculated. lane and due are set by the code
+    that dispatches the task, for the counters of calculation_lanes.
+    """
+    calculation_lanes.record_start(lane, due)
+    cache.delete_many(["agrifield_{}_scheduled".format(x) for x in agrifield_ids])
+    agrifields = list(
+        Agrifield.objects.filter(id__in=agrifield_ids).select_related(
+            "owner", "crop_type", "irrigation_type"
+        )
+    )
+    status_keys = [agrifield._status_cache_key for agrifield in agrifields]
+    cache.set_many({key: "being processed" for key in status_keys}, None)
+    execute_model_in_batch(agrifields)
+    cache.set_many({key: "done" for key in status_keys}, None)
+    return len(agrifields)
+
+
+@app.task
+def refresh_forecasts(agrifield_ids, lane=None, due=None):
+    """Like calculate_agrifields(), but with refresh_forecasts_in_batch().
+
+    This is for when only the forecast rasters have changed. Unlike
+    calculate_agrifields(), it leaves the markers of scheduled calculations alone,
+    since it doesn't take into account changes to the agrifields.
+    """
+    calculation_lanes.record_start(lane, due)
+    agrifields = list(
+        Agrifield.objects.filter(id__in=agrifield_ids).select_related(
+            "owner", "crop_type", "irrigation_type"
+        )
+    )
+    refresh_forecasts_in_batch(agrifields)
+    return len(agrifields)
+
+
+@app.task
+def report_calculation_runtime(counts, start_time):
+    """Log the total runtime of a calculate_agrifields_in_chunks() run.
+
+    This is the body of the chord; counts are the results of the
+    calculate_agrifields tasks and start_time is when they were dispatched, as a
+    Unix timestamp.
+    """
+    runtime = time.time() - start_time
+    logger.info(
+        "Calculated {} agrifields in {} chunks in {:.1f} s".format(
+            sum(counts), len(counts), runtime
+        )
+    )
+    return runtime
+
+
+def chunk_ids(ids, chunk_size):
+    """Split the list ids into lists of at most chunk_size items."""
+    result = []
+    for start in range(0, len(ids), chunk_size):
+        end = start + chunk_size
+        result.append(ids[start:end])
+    return result
+
+
+def calculate_agrifields_in_chunks(
+    agrifield_ids,
+    chunk_size=100,
+    countdown=0,
+    lane=calculation_lanes.BULK,
+    task=calculate_agrifields,
+):
+    """Dispatch calculate_agrifields tasks for chunks of agrifield_ids as a group.
+
+    The tasks go to the queue of the specified lane (see calculation_lanes). task
+    can also be refresh_forecasts.
+
+    If Celery has a result backend, the group is the header of a chord whose body,
+    report_calculation_runtime, logs the total runtime; chords don't work without a
+    result backend, so otherwise the group is dispatched alone.
+    """
+    chunks = chunk_ids(list(agrifield_ids), chunk_size)
+    if not chunks:
+        return None
+    signatures = []
+    for chunk in chunks:
+        kwargs, options = calculation_lanes.get_dispatch_options(lane, countdown)
+        signatures.append(task.signature((chunk,), kwargs, **options))
+    header = group(signatures)
+    if not app.conf.result_backend:
+        return header.apply_async()
+    return chord(header)(report_calculation_runtime.s(time.time()))
+
+
+@app.task
+def recalculate_for_changed_rasters():
+    """
+    A scheduled task that queues for calculation the agrifields affected by
+    meteorological rasters that have been added, replaced or removed since it last
+    ran (see `RasterWatcher`). If only forecast rasters have changed, only the
+    forecast part of the agrifields is recalculated (see `refresh_forecasts`).
+    Returns the number of agrifields queued.
+    """
+    watcher = RasterWatcher()
+    agrifields = watcher.find_affected_agrifields()
+    if watcher.forecast_only:
+        calculate_agrifields_in_chunks(
+            [agrifield.id for agrifield in agrifields], task=refresh_forecasts
+        )
+    else:
+        queue_for_calculation(agrifields, lane=calculation_lanes.BULK)
+    watcher.save()
+    return len(agrifields)
+
+
 @app.task
 def add_irrigations_from_telemetric_flowmeters():
     """
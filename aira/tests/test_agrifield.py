@@ -1,4 +1,5 @@
 import datetime as dt
+import json
 import os
 import shutil
 import tempfile
@@ -15,9 +16,18 @@ import pandas as pd
 from freezegun import freeze_time
 from model_mommy import mommy
 from osgeo import gdal, osr
+from swb import calculate_soil_water
 
-from aira import models
-from aira.agrifield import InitialConditions
+from aira import models, tasks
+from aira.agrifield import (
+    ForecastForcing,
+    InitialConditions,
+    execute_model_in_batch,
+    get_historical_rasters_version,
+    refresh_forecasts_in_batch,
+)
+from aira.rasters import raster_pool
+from aira.timeseries_store import TimeseriesStore
 
 
 def setup_input_file(filename, value, timestamp_str):
@@ -197,6 +207,9 @@ class SetupTestDataMixin:
             ),
             override_settings(AIRA_DATA_FORECAST=os.path.join(cls.tempdir, "forecast")),
             override_settings(AIRA_DATA_SOIL=cls.tempdir),
+            override_settings(
+                AIRA_TIMESERIES_CACHE_DIR=os.path.join(cls.tempdir, "timeseries_cache")
+            ),
             freeze_time("2018-03-18 13:00:01"),
         }
         for x in cls._context_managers:
@@ -291,28 +304,69 @@ class ExecuteModelTestCase(DataTestCase):
         self.assertAlmostEqual(
             self.timeseries.at[dt.datetime(2018, 3, 18, 23, 59), var], 0
         )
+        self.assertAlmostEqual(
+            self.timeseries.at[dt.datetime(2018, 3, 19, 23, 59), var], 0
+        )
+
+    def test_irrigate_to_fc(self):
         self.assertEqual(
-            self.timeseries.at[dt.datetime(2018, 3, 19, 23, 59), var], "fc"
+            list(self.timeseries["irrigate_to_fc"]),
+            [False, False, False, False, True],
         )
 
+    def test_theoretical_run_is_not_included(self):
+        self.assertNotIn("ifinal_theoretical", self.timeseries)
+
     def test_ifinal_theoretical(self):
+        performance = self.agrifield.calculate_performance(self.results)
         var = "ifinal_theoretical"
+        self.assertAlmostEqual(performance.at[pd.Timestamp("2018-03-15 23:59"), var], 0)
+        self.assertAlmostEqual(performance.at[pd.Timestamp("2018-03-16 23:59"), var], 0)
+        self.assertAlmostEqual(performance.at[pd.Timestamp("2018-03-17 23:59"), var], 0)
         self.assertAlmostEqual(
-            self.timeseries.at[pd.Timestamp("2018-03-15 23:59"), var], 0
+            performance.at[pd.Timestamp("2018-03-18 23:59"), var], 122.08333333
         )
         self.assertAlmostEqual(
-            self.timeseries.at[pd.Timestamp("2018-03-16 23:59"), var], 0
+            performance.at[pd.Timestamp("2018-03-19 23:59"), var], 125.20833333
         )
-        self.assertAlmostEqual(
-            self.timeseries.at[pd.Timestamp("2018-03-17 23:59"), var], 0
-        )
-        self.assertAlmostEqual(
-            self.timeseries.at[pd.Timestamp("2018-03-18 23:59"), var], 122.08333333
-        )
-        self.assertAlmostEqual(
-            self.timeseries.at[pd.Timestamp("2018-03-19 23:59"), var], 125.20833333
+
+
+class ExecuteModelInBatchTestCase(DataTestCase):
+    @classmethod
+    def _create_agrifield(cls):
+        super()._create_agrifield()
+        cls.agrifield2 = mommy.make(
+            models.Agrifield,
+            id=2,
+            owner=cls.user,
+            name="Another field",
+            crop_type=cls.crop_type,
+            irrigation_type=cls.irrigation_type,
+            location=Point(22.015, 37.985),
+            wetted_area=1000,
+            use_custom_parameters=True,
+            custom_max_allowed_depletion=0.4,
+            custom_irrigation_optimizer=0.8,
         )
 
+    def setUp(self):
+        super().setUp()
+        self.expected = {
+            f.id: f.execute_model()["timeseries"].copy()
+            for f in (self.agrifield, self.agrifield2)
+        }
+        agrifields = models.Agrifield.objects.filter(id__in=(1, 2))
+        self.results = execute_model_in_batch(agrifields)
+
+    def test_results_are_the_same_as_those_of_execute_model(self):
+        for agrifield_id, expected in self.expected.items():
+            pd.testing.assert_frame_equal(
+                self.results[agrifield_id]["timeseries"], expected, check_like=True
+            )
+
+    def test_raw(self):
+        self.assertAlmostEqual(self.results[1]["raw"], 142.5, places=4)
+
 
 class FutureIrrigationDoesNotAffectRecommendationTestCase(DataTestCase):
     @classmethod
@@ -391,6 +445,141 @@ class NeedsIrrigationTestCase(TestCase):
         self.assertIsNone(self.agrifield.needs_irrigation)
 
 
+@override_settings(CACHES={"default": {"BACKEND": _locmemcache}})
+@patch(_in_covered_area, new_callable=PropertyMock, return_value=True)
+class ResultsMemoizationTestCase(TestCase):
+    def setUp(self):
+        self.agrifield = mommy.make(
+            models.Agrifield, id=1, crop_type__planting_date="15/03"
+        )
+        timeseries = pd.DataFrame(
+            {"ifinal": [0, 42.0]},
+            index=pd.DatetimeIndex(["2020-01-14", "2020-01-15"]),
+        )
+        cache.set(
+            "model_run_1",
+            {"forecast_start_date": "2020-01-15", "timeseries": timeseries},
+        )
+
+    def tearDown(self):
+        cache.delete("model_run_1")
+
+    def test_results_are_read_from_cache_once(self, m):
+        with patch("aira.agrifield.cache.get", wraps=cache.get) as mock_get:
+            self.agrifield.results
+            self.agrifield.needs_irrigation
+            self.agrifield.alternative_irrigations
+            self.agrifield.results
+        mock_get.assert_called_once_with("model_run_1")
+
+    def test_forget_results(self, m):
+        self.assertTrue(self.agrifield.needs_irrigation)
+        cache.delete("model_run_1")
+        self.assertTrue(self.agrifield.needs_irrigation)
+        self.agrifield.forget_results()
+        self.assertIsNone(self.agrifield.needs_irrigation)
+
+
+@override_settings(CACHES={"default": {"BACKEND": _locmemcache}})
+class PrefetchCachedResultsTestCase(DataTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.agrifield.execute_model()
+        cache.set("agrifield_1_status", "done")
+
+    def test_single_cache_access(self):
+        agrifields = models.Agrifield.objects.filter(id=1).with_cached_results()
+        with patch("aira.models.cache.get_many", wraps=cache.get_many) as get_many:
+            with patch("aira.agrifield.cache.get", wraps=cache.get) as get:
+                for agrifield in agrifields:
+                    agrifield.status
+                    agrifield.needs_irrigation
+                    agrifield.forecast_data
+        get_many.assert_called_once()
+        get.assert_not_called()
+
+    def test_results(self):
+        (agrifield,) = models.Agrifield.objects.filter(id=1).with_cached_results()
+        self.assertAlmostEqual(agrifield.results["raw"], 142.5, places=4)
+
+    def test_status(self):
+        (agrifield,) = models.Agrifield.objects.filter(id=1).with_cached_results()
+        self.assertEqual(agrifield.status, "done")
+
+    def test_soil_rasters_version_is_found_once(self):
+        mommy.make(
+            models.Agrifield,
+            owner=self.user,
+            location=Point(22.0, 38.0),
+            crop_type=self.crop_type,
+            irrigation_type=self.irrigation_type,
+        )
+        with patch(
+            "aira.models.get_soil_rasters_version",
+            wraps=models.get_soil_rasters_version,
+        ) as m:
+            list(models.Agrifield.objects.with_cached_results())
+        m.assert_called_once()
+
+    def test_crop_type_is_fetched_in_the_same_query(self):
+        (agrifield,) = models.Agrifield.objects.filter(id=1).with_cached_results()
+        with self.assertNumQueries(0):
+            agrifield.root_depth
+
+    def test_without_prefetch_results_are_read_individually(self):
+        with patch("aira.models.cache.get_many", wraps=cache.get_many) as get_many:
+            list(models.Agrifield.objects.filter(id=1))
+        get_many.assert_not_called()
+
+
+@override_settings(CACHES={"default": {"BACKEND": _locmemcache}})
+class ExecuteModelProfileTestCase(DataTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        raster_pool.clear()
+        with self.assertLogs("aira.profiling") as logs:
+            self.results = self.agrifield.execute_model()
+        self.profile = self.results["profile"]
+        self.log_record = json.loads(logs.records[0].getMessage())
+
+    def test_spans(self):
+        self.assertEqual(
+            set(self.profile["spans"]),
+            {
+                "read_soil_rasters",
+                "determine_evaporation",
+                "determine_effective_precipitation",
+                "determine_crop_evapotranspiration",
+                "determine_irrigation",
+                "resume_from_checkpoint",
+                "swb",
+                "save_checkpoint",
+            },
+        )
+
+    def test_total(self):
+        self.assertGreaterEqual(
+            self.profile["total"], self.profile["spans"]["determine_irrigation"]
+        )
+
+    def test_rasters_opened(self):
+        self.assertGreaterEqual(self.profile["counters"]["rasters_opened"], 5)
+
+    def test_db_queries(self):
+        self.assertGreater(self.profile["counters"]["db_queries"], 0)
+
+    def test_profile_is_stored(self):
+        agrifield = models.Agrifield.objects.get(id=self.agrifield.id)
+        self.assertEqual(agrifield.results["profile"], self.profile)
+
+    def test_log(self):
+        self.assertEqual(self.log_record["run"], "execute_model")
+        self.assertEqual(self.log_record["agrifield_id"], self.agrifield.id)
+        self.assertEqual(set(self.log_record["spans"]), set(self.profile["spans"]))
+
+
 class DefaultFieldCapacityTestCase(DataTestCase):
     def test_value(self):
         with override_settings(AIRA_DATA_SOIL=self.tempdir):
@@ -424,6 +613,70 @@ class DefaultThetaSTestCase(DataTestCase):
             self.assertIsNone(self.agrifield.default_theta_s)
 
 
+@override_settings(CACHES={"default": {"BACKEND": _locmemcache}})
+class SoilTestCase(DataTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.agrifield = models.Agrifield.objects.get(id=1)
+
+    def _count_raster_reads(self, agrifield):
+        with patch(
+            "aira.rasters.raster_pool.extract_point", wraps=raster_pool.extract_point
+        ) as m:
+            agrifield.in_covered_area
+            agrifield.field_capacity
+            agrifield.theta_s
+            agrifield.wilting_point
+            agrifield.draintime
+        return m.call_count
+
+    def test_all_rasters_are_read_in_one_pass(self):
+        self.assertEqual(self._count_raster_reads(self.agrifield), 5)
+
+    def test_values(self):
+        self.assertAlmostEqual(self.agrifield.field_capacity, 0.4)
+        self.assertAlmostEqual(self.agrifield.theta_s, 0.5)
+        self.assertAlmostEqual(self.agrifield.wilting_point, 0.1)
+        self.assertEqual(self.agrifield.draintime, 29)
+
+    def test_snapshot_is_cached_across_instances(self):
+        self.agrifield.soil
+        another_instance = models.Agrifield.objects.get(id=1)
+        self.assertEqual(self._count_raster_reads(another_instance), 0)
+
+    def test_custom_parameters_are_taken_into_account(self):
+        self.agrifield.soil
+        self.agrifield.use_custom_parameters = True
+        self.agrifield.custom_field_capacity = 0.3
+        self.assertAlmostEqual(self.agrifield.field_capacity, 0.3)
+        self.assertAlmostEqual(self.agrifield.default_field_capacity, 0.4)
+
+    def test_modified_raster_is_reread(self):
+        self.agrifield.soil
+        filename = os.path.join(self.tempdir, "pwp.tif")
+        setup_input_file(filename, np.array([[0.12, 0.15], [0.2, 0.25]]), None)
+        os.utime(filename, ns=(0, 0))
+        try:
+            self.assertAlmostEqual(self.agrifield.wilting_point, 0.12)
+        finally:
+            self._setup_pwp_raster()
+
+    def test_nan_in_draintime_raster_affects_only_draintime(self):
+        filename = os.path.join(self.tempdir, "a_1d.tif")
+        setup_input_file(filename, np.array([[np.nan, 30], [30, 30]]), None)
+        os.utime(filename, ns=(0, 0))
+        try:
+            self.assertTrue(self.agrifield.in_covered_area)
+            self.assertAlmostEqual(self.agrifield.field_capacity, 0.4)
+            self.assertAlmostEqual(self.agrifield.theta_s, 0.5)
+            self.assertAlmostEqual(self.agrifield.wilting_point, 0.1)
+            with self.assertRaises(ValueError):
+                self.agrifield.draintime
+        finally:
+            self._setup_draintime_rasters()
+
+
 @override_settings(CACHES={"default": {"BACKEND": _locmemcache}})
 @patch(_in_covered_area, new_callable=PropertyMock, return_value=True)
 class LastIrrigationIsOutdatedTestCase(DataTestCase):
@@ -468,6 +721,60 @@ class SetStatusTestCase(DataTestCase):
         self.assertEqual(self.agrifield.status, "done")
 
 
+@override_settings(
+    CACHES={"default": {"BACKEND": _locmemcache}}, AIRA_RECALCULATION_DEBOUNCE=7
+)
+@patch(_in_covered_area, new_callable=PropertyMock, return_value=True)
+class DebouncedRecalculationTestCase(DataTestCase):
+    def setUp(self):
+        cache.clear()
+
+    @patch("aira.tasks.calculate_agrifield.apply_async")
+    def test_burst_of_changes_dispatches_one_task(self, m, m_in_covered_area):
+        self.agrifield.save()
+        self.applied_irrigation_1.save()
+        self.applied_irrigation_2.delete()
+        m.assert_called_once()
+        args, kwargs = m.call_args
+        self.assertEqual(args[0], [self.agrifield.id])
+        self.assertEqual(kwargs["countdown"], 7)
+
+    @patch("aira.tasks.calculate_agrifield.apply_async")
+    def test_user_change_goes_to_interactive_lane(self, m, m_in_covered_area):
+        self.agrifield.save()
+        self.assertEqual(m.call_args[1]["queue"], "interactive")
+
+    @patch("aira.tasks.calculate_agrifield.apply_async")
+    def test_change_after_task_started_dispatches_again(self, m, m_in_covered_area):
+        self.agrifield.save()
+        cache.delete(self.agrifield._scheduled_cache_key)
+        self.agrifield.save()
+        self.assertEqual(m.call_count, 2)
+
+    @patch("aira.tasks.calculate_agrifields_in_chunks")
+    def test_many_agrifields_are_dispatched_as_batch(self, m, m_in_covered_area):
+        agrifield2 = mommy.make(models.Agrifield, owner=self.user)
+        cache.clear()
+        models.queue_for_calculation([self.agrifield, agrifield2])
+        m.assert_called_once_with(
+            [self.agrifield.id, agrifield2.id], countdown=7, lane="interactive"
+        )
+
+    @patch("aira.models.Agrifield.execute_model")
+    def test_task_removes_marker(self, m, m_in_covered_area):
+        cache.set(self.agrifield._scheduled_cache_key, True)
+        tasks.calculate_agrifield(self.agrifield.id)
+        self.assertIsNone(cache.get(self.agrifield._scheduled_cache_key))
+        self.assertEqual(self.agrifield.status, "done")
+
+    @patch("aira.models.Agrifield.execute_model", autospec=True)
+    def test_task_uses_current_data(self, m, m_in_covered_area):
+        models.Agrifield.objects.filter(id=self.agrifield.id).update(name="renamed")
+        tasks.calculate_agrifield(self.agrifield.id)
+        (agrifield,) = m.call_args[0]
+        self.assertEqual(agrifield.name, "renamed")
+
+
 @override_settings(TIME_ZONE="Europe/Athens")
 @patch(_in_covered_area, new_callable=PropertyMock, return_value=True)
 class AppliedIrrigationTimeZoneTestCase(DataTestCase):
@@ -486,6 +793,281 @@ class AppliedIrrigationTimeZoneTestCase(DataTestCase):
         self.assertAlmostEqual(self.timeseries[var].at[timestamp], 150)
 
 
+@override_settings(CACHES={"default": {"BACKEND": _locmemcache}})
+class ModelCheckpointTestCase(DataTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.full_run = self.agrifield.execute_model()["timeseries"].copy()
+
+    def test_checkpoint_is_at_historical_end_date(self):
+        checkpoint = cache.get("model_checkpoint_1")
+        self.assertEqual(checkpoint["date"], pd.Timestamp("2018-03-17 23:59"))
+
+    def test_second_run_resumes_from_checkpoint(self):
+        with patch("aira.agrifield.calculate_soil_water") as m:
+            self.agrifield.execute_model()
+        m.assert_not_called()
+
+    def test_resumed_run_gives_same_results(self):
+        timeseries = self.agrifield.execute_model()["timeseries"]
+        pd.testing.assert_frame_equal(timeseries, self.full_run, check_like=True)
+
+    def test_changed_parameters_cause_full_run(self):
+        self.agrifield.use_custom_parameters = True
+        self.agrifield.custom_irrigation_optimizer = 0.8
+        with patch(
+            "aira.agrifield.calculate_soil_water", wraps=calculate_soil_water
+        ) as m:
+            self.agrifield.execute_model()
+        self.assertEqual(m.call_count, 1)
+
+
+@override_settings(CACHES={"default": {"BACKEND": _locmemcache}})
+class PerformanceResultsTestCase(DataTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.agrifield.execute_model()
+
+    def tearDown(self):
+        cache.delete("model_checkpoint_{}".format(self.agrifield.id))
+        super().tearDown()
+
+    def _get_performance_results(self):
+        agrifield = models.Agrifield.objects.get(id=self.agrifield.id)
+        with patch.object(
+            models.Agrifield,
+            "calculate_performance",
+            autospec=True,
+            side_effect=models.Agrifield.calculate_performance,
+        ) as m:
+            result = agrifield.performance_results
+        self.performance_calculations = m.call_count
+        return result
+
+    def test_ifinal_theoretical(self):
+        timeseries = self._get_performance_results()["timeseries"]
+        self.assertAlmostEqual(
+            timeseries.at[pd.Timestamp("2018-03-19 23:59"), "ifinal_theoretical"],
+            125.20833333,
+        )
+
+    def test_unknown_applied_irrigation_is_filled_in(self):
+        timeseries = self._get_performance_results()["timeseries"]
+        self.assertAlmostEqual(
+            timeseries.at[pd.Timestamp("2018-03-19 23:59"), "applied_irrigation"],
+            125.20833333,
+        )
+
+    def test_calculated_on_first_request(self):
+        self._get_performance_results()
+        self.assertEqual(self.performance_calculations, 1)
+
+    def test_cached(self):
+        self._get_performance_results()
+        self._get_performance_results()
+        self.assertEqual(self.performance_calculations, 0)
+
+    def test_recalculation_invalidates_cache(self):
+        self._get_performance_results()
+        self.agrifield.execute_model()
+        self._get_performance_results()
+        self.assertEqual(self.performance_calculations, 1)
+
+
+@override_settings(CACHES={"default": {"BACKEND": _locmemcache}})
+class EvaluateScenariosTestCase(DataTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.timeseries = self.agrifield.execute_model()["timeseries"]
+        self.result = self.agrifield.evaluate_scenarios(
+            [{}, {dt.date(2018, 3, 18): 50}]
+        )
+
+    def tearDown(self):
+        cache.delete("model_checkpoint_{}".format(self.agrifield.id))
+        super().tearDown()
+
+    def test_index(self):
+        self.assertTrue(self.result["index"].equals(self.timeseries.index))
+
+    def test_shape(self):
+        self.assertEqual(self.result["theta"].shape, (5, 2))
+        self.assertEqual(self.result["ks"].shape, (5, 2))
+
+    def test_empty_scenario_is_the_normal_run(self):
+        np.testing.assert_allclose(self.result["theta"][:, 0], self.timeseries["theta"])
+        np.testing.assert_allclose(self.result["ks"][:, 0], self.timeseries["ks"])
+
+    def test_irrigation_increases_theta(self):
+        theta = self.result["theta"]
+        self.assertAlmostEqual(theta[2, 1], theta[2, 0])
+        self.assertGreater(theta[3, 1], theta[3, 0])
+
+    def test_date_outside_results(self):
+        with self.assertRaises(ValueError):
+            self.agrifield.evaluate_scenarios([{dt.date(2018, 3, 20): 50}])
+
+
+@override_settings(CACHES={"default": {"BACKEND": _locmemcache}})
+class SweepIrrigationParametersTestCase(DataTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.results = self.agrifield.execute_model()
+        self.sweep = self.agrifield.sweep_irrigation_parameters(
+            [0.5, 0.8], ps=[0.5, 0.3]
+        )
+
+    def tearDown(self):
+        cache.delete("model_checkpoint_{}".format(self.agrifield.id))
+        super().tearDown()
+
+    def test_combinations(self):
+        self.assertEqual(
+            [(x["mif"], x["p"]) for x in self.sweep],
+            [(0.5, 0.5), (0.8, 0.5), (0.5, 0.3), (0.8, 0.3)],
+        )
+
+    def test_current_setting_is_the_performance_run(self):
+        performance = self.agrifield.calculate_performance(self.results)
+        self.assertAlmostEqual(
+            self.sweep[0]["water_use"], performance["ifinal_theoretical"].sum()
+        )
+
+    def test_water_use_m3(self):
+        for x in self.sweep:
+            self.assertAlmostEqual(x["water_use_m3"], x["water_use"] * 2)
+
+    def test_stress_days(self):
+        for x in self.sweep:
+            self.assertTrue(0 <= x["stress_days"] <= 5)
+
+    def test_default_p(self):
+        (result,) = self.agrifield.sweep_irrigation_parameters([0.5])
+        self.assertAlmostEqual(result["p"], 0.5)
+
+
+class ForecastForcingTestCase(DataTestCase):
+    def setUp(self):
+        super().setUp()
+        self.forcing = ForecastForcing(
+            [self.agrifield.location], pd.Timestamp("2018-03-17 23:59")
+        )
+        self.index, self.values = self.forcing.get("evaporation")
+
+    def test_index(self):
+        self.assertEqual(
+            list(self.index),
+            [pd.Timestamp("2018-03-18 23:59"), pd.Timestamp("2018-03-19 23:59")],
+        )
+
+    def test_values(self):
+        np.testing.assert_allclose(self.values[:, 0], [70, 110])
+
+    def test_dates(self):
+        self.assertEqual(
+            self.forcing.historical_end_date["evaporation"],
+            pd.Timestamp("2018-03-17 23:59"),
+        )
+        self.assertEqual(
+            self.forcing.forecast_start_date["evaporation"],
+            pd.Timestamp("2018-03-18 23:59"),
+        )
+
+
+@override_settings(CACHES={"default": {"BACKEND": _locmemcache}})
+class ForecastRefreshTestCase(DataTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.agrifield.execute_model()
+        self.forecast_filename = os.path.join(
+            self.tempdir, "forecast", "daily_evaporation-2018-03-19.tif"
+        )
+        self.backup_filename = os.path.join(self.tempdir, "backup.tif")
+        shutil.copy2(self.forecast_filename, self.backup_filename)
+        setup_input_file(
+            self.forecast_filename,
+            np.array([[50.0, 9.7], [9.8, 9.9]]),
+            "2018-03-19",
+        )
+
+    def tearDown(self):
+        shutil.move(self.backup_filename, self.forecast_filename)
+        cache.delete("model_checkpoint_{}".format(self.agrifield.id))
+        super().tearDown()
+
+    def _refresh(self):
+        with patch(
+            "aira.agrifield.execute_model_in_batch", wraps=execute_model_in_batch
+        ) as m:
+            result = refresh_forecasts_in_batch([self.agrifield])
+        self.nfully_calculated = len(m.call_args[0][0])
+        return result[self.agrifield.id]["timeseries"]
+
+    def test_refresh_gives_same_results_as_full_run(self):
+        timeseries = self._refresh()
+        cache.delete("model_checkpoint_{}".format(self.agrifield.id))
+        full_run = self.agrifield.execute_model()["timeseries"]
+        pd.testing.assert_frame_equal(timeseries, full_run, check_like=True)
+
+    def test_refresh_uses_new_forecast(self):
+        timeseries = self._refresh()
+        self.assertAlmostEqual(
+            timeseries.at[dt.datetime(2018, 3, 19, 23, 59), "ref_evapotranspiration"],
+            50,
+        )
+
+    def test_refresh_does_not_use_full_run(self):
+        self._refresh()
+        self.assertEqual(self.nfully_calculated, 0)
+
+    def test_refresh_does_not_read_historical_rasters(self):
+        with patch.object(
+            TimeseriesStore, "get", autospec=True, side_effect=TimeseriesStore.get
+        ) as m:
+            self._refresh()
+        prefixes = {call[0][0].prefix for call in m.call_args_list}
+        self.assertEqual(
+            prefixes,
+            {
+                os.path.join(self.tempdir, "forecast", "daily_evaporation"),
+                os.path.join(self.tempdir, "forecast", "daily_rain"),
+            },
+        )
+
+    def test_changed_irrigation_causes_full_run(self):
+        mommy.make(
+            models.AppliedIrrigation,
+            agrifield=self.agrifield,
+            timestamp=dt.datetime(2018, 3, 16, 7, 0, tzinfo=dt.timezone.utc),
+            supplied_water_volume=100,
+        )
+        self._refresh()
+        self.assertEqual(self.nfully_calculated, 1)
+
+    def test_irrigation_after_checkpoint_does_not_cause_full_run(self):
+        mommy.make(
+            models.AppliedIrrigation,
+            agrifield=self.agrifield,
+            timestamp=dt.datetime(2018, 3, 18, 7, 0, tzinfo=dt.timezone.utc),
+            supplied_water_volume=100,
+        )
+        self._refresh()
+        self.assertEqual(self.nfully_calculated, 0)
+
+    def test_historical_rasters_are_scanned_once(self):
+        with patch(
+            "aira.agrifield.get_historical_rasters_version",
+            wraps=get_historical_rasters_version,
+        ) as m:
+            self._refresh()
+        self.assertEqual(m.call_count, 1)
+
+
 def mock_calculate_soil_water(**kwargs):
     timeseries = kwargs["timeseries"]
     timeseries["dr"] = 0
@@ -498,19 +1080,25 @@ def mock_calculate_soil_water(**kwargs):
 
 @patch("aira.agrifield.calculate_soil_water", side_effect=mock_calculate_soil_water)
 class InitialConditionsTestCase(DataTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.delete("model_checkpoint_{}".format(self.agrifield.id))
+
     def tearDown(self):
         self._remove_initial_theta_rasters()
+        # Don't let the mocked results be used as a checkpoint by other tests
+        cache.delete("model_checkpoint_{}".format(self.agrifield.id))
 
     def _check_theta_init(self, m, theta_init):
         calls = m.call_args_list
-        self.assertEqual(len(calls), 2)
+        self.assertEqual(len(calls), 1)
         for call in calls:
             call_kwargs = list(call)[1]
             self.assertAlmostEqual(call_kwargs["theta_init"], theta_init)
 
     def _check_starting_date(self, m, starting_date):
         calls = m.call_args_list
-        self.assertEqual(len(calls), 2)
+        self.assertEqual(len(calls), 1)
         for call in calls:
             call_kwargs = list(call)[1]
             self.assertEqual(call_kwargs["timeseries"].index[0], starting_date)
@@ -0,0 +1,78 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core import management
+from django.test import TestCase
+
+from aira import models
+
+
+class BenchmarkTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tempdir = tempfile.mkdtemp()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(cls.tempdir)
+
+    @classmethod
+    def setUpTestData(cls):
+        # The benchmark runs once for all tests, with as little data as possible.
+        output = os.path.join(cls.tempdir, "results.json")
+        previous = os.path.join(cls.tempdir, "previous.json")
+        with open(previous, "w") as f:
+            json.dump({"timings": {"runswb": 1000.0}}, f)
+        cls.out = StringIO()
+        management.call_command(
+            "benchmark",
+            "--fields=2",
+            "--users=1",
+            "--raster-size=5",
+            "--days=2",
+            "--forecast-days=1",
+            "--irrigations=1",
+            "--sample=1",
+            f"--output={output}",
+            f"--compare={previous}",
+            stdout=cls.out,
+        )
+        with open(output) as f:
+            cls.results = json.load(f)
+
+    def test_timings(self):
+        self.assertEqual(
+            set(self.results["timings"]),
+            {
+                "generate_data",
+                "execute_model_first",
+                "execute_model",
+                "runswb",
+                "agrifield_list_view",
+                "performance_csv",
+                "send_notifications",
+            },
+        )
+
+    def test_parameters(self):
+        self.assertEqual(self.results["parameters"]["fields"], 2)
+        self.assertEqual(self.results["parameters"]["seed"], 42)
+
+    def test_execute_model_profile(self):
+        self.assertIn("swb", self.results["execute_model_profile"]["spans"])
+
+    def test_data_are_rolled_back(self):
+        self.assertFalse(models.Agrifield.objects.exists())
+        self.assertFalse(User.objects.filter(username__startswith="aira-").exists())
+
+    def test_compare(self):
+        self.assertRegex(self.out.getvalue(), r"runswb: .* \(was 1000\.000 s, -")
+
+    def test_report_includes_timings_not_in_previous_results(self):
+        self.assertIn("send_notifications: ", self.out.getvalue())
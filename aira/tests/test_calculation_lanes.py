@@ -0,0 +1,48 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from aira import calculation_lanes
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+@mock.patch("aira.calculation_lanes.time.time", return_value=1000.0)
+class CalculationLanesTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_dispatch_options(self, m):
+        kwargs, options = calculation_lanes.get_dispatch_options("bulk", 10)
+        self.assertEqual(kwargs, {"lane": "bulk", "due": 1010.0})
+        self.assertEqual(options, {"queue": "bulk", "countdown": 10})
+
+    def test_depth(self, m):
+        calculation_lanes.get_dispatch_options("bulk", 0)
+        calculation_lanes.get_dispatch_options("bulk", 0)
+        calculation_lanes.get_dispatch_options("interactive", 0)
+        calculation_lanes.record_start("bulk", 1000.0)
+        stats = calculation_lanes.get_stats()
+        self.assertEqual(stats["bulk"]["depth"], 1)
+        self.assertEqual(stats["interactive"]["depth"], 1)
+
+    def test_latency(self, m):
+        calculation_lanes.get_dispatch_options("interactive", 0)
+        calculation_lanes.get_dispatch_options("interactive", 0)
+        calculation_lanes.record_start("interactive", 998.0)
+        calculation_lanes.record_start("interactive", 999.0)
+        stats = calculation_lanes.get_stats()["interactive"]
+        self.assertEqual(stats["started"], 2)
+        self.assertAlmostEqual(stats["mean_latency"], 1.5)
+        self.assertAlmostEqual(stats["last_latency"], 1.0)
+
+    def test_no_tasks(self, m):
+        stats = calculation_lanes.get_stats()["bulk"]
+        self.assertEqual(stats["depth"], 0)
+        self.assertIsNone(stats["mean_latency"])
+
+    def test_unknown_lane_is_ignored(self, m):
+        calculation_lanes.record_start(None, None)
+        self.assertEqual(calculation_lanes.get_stats()["bulk"]["started"], 0)
@@ -0,0 +1,60 @@
+import datetime as dt
+
+from django.test import TestCase, override_settings
+
+import numpy as np
+import pandas as pd
+from model_mommy import mommy
+
+from aira import kc_curves, models
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class GetKcTestCase(TestCase):
+    def setUp(self):
+        self.crop_type = mommy.make(
+            models.CropType,
+            kc_offseason=0.3,
+            kc_plantingdate=0.5,
+            planting_date=models.DayAndMonth(3, 3),
+        )
+        self.stage = models.CropTypeKcStage.objects.create(
+            crop_type=self.crop_type, order=1, ndays=2, kc_end=0.9
+        )
+        self.planting_date = dt.date(2018, 3, 3)
+        self.index = pd.date_range("2018-03-01 23:59", periods=6, freq="D")
+
+    def _get_kc(self):
+        crop_type = models.CropType.objects.get(id=self.crop_type.id)
+        return kc_curves.get_kc(crop_type, self.planting_date, self.index)
+
+    def test_values(self):
+        np.testing.assert_allclose(self._get_kc(), [0.3, 0.3, 0.7, 0.9, 0.3, 0.3])
+
+    def test_curve_is_shared(self):
+        self.assertIs(self._get_kc(), self._get_kc())
+
+    def test_curve_is_read_only(self):
+        with self.assertRaises(ValueError):
+            self._get_kc()[0] = 1
+
+    def test_changing_stage_invalidates(self):
+        self._get_kc()
+        self.stage.kc_end = 1.1
+        self.stage.save()
+        np.testing.assert_allclose(self._get_kc(), [0.3, 0.3, 0.8, 1.1, 0.3, 0.3])
+
+    def test_changing_crop_type_invalidates(self):
+        self._get_kc()
+        self.crop_type.kc_offseason = 0.2
+        self.crop_type.save()
+        np.testing.assert_allclose(self._get_kc(), [0.2, 0.2, 0.7, 0.9, 0.2, 0.2])
+
+    def test_other_process_sees_invalidation(self):
+        version = kc_curves.get_version()
+        models.CropTypeKcStage.objects.create(
+            crop_type=self.crop_type, order=2, ndays=1, kc_end=0.4
+        )
+        self.assertNotEqual(kc_curves.get_version(), version)
@@ -0,0 +1,90 @@
+import datetime as dt
+
+from django.test import SimpleTestCase
+
+import numpy as np
+import pandas as pd
+
+from aira.model_results import (
+    decode_model_results,
+    decode_model_results_arrays,
+    encode_model_results,
+)
+
+
+class ModelResultsTestCase(SimpleTestCase):
+    def setUp(self):
+        index = pd.date_range("2018-03-15 23:59", periods=3, freq="D")
+        timeseries = pd.DataFrame(
+            {
+                "dr": [1.5, 2.5, 3.5],
+                "recommendation": [False, True, False],
+                "actual_net_irrigation": pd.Series([0, "fc", 12.5], dtype=object),
+            },
+            index=index,
+        )
+        self.data = encode_model_results(
+            {
+                "raw": 142.5,
+                "taw": 285.0,
+                "historical_end_date": index[1],
+                "forecast_start_date": index[2],
+                "timeseries": timeseries,
+            }
+        )
+        self.results = decode_model_results(self.data)
+
+    def test_is_bytes(self):
+        self.assertIsInstance(self.data, bytes)
+
+    def test_scalars(self):
+        self.assertEqual(self.results["raw"], 142.5)
+        self.assertEqual(self.results["taw"], 285.0)
+
+    def test_dates(self):
+        self.assertEqual(
+            self.results["historical_end_date"], dt.datetime(2018, 3, 16, 23, 59)
+        )
+        self.assertEqual(
+            self.results["forecast_start_date"], dt.datetime(2018, 3, 17, 23, 59)
+        )
+
+    def test_index(self):
+        self.assertEqual(
+            list(self.results["timeseries"].index),
+            list(pd.date_range("2018-03-15 23:59", periods=3, freq="D")),
+        )
+
+    def test_float_column(self):
+        np.testing.assert_equal(self.results["timeseries"]["dr"], [1.5, 2.5, 3.5])
+
+    def test_bool_column(self):
+        self.assertEqual(
+            self.results["timeseries"]["recommendation"].tolist(), [False, True, False]
+        )
+
+    def test_object_column_is_coerced_to_float(self):
+        np.testing.assert_equal(
+            self.results["timeseries"]["actual_net_irrigation"], [0, np.nan, 12.5]
+        )
+
+    def test_arrays_share_memory_with_data(self):
+        header, index, floats, bools = decode_model_results_arrays(self.data)
+        self.assertTrue(
+            np.shares_memory(floats, np.frombuffer(self.data, dtype=np.uint8))
+        )
+
+    def test_legacy_results_are_returned_unchanged(self):
+        legacy = {"raw": 1, "timeseries": pd.DataFrame()}
+        self.assertIs(decode_model_results(legacy), legacy)
+        self.assertIsNone(decode_model_results(None))
+
+    def test_profile_is_none_if_missing(self):
+        self.assertIsNone(self.results["profile"])
+
+    def test_profile(self):
+        profile = {"total": 0.5, "spans": {"swb": 0.25}, "counters": {"db_queries": 3}}
+        results = decode_model_results(
+            encode_model_results({**self.results, "profile": profile})
+        )
+        self.assertEqual(results["profile"], profile)
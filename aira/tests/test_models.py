@@ -10,6 +10,7 @@ from django.core.files.base import ContentFile
 from django.db import IntegrityError
 from django.test import TestCase, override_settings
 
+import pytz
 from freezegun import freeze_time
 from model_mommy import mommy
 from swb import KcStage
@@ -508,6 +509,61 @@ class AppliedIrrigationTestCase(TestCase):
             self.assertIsNone(irrigation.volume)
 
 
+class AppliedIrrigationDailyTotalsTestCase(TestCase):
+    def setUp(self):
+        self.agrifield = mommy.make(models.Agrifield, crop_type__planting_date="15/03")
+        self._make(
+            dt.datetime(2018, 3, 15, 7, 0),
+            irrigation_type="VOLUME_OF_WATER",
+            supplied_water_volume=100,
+        )
+        self._make(
+            dt.datetime(2018, 3, 15, 9, 0),
+            irrigation_type="DURATION_OF_IRRIGATION",
+            supplied_duration=60,
+            supplied_flow_rate=50,
+        )
+        # 2018-03-16 01:30 in Europe/Athens
+        self._make(
+            dt.datetime(2018, 3, 15, 23, 30),
+            irrigation_type="FLOWMETER_READINGS",
+            flowmeter_reading_start=1000,
+            flowmeter_reading_end=1010,
+            flowmeter_water_percentage=50,
+        )
+        self._make(
+            dt.datetime(2018, 3, 16, 7, 0),
+            irrigation_type="VOLUME_OF_WATER",
+            supplied_water_volume=None,
+        )
+        self.totals = list(
+            models.AppliedIrrigation.objects.daily_totals(
+                pytz.timezone("Europe/Athens")
+            )
+        )
+
+    def _make(self, timestamp, **kwargs):
+        mommy.make(
+            models.AppliedIrrigation,
+            agrifield=self.agrifield,
+            timestamp=timestamp.replace(tzinfo=dt.timezone.utc),
+            **kwargs,
+        )
+
+    def test_dates(self):
+        self.assertEqual(
+            [x["date"] for x in self.totals],
+            [dt.date(2018, 3, 15), dt.date(2018, 3, 16)],
+        )
+
+    def test_volumes(self):
+        self.assertAlmostEqual(self.totals[0]["volume"], 150)
+        self.assertAlmostEqual(self.totals[1]["volume"], 20)
+
+    def test_unknown_volumes(self):
+        self.assertEqual([x["nunknown"] for x in self.totals], [0, 1])
+
+
 class AppliedIrrigationUniqueTogetherConstraintTestCase(TestCase):
     def test_duplicate_point_raises(self):
         time = dt.datetime(2020, 10, 10, 0, 0, tzinfo=dt.timezone.utc)
@@ -0,0 +1,51 @@
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from aira import profiling
+
+
+class ProfilingTestCase(TestCase):
+    def test_span(self):
+        with patch("time.perf_counter", side_effect=[10, 11, 13.5, 14, 15]):
+            with profiling.profiling() as profile:
+                with profiling.span("stage"):
+                    pass
+                with profiling.span("stage"):
+                    pass
+        self.assertEqual(profile.spans, {"stage": 3.5})
+
+    def test_count(self):
+        with profiling.profiling() as profile:
+            profiling.count("rasters_opened")
+            profiling.count("rasters_opened", 2)
+        self.assertEqual(profile.counters, {"rasters_opened": 3})
+
+    def test_db_queries(self):
+        with profiling.profiling() as profile:
+            User.objects.count()
+            User.objects.count()
+        self.assertEqual(profile.counters, {"db_queries": 2})
+
+    def test_nested_profiles(self):
+        with profiling.profiling() as outer:
+            User.objects.count()
+            with profiling.profiling() as inner:
+                User.objects.count()
+            self.assertIs(profiling.get_current_profile(), outer)
+        self.assertEqual(outer.counters, {"db_queries": 2})
+        self.assertEqual(inner.counters, {"db_queries": 1})
+
+    def test_nothing_is_recorded_outside_profiling(self):
+        with profiling.span("stage"):
+            profiling.count("rasters_opened")
+        self.assertIsNone(profiling.get_current_profile())
+
+    def test_log_profile(self):
+        with profiling.profiling() as profile:
+            profiling.count("rasters_opened")
+        with self.assertLogs("aira.profiling") as logs:
+            profiling.log_profile(profile, agrifield_id=42)
+        self.assertIn('"agrifield_id": 42', logs.output[0])
+        self.assertIn('"counters": {"rasters_opened": 1}', logs.output[0])
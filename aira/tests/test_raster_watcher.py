@@ -0,0 +1,134 @@
+import os
+import shutil
+from unittest import mock
+
+from django.conf import settings
+
+import numpy as np
+
+from aira import tasks
+from aira.raster_watcher import RasterWatcher
+from aira.tests.test_agrifield import DataTestCase, setup_input_file
+from aira.timeseries_store import TimeseriesStore
+
+
+class RasterWatcherTestCase(DataTestCase):
+    def setUp(self):
+        super().setUp()
+        self.prefix = os.path.join(settings.AIRA_DATA_HISTORICAL, "daily_rain")
+        self.filename = self.prefix + "-2018-03-16.tif"
+        self.backup_filename = os.path.join(self.tempdir, "backup.tif")
+        shutil.copy2(self.filename, self.backup_filename)
+        TimeseriesStore(self.prefix).update()
+        watcher = RasterWatcher()
+        self.assertEqual(watcher.find_affected_agrifields(), [])
+        watcher.save()
+
+    def tearDown(self):
+        shutil.move(self.backup_filename, self.filename)
+        for filename in (
+            self.prefix + "-2018-03-14.tif",
+            RasterWatcher().catalog_filename,
+        ):
+            if os.path.exists(filename):
+                os.remove(filename)
+        super().tearDown()
+
+    def _get_affected_agrifields(self):
+        watcher = RasterWatcher()
+        result = watcher.find_affected_agrifields()
+        watcher.save()
+        return result
+
+    def test_nothing_changed(self):
+        self.assertEqual(self._get_affected_agrifields(), [])
+
+    def test_new_raster_affects_all_agrifields(self):
+        setup_input_file(
+            self.prefix + "-2018-03-14.tif", np.array([[1.0, 1], [1, 1]]), "2018-03-14"
+        )
+        self.assertEqual(self._get_affected_agrifields(), [self.agrifield])
+
+    def test_removed_raster_affects_all_agrifields(self):
+        os.remove(self.filename)
+        self.assertEqual(self._get_affected_agrifields(), [self.agrifield])
+
+    def test_changed_pixel_of_agrifield(self):
+        setup_input_file(
+            self.filename, np.array([[4.0, 0.6], [0.7, 0.8]]), "2018-03-16"
+        )
+        self.assertEqual(self._get_affected_agrifields(), [self.agrifield])
+
+    def test_changed_pixel_of_no_agrifield(self):
+        setup_input_file(
+            self.filename, np.array([[5.0, 0.6], [0.7, 9.0]]), "2018-03-16"
+        )
+        self.assertEqual(self._get_affected_agrifields(), [])
+
+    def test_same_contents_affect_nothing(self):
+        shutil.copy(self.backup_filename, self.filename)
+        self.assertEqual(self._get_affected_agrifields(), [])
+
+    def test_changes_are_reported_once(self):
+        setup_input_file(
+            self.filename, np.array([[4.0, 0.6], [0.7, 0.8]]), "2018-03-16"
+        )
+        self._get_affected_agrifields()
+        self.assertEqual(self._get_affected_agrifields(), [])
+
+    def test_store_read_between_change_and_watcher_run(self):
+        setup_input_file(
+            self.filename, np.array([[5.0, 0.6], [0.7, 9.0]]), "2018-03-16"
+        )
+        TimeseriesStore(self.prefix).get_series(self.agrifield.location)
+        self.assertEqual(self._get_affected_agrifields(), [])
+
+    def test_raster_replaced_twice_affects_all_agrifields(self):
+        setup_input_file(
+            self.filename, np.array([[5.0, 0.6], [0.7, 9.0]]), "2018-03-16"
+        )
+        os.utime(self.filename, ns=(0, 0))
+        TimeseriesStore(self.prefix).update()
+        setup_input_file(
+            self.filename, np.array([[5.0, 0.6], [0.7, 8.0]]), "2018-03-16"
+        )
+        os.utime(self.filename, ns=(1, 1))
+        TimeseriesStore(self.prefix).update()
+        self.assertEqual(self._get_affected_agrifields(), [self.agrifield])
+
+    def _change_forecast_raster(self):
+        filename = os.path.join(
+            settings.AIRA_DATA_FORECAST, "daily_rain-2018-03-18.tif"
+        )
+        backup_filename = os.path.join(self.tempdir, "forecast_backup.tif")
+        shutil.copy2(filename, backup_filename)
+        self.addCleanup(shutil.move, backup_filename, filename)
+        setup_input_file(filename, np.array([[0.9, 0.2], [0.1, 0.0]]), "2018-03-18")
+
+    def test_forecast_only(self):
+        self._change_forecast_raster()
+        watcher = RasterWatcher()
+        self.assertEqual(watcher.find_affected_agrifields(), [self.agrifield])
+        self.assertTrue(watcher.forecast_only)
+
+    def test_not_forecast_only(self):
+        setup_input_file(
+            self.filename, np.array([[4.0, 0.6], [0.7, 0.8]]), "2018-03-16"
+        )
+        watcher = RasterWatcher()
+        watcher.find_affected_agrifields()
+        self.assertFalse(watcher.forecast_only)
+
+    @mock.patch("aira.tasks.calculate_agrifields_in_chunks")
+    def test_task_refreshes_forecasts(self, m):
+        self._change_forecast_raster()
+        self.assertEqual(tasks.recalculate_for_changed_rasters(), 1)
+        m.assert_called_once_with([self.agrifield.id], task=tasks.refresh_forecasts)
+
+    @mock.patch("aira.tasks.queue_for_calculation")
+    def test_task(self, m):
+        setup_input_file(
+            self.filename, np.array([[4.0, 0.6], [0.7, 0.8]]), "2018-03-16"
+        )
+        self.assertEqual(tasks.recalculate_for_changed_rasters(), 1)
+        m.assert_called_once_with([self.agrifield], lane="bulk")
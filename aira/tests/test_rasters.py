@@ -0,0 +1,97 @@
+import datetime as dt
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.contrib.gis.geos import Point
+from django.test import SimpleTestCase
+
+import numpy as np
+from osgeo import gdal
+
+from aira.rasters import RasterPool, extract_points_from_rasters
+from aira.tests.test_agrifield import setup_input_file
+
+
+class RasterPoolTestCase(SimpleTestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, "fc.tif")
+        setup_input_file(self.filename, np.array([[0.4, 0.45], [0.50, 0.55]]), None)
+        self.pool = RasterPool()
+
+    def tearDown(self):
+        self.pool.clear()
+        shutil.rmtree(self.tempdir)
+
+    def test_extract_point(self):
+        value = self.pool.extract_point(Point(22.0, 38.0), self.filename)
+        self.assertAlmostEqual(value, 0.4)
+
+    def test_file_is_opened_only_once(self):
+        dataset1 = self.pool.get(self.filename).dataset
+        dataset2 = self.pool.get(self.filename).dataset
+        self.assertIs(dataset1, dataset2)
+
+    def test_file_is_reopened_when_modified(self):
+        dataset1 = self.pool.get(self.filename).dataset
+        setup_input_file(self.filename, np.array([[0.3, 0.45], [0.50, 0.55]]), None)
+        os.utime(self.filename, ns=(0, 0))
+        dataset2 = self.pool.get(self.filename).dataset
+        self.assertIsNot(dataset1, dataset2)
+        value = self.pool.extract_point(Point(22.0, 38.0), self.filename)
+        self.assertAlmostEqual(value, 0.3)
+
+    def test_missing_file(self):
+        with self.assertRaises(RuntimeError):
+            self.pool.get(os.path.join(self.tempdir, "nonexistent.tif"))
+
+
+class ExtractPointsFromRastersTestCase(SimpleTestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.tempdir, "daily_rain")
+        for day, value in ((16, 1.0), (14, 2.0), (15, np.nan)):
+            setup_input_file(
+                f"{self.prefix}-2018-03-{day}.tif",
+                np.array([[value, 0.5], [0.75, day]]),
+                f"2018-03-{day}",
+            )
+        self.points = [Point(22.0, 38.0), Point(22.015, 37.985), Point(30.0, 30.0)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_index(self):
+        index, values = extract_points_from_rasters(
+            self.points, self.prefix, default_time=dt.time(23, 59)
+        )
+        self.assertEqual(
+            list(index),
+            [
+                dt.datetime(2018, 3, 14, 23, 59),
+                dt.datetime(2018, 3, 15, 23, 59),
+                dt.datetime(2018, 3, 16, 23, 59),
+            ],
+        )
+
+    def test_values(self):
+        index, values = extract_points_from_rasters(self.points, self.prefix)
+        np.testing.assert_allclose(
+            values,
+            [[2.0, 14.0, np.nan], [np.nan, 15.0, np.nan], [1.0, 16.0, np.nan]],
+        )
+
+    def test_start_date(self):
+        index, values = extract_points_from_rasters(
+            self.points, self.prefix, start_date=dt.datetime(2018, 3, 15)
+        )
+        self.assertEqual(len(index), 2)
+        self.assertEqual(values.shape, (2, 3))
+        self.assertEqual(values[1, 1], 16.0)
+
+    def test_each_raster_is_opened_once(self):
+        with mock.patch("aira.rasters.gdal.Open", wraps=gdal.Open) as m:
+            extract_points_from_rasters(self.points * 10, self.prefix)
+        self.assertEqual(m.call_count, 3)
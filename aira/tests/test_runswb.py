@@ -0,0 +1,44 @@
+from io import StringIO
+from unittest import mock
+
+from django.core import management
+from django.core.cache import cache
+from django.test import override_settings
+
+from aira.tests.test_agrifield import DataTestCase
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class RunSWBWithWorkersTestCase(DataTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.out = StringIO()
+        with mock.patch("aira.tasks.calculate_agrifield.apply_async") as self.m:
+            management.call_command("runswb", "--workers", "1", stdout=self.out)
+
+    def test_does_not_queue_to_celery(self):
+        self.m.assert_not_called()
+
+    def test_stores_results(self):
+        self.assertIsNotNone(self.agrifield.results)
+
+    def test_status(self):
+        self.assertEqual(self.agrifield.status, "done")
+
+    def test_reports_progress(self):
+        self.assertIn("Calculated 1/1 fields", self.out.getvalue())
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class RunSWBWithoutWorkersTestCase(DataTestCase):
+    def test_queues_to_celery(self):
+        cache.clear()
+        with mock.patch("aira.tasks.calculate_agrifield.apply_async") as m:
+            management.call_command("runswb")
+        m.assert_called_once()
+        self.assertEqual(m.call_args[1]["queue"], "bulk")
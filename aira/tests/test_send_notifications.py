@@ -1,6 +1,8 @@
+from io import StringIO
 from unittest import mock
 
 from django.core import mail, management
+from django.core.mail import get_connection
 from django.test import override_settings
 
 from aira.tests.test_agrifield import DataTestCase
@@ -9,7 +11,7 @@ from aira.tests.test_agrifield import DataTestCase
 @override_settings(
     CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
 )
-class SendNotificationsTestCase(DataTestCase):
+class SendNotificationsDataTestCase(DataTestCase):
     @classmethod
     def setUpTestData(cls):
         super().setUpTestData()
@@ -19,6 +21,8 @@ class SendNotificationsTestCase(DataTestCase):
         cls.user.profile.save()
         cls.agrifield.execute_model()
 
+
+class SendNotificationsTestCase(SendNotificationsDataTestCase):
     # We don't let send_notifications use logging, otherwise the rest of the
     # unit tests somehow start polluting the output with messages
     @mock.patch("aira.management.commands.send_notifications.logging")
@@ -27,3 +31,38 @@ class SendNotificationsTestCase(DataTestCase):
 
     def test_has_sent_email(self):
         self.assertTrue(len(mail.outbox) > 0)
+
+
+class SendNotificationsPipelineTestCase(SendNotificationsDataTestCase):
+    @mock.patch("aira.management.commands.send_notifications.logging")
+    def test_dry_run_sends_nothing(self, m):
+        out = StringIO()
+        management.call_command("send_notifications", "--dry-run", stdout=out)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertIn("Rendered 1 notifications", out.getvalue())
+
+    @mock.patch("aira.management.commands.send_notifications.logging")
+    def test_uses_single_connection(self, m):
+        with mock.patch(
+            "aira.management.commands.send_notifications.get_connection",
+            wraps=get_connection,
+        ) as m_get_connection:
+            management.call_command("send_notifications")
+        m_get_connection.assert_called_once_with()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["bob@antonischristofides.com"])
+
+    @mock.patch("aira.management.commands.send_notifications.logging")
+    def test_no_notification_when_not_due(self, m):
+        self.user.profile.notification = ""
+        self.user.profile.save()
+        management.call_command("send_notifications")
+        self.assertEqual(len(mail.outbox), 0)
+
+    @mock.patch("aira.management.commands.send_notifications.logging")
+    def test_worker_closes_its_database_connections(self, m):
+        with mock.patch(
+            "aira.management.commands.send_notifications.connections"
+        ) as m_connections:
+            management.call_command("send_notifications")
+        m_connections.close_all.assert_called_once_with()
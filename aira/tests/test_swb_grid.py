@@ -0,0 +1,78 @@
+import os
+from glob import glob
+from io import StringIO
+
+from django.conf import settings
+from django.core import management
+
+import numpy as np
+import pandas as pd
+from osgeo import gdal
+
+from aira.tests.test_agrifield import DataTestCase
+
+
+class CalculateSWBGridsTestCase(DataTestCase):
+    def setUp(self):
+        super().setUp()
+        self.performance = self.agrifield.calculate_performance(
+            self.agrifield.execute_model()
+        )
+        self.out = StringIO()
+        management.call_command("calculate_swb_grids", stdout=self.out)
+
+    def tearDown(self):
+        for directory in (settings.AIRA_DATA_HISTORICAL, settings.AIRA_DATA_FORECAST):
+            for filename in glob(os.path.join(directory, "swb_crop*")):
+                os.remove(filename)
+        super().tearDown()
+
+    def _read_pixel(self, variable, date, directory):
+        filename = os.path.join(
+            directory,
+            "swb_crop{}_{}-{}.tif".format(self.crop_type.id, variable, date),
+        )
+        dataset = gdal.Open(filename)
+        try:
+            return dataset.GetRasterBand(1).ReadAsArray()[0, 0]
+        finally:
+            dataset = None
+
+    def test_historical_theta(self):
+        expected = self.performance.at[
+            pd.Timestamp("2018-03-16 23:59"), "theta_theoretical"
+        ]
+        value = self._read_pixel("theta", "2018-03-16", settings.AIRA_DATA_HISTORICAL)
+        self.assertAlmostEqual(value, expected, places=5)
+
+    def test_forecast_irrigation_need(self):
+        expected = self.performance.at[
+            pd.Timestamp("2018-03-19 23:59"), "recommended_net_irrigation_theoretical"
+        ]
+        value = self._read_pixel(
+            "irrigation_need", "2018-03-19", settings.AIRA_DATA_FORECAST
+        )
+        self.assertAlmostEqual(value, expected, places=4)
+
+    def test_files(self):
+        historical = glob(os.path.join(settings.AIRA_DATA_HISTORICAL, "swb_crop*"))
+        forecast = glob(os.path.join(settings.AIRA_DATA_FORECAST, "swb_crop*"))
+        self.assertEqual(len(historical), 9)
+        self.assertEqual(len(forecast), 6)
+
+    def test_output(self):
+        self.assertIn("Grass: 4 pixels, 5 days", self.out.getvalue())
+
+    def test_timestamp(self):
+        filename = os.path.join(
+            settings.AIRA_DATA_FORECAST,
+            "swb_crop{}_dr-2018-03-18.tif".format(self.crop_type.id),
+        )
+        dataset = gdal.Open(filename)
+        try:
+            self.assertEqual(dataset.GetMetadata()["TIMESTAMP"], "2018-03-18")
+        finally:
+            dataset = None
+        self.assertFalse(
+            np.isnan(self._read_pixel("dr", "2018-03-18", settings.AIRA_DATA_FORECAST))
+        )
@@ -7,7 +7,12 @@ import requests
 from model_mommy import mommy
 
 from aira import models
-from aira.tasks import _get_ttn_data, add_irrigations_from_telemetric_flowmeters
+from aira.tasks import (
+    _get_ttn_data,
+    add_irrigations_from_telemetric_flowmeters,
+    calculate_agrifields_in_chunks,
+    chunk_ids,
+)
 
 
 class MockResponse(requests.Response):
@@ -148,3 +153,44 @@ class LoRA_ARTAFlowmeterTTNIntegrationTestCase(TestCase):
         mocked_get.return_value = MockInvalidResponse()
         result = _get_ttn_data()
         self.assertEqual(result, [])
+
+
+class ChunkIdsTestCase(TestCase):
+    def test_chunks(self):
+        self.assertEqual(chunk_ids([1, 2, 3, 4, 5], 2), [[1, 2], [3, 4], [5]])
+
+    def test_empty(self):
+        self.assertEqual(chunk_ids([], 2), [])
+
+
+@patch("aira.tasks.chord")
+@patch("aira.tasks.group")
+@patch("aira.tasks.app")
+class CalculateAgrifieldsInChunksTestCase(TestCase):
+    def test_dispatches_one_task_per_chunk(self, m_app, m_group, m_chord):
+        m_app.conf.result_backend = None
+        calculate_agrifields_in_chunks([1, 2, 3], chunk_size=2)
+        signatures = list(m_group.call_args[0][0])
+        self.assertEqual([s.args for s in signatures], [([1, 2],), ([3],)])
+
+    def test_payload_is_ids(self, m_app, m_group, m_chord):
+        m_app.conf.result_backend = None
+        calculate_agrifields_in_chunks([1, 2, 3], chunk_size=2, countdown=5)
+        signatures = list(m_group.call_args[0][0])
+        self.assertEqual(json.loads(json.dumps(signatures[0].args)), [[1, 2]])
+        self.assertEqual(signatures[0].options["countdown"], 5)
+
+    def test_without_result_backend_dispatches_group(self, m_app, m_group, m_chord):
+        m_app.conf.result_backend = None
+        calculate_agrifields_in_chunks([1, 2, 3], chunk_size=2)
+        m_group.return_value.apply_async.assert_called_once_with()
+        m_chord.assert_not_called()
+
+    def test_with_result_backend_uses_chord(self, m_app, m_group, m_chord):
+        m_app.conf.result_backend = "redis://"
+        calculate_agrifields_in_chunks([1, 2, 3], chunk_size=2)
+        m_chord.assert_called_once_with(m_group.return_value)
+
+    def test_nothing_to_dispatch(self, m_app, m_group, m_chord):
+        self.assertIsNone(calculate_agrifields_in_chunks([]))
+        m_group.assert_not_called()
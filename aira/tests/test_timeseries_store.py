@@ -0,0 +1,171 @@
+import datetime as dt
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.contrib.gis.geos import Point
+from django.test import SimpleTestCase, override_settings
+
+import numpy as np
+
+from aira.rasters import RasterGrid, get_file_version, write_raster
+from aira.tests.test_agrifield import setup_input_file
+from aira.timeseries_store import (
+    PixelSeriesCache,
+    TimeseriesStore,
+    _grid_from_json,
+    pixel_series_cache,
+)
+
+
+class TimeseriesStoreTestCase(SimpleTestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.settings_overrider = override_settings(
+            AIRA_TIMESERIES_CACHE_DIR=os.path.join(self.tempdir, "cache")
+        )
+        self.settings_overrider.__enter__()
+        self.prefix = os.path.join(self.tempdir, "daily_rain")
+        self._create_raster("2018-03-15", 1.0)
+        self._create_raster("2018-03-16", np.nan)
+        self.point = Point(22.015, 37.985)
+        self.store = TimeseriesStore(self.prefix)
+        pixel_series_cache.clear()
+
+    def tearDown(self):
+        self.settings_overrider.__exit__(None, None, None)
+        shutil.rmtree(self.tempdir)
+
+    def _create_raster(self, datestr, value):
+        setup_input_file(
+            f"{self.prefix}-{datestr}.tif",
+            np.array([[0.5, 0.25], [0.75, value]]),
+            datestr,
+        )
+
+    def test_get_series(self):
+        series = self.store.get_series(self.point, default_time=dt.time(23, 59))
+        self.assertEqual(
+            list(series.index),
+            [dt.datetime(2018, 3, 15, 23, 59), dt.datetime(2018, 3, 16, 23, 59)],
+        )
+        np.testing.assert_equal(series.values, [1.0, np.nan])
+
+    def test_get(self):
+        index, values = self.store.get(
+            [Point(22.0, 38.0), self.point, Point(30.0, 30.0)],
+            start_date=dt.datetime(2018, 3, 16),
+        )
+        self.assertEqual(list(index), [dt.datetime(2018, 3, 16)])
+        np.testing.assert_equal(values, [[0.5, np.nan, np.nan]])
+
+    def test_rasters_are_read_once(self):
+        self.store.update()
+        with mock.patch("aira.timeseries_store.gdal.Open") as m:
+            self.store.get_series(self.point)
+        m.assert_not_called()
+
+    def test_new_raster_is_appended(self):
+        self.store.update()
+        self._create_raster("2018-03-17", 3.0)
+        with mock.patch.object(self.store, "_rebuild") as m:
+            series = self.store.get_series(self.point)
+        m.assert_not_called()
+        np.testing.assert_equal(series.values, [1.0, np.nan, 3.0])
+
+    def test_earlier_raster_causes_rebuild(self):
+        self.store.update()
+        self._create_raster("2018-03-14", 4.0)
+        series = self.store.get_series(self.point)
+        np.testing.assert_equal(series.values, [4.0, 1.0, np.nan])
+
+    def test_modified_raster_causes_rebuild(self):
+        self.store.update()
+        self._create_raster("2018-03-15", 5.0)
+        os.utime(f"{self.prefix}-2018-03-15.tif", ns=(0, 0))
+        series = self.store.get_series(self.point)
+        np.testing.assert_equal(series.values, [5.0, np.nan])
+
+    def test_removed_raster_causes_rebuild(self):
+        self.store.update()
+        os.remove(f"{self.prefix}-2018-03-15.tif")
+        series = self.store.get_series(self.point)
+        np.testing.assert_equal(series.values, [np.nan])
+
+    def test_leftover_rows_are_discarded(self):
+        self.store.update()
+        with open(self.store.data_filename, "ab") as f:
+            f.write(b"garbage")
+        self._create_raster("2018-03-17", 3.0)
+        series = self.store.get_series(self.point)
+        np.testing.assert_equal(series.values, [1.0, np.nan, 3.0])
+
+    def test_raster_with_different_grid_is_resampled(self):
+        self.store.update()
+        grid = RasterGrid(
+            (22.0, 0.005, 0, 38.0, 0, -0.005),
+            _grid_from_json(self.store._read_catalog()["grid"]).projection,
+            (4, 4),
+        )
+        write_raster(
+            f"{self.prefix}-2018-03-17.tif", grid, np.full((4, 4), 3.0), "2018-03-17"
+        )
+        with self.assertLogs("aira.timeseries_store", level="WARNING"):
+            series = self.store.get_series(self.point)
+        np.testing.assert_equal(series.values, [1.0, np.nan, 3.0])
+
+    def test_changed_pixels(self):
+        self.store.update()
+        filename = f"{self.prefix}-2018-03-15.tif"
+        old_version = list(get_file_version(filename))
+        self._create_raster("2018-03-15", 5.0)
+        os.utime(filename, ns=(0, 0))
+        grid, changed = self.store.get_changed_pixels(
+            {"daily_rain-2018-03-15.tif": old_version}
+        )
+        np.testing.assert_equal(changed, [False, False, False, True])
+
+    def test_changed_pixels_after_update(self):
+        self.store.update()
+        filename = f"{self.prefix}-2018-03-15.tif"
+        old_version = list(get_file_version(filename))
+        self._create_raster("2018-03-15", 5.0)
+        os.utime(filename, ns=(0, 0))
+        self.store.get_series(self.point)
+        grid, changed = self.store.get_changed_pixels(
+            {"daily_rain-2018-03-15.tif": old_version}
+        )
+        np.testing.assert_equal(changed, [False, False, False, True])
+
+    def test_points_in_same_pixel_share_series(self):
+        index, values = self.store.get([Point(22.001, 37.999), Point(22.009, 37.991)])
+        np.testing.assert_equal(values, [[0.5, 0.5], [0.5, 0.5]])
+        self.assertEqual(len(pixel_series_cache), 1)
+
+    def test_cached_series_is_used(self):
+        self.store.get([self.point])
+        with mock.patch.object(
+            pixel_series_cache, "set", wraps=pixel_series_cache.set
+        ) as m:
+            index, values = self.store.get([self.point])
+        m.assert_not_called()
+        np.testing.assert_equal(values, [[1.0], [np.nan]])
+
+    def test_cached_series_is_not_used_after_update(self):
+        self.store.get([self.point])
+        self._create_raster("2018-03-17", 3.0)
+        index, values = self.store.get([self.point])
+        np.testing.assert_equal(values, [[1.0], [np.nan], [3.0]])
+
+
+class PixelSeriesCacheTestCase(SimpleTestCase):
+    def test_least_recently_used_is_evicted(self):
+        cache = PixelSeriesCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
@@ -1,4 +1,5 @@
 import datetime as dt
+import json
 import os
 import re
 import shutil
@@ -15,6 +16,7 @@ from django.core.files.base import ContentFile
 from django.http import HttpRequest
 from django.test import Client, TestCase, override_settings
 
+import numpy as np
 import pandas as pd
 import pytz
 from bs4 import BeautifulSoup
@@ -25,7 +27,7 @@ from selenium.webdriver.common.by import By
 
 from aira import models, views
 from aira.tests import RandomMediaRootMixin
-from aira.tests.test_agrifield import DataTestCase, SetupTestDataMixin
+from aira.tests.test_agrifield import DataTestCase, SetupTestDataMixin, setup_input_file
 
 
 class TestFrontPageView(TestCase):
@@ -379,24 +381,24 @@ class AgrifieldTimeseriesViewTestCase(WrongUsernameTestMixin, TestCase):
         self._override_settings()
         self._create_user()
         self._create_agrifield()
-        self._create_dummy_result_file()
+        self._create_rasters()
 
     def _create_tempdir(self):
         self.tempdir = tempfile.mkdtemp()
 
     def _override_settings(self):
         self.settings_overrider = override_settings(
-            AIRA_TIMESERIES_CACHE_DIR=self.tempdir
+            AIRA_TIMESERIES_CACHE_DIR=self.tempdir, AIRA_DATA_HISTORICAL=self.tempdir
         )
         self.settings_overrider.__enter__()
 
-    def _create_dummy_result_file(self):
-        self.dummy_result_pathname = os.path.join(
-            settings.AIRA_TIMESERIES_CACHE_DIR,
-            "agrifield{}-temperature.hts".format(self.agrifield.id),
-        )
-        with open(self.dummy_result_pathname, "w") as f:
-            f.write("These are the dummy result file contents")
+    def _create_rasters(self):
+        for datestr, value in (("2018-03-15", 12.5), ("2018-03-16", 13.25)):
+            setup_input_file(
+                os.path.join(self.tempdir, f"daily_temperature-{datestr}.tif"),
+                np.array([[value, 1.0], [2.0, 3.0]]),
+                datestr,
+            )
 
     def _create_user(self):
         self.alice = User.objects.create_user(
@@ -407,7 +409,7 @@ class AgrifieldTimeseriesViewTestCase(WrongUsernameTestMixin, TestCase):
         self.agrifield = mommy.make(
             models.Agrifield,
             name="hello",
-            location=Point(23, 38),
+            location=Point(22.005, 37.995),
             owner=self.alice,
             crop_type__planting_date="15/03",
         )
@@ -416,40 +418,37 @@ class AgrifieldTimeseriesViewTestCase(WrongUsernameTestMixin, TestCase):
         self.client.login(username="alice", password="topsecret")
 
     def _get_response(self):
-        patcher = patch(
-            "aira.models.PointTimeseries",
-            **{"return_value.get_cached.return_value": self.dummy_result_pathname},
-        )
-        with patcher as m:
-            self.mock_point_timeseries = m
-            self.response = self.client.get(
-                f"/alice/fields/{self.agrifield.id}/timeseries/temperature/"
-            )
+        self.response = self.client.get(
+            f"/alice/fields/{self.agrifield.id}/timeseries/temperature/"
+        )
 
     def tearDown(self):
         self.settings_overrider.__exit__(None, None, None)
         shutil.rmtree(self.tempdir)
 
-    def test_status_code(self):
-        self.assertEqual(self.response.status_code, 200)
-
-    def test_response_contents(self):
+    def _get_content(self):
         content = b""
         for chunk in self.response.streaming_content:
             content += chunk
-        self.assertEqual(content, b"These are the dummy result file contents")
+        return content.decode()
 
-    def test_called_point_timeseries(self):
-        self.mock_point_timeseries.assert_called_once_with(
-            point=self.agrifield.location,
-            prefix=os.path.join(settings.AIRA_DATA_HISTORICAL, "daily_temperature"),
-            default_time=dt.time(23, 59),
-        )
+    def test_status_code(self):
+        self.assertEqual(self.response.status_code, 200)
+
+    def test_response_contents(self):
+        content = self._get_content()
+        self.assertTrue(content.startswith("Version=2\r\n"))
+        self.assertIn("2018-03-15 23:59,12.500000,\r\n", content)
+        self.assertIn("2018-03-16 23:59,13.250000,\r\n", content)
 
-    def test_called_get_cached(self):
-        self.mock_point_timeseries.return_value.get_cached.assert_called_once_with(
-            self.dummy_result_pathname, version=2
+    def test_new_raster_is_included(self):
+        setup_input_file(
+            os.path.join(self.tempdir, "daily_temperature-2018-03-17.tif"),
+            np.array([[14.0, 1.0], [2.0, 3.0]]),
+            "2018-03-17",
         )
+        self._get_response()
+        self.assertIn("2018-03-17 23:59,14.000000,\r\n", self._get_content())
 
 
 class DownloadSoilAnalysisViewTestCase(
@@ -964,6 +963,119 @@ class IrrigationPerformanceCsvTestCase(WrongUsernameTestMixin, DataTestCase):
         self.assertAlmostEqual(value, 125.20833333)
 
 
+class IrrigationScenariosViewTestCase(DataTestCase):
+    def setUp(self):
+        super().setUp()
+        self.agrifield.execute_model()
+        self.client.login(username="bob", password="topsecret")
+
+    def _post(self, data, username="bob"):
+        return self.client.post(
+            f"/{username}/fields/{self.agrifield.id}/scenarios/",
+            data=json.dumps(data),
+            content_type="application/json",
+        )
+
+    def test_response(self):
+        response = self._post(
+            {"scenarios": [[], [{"date": "2018-03-18", "amount": 50}]]}
+        )
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(result["dates"][0], "2018-03-15")
+        self.assertEqual(len(result["scenarios"]), 2)
+        self.assertEqual(len(result["scenarios"][1]["theta"]), 5)
+        self.assertGreater(
+            result["scenarios"][1]["theta"][3], result["scenarios"][0]["theta"][3]
+        )
+
+    def test_invalid_date(self):
+        response = self._post({"scenarios": [[{"date": "hello", "amount": 50}]]})
+        self.assertEqual(response.status_code, 400)
+
+    def test_date_outside_results(self):
+        response = self._post({"scenarios": [[{"date": "2018-04-18", "amount": 5}]]})
+        self.assertEqual(response.status_code, 400)
+
+    def test_negative_amount(self):
+        response = self._post({"scenarios": [[{"date": "2018-03-18", "amount": -5}]]})
+        self.assertEqual(response.status_code, 400)
+
+    def test_infinite_amount(self):
+        for amount in (float("inf"), "inf"):
+            response = self._post(
+                {"scenarios": [[{"date": "2018-03-18", "amount": amount}]]}
+            )
+            self.assertEqual(response.status_code, 400)
+
+    def test_wrong_username(self):
+        response = self._post({"scenarios": [[]]}, username="antonis")
+        self.assertEqual(response.status_code, 404)
+
+    def test_too_many_scenarios(self):
+        response = self._post({"scenarios": [[]] * 21})
+        self.assertEqual(response.status_code, 400)
+
+    def test_too_many_irrigations(self):
+        irrigation = {"date": "2018-03-18", "amount": 1}
+        response = self._post({"scenarios": [[irrigation] * 367]})
+        self.assertEqual(response.status_code, 400)
+
+    def test_scenario_not_a_list(self):
+        response = self._post({"scenarios": [{"date": "2018-03-18", "amount": 1}]})
+        self.assertEqual(response.status_code, 400)
+
+
+class IrrigationScenariosCsrfTestCase(DataTestCase):
+    def setUp(self):
+        super().setUp()
+        self.agrifield.execute_model()
+        self.client = Client(enforce_csrf_checks=True)
+        self.client.login(username="bob", password="topsecret")
+        self.client.cookies["csrftoken"] = "a" * 64
+
+    def _post(self, **headers):
+        return self.client.post(
+            f"/bob/fields/{self.agrifield.id}/scenarios/",
+            data=json.dumps({"scenarios": [[]]}),
+            content_type="application/json",
+            **headers,
+        )
+
+    def test_without_token(self):
+        self.assertEqual(self._post().status_code, 403)
+
+    def test_with_token_in_header(self):
+        self.assertEqual(self._post(HTTP_X_CSRFTOKEN="a" * 64).status_code, 200)
+
+
+class IrrigationParameterSweepViewTestCase(WrongUsernameTestMixin, DataTestCase):
+    wrong_username_test_mixin_url_remainder = "sweep"
+
+    def setUp(self):
+        super().setUp()
+        self.agrifield.execute_model()
+        self.client.login(username="bob", password="topsecret")
+
+    def _get(self, query):
+        return self.client.get(f"/bob/fields/{self.agrifield.id}/sweep/?{query}")
+
+    def test_response(self):
+        response = self._get("mif=0.5&mif=0.8")
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual([x["mif"] for x in results], [0.5, 0.8])
+
+    def test_no_mif(self):
+        self.assertEqual(self._get("p=0.5").status_code, 400)
+
+    def test_mif_out_of_range(self):
+        self.assertEqual(self._get("mif=1.5").status_code, 400)
+
+    def test_invalid_p(self):
+        self.assertEqual(self._get("mif=0.5&p=hello").status_code, 400)
+
+
 class AppliedIrrigationsViewTestCase(WrongUsernameTestMixin, TestCase):
     wrong_username_test_mixin_url_remainder = "appliedirrigations"
 
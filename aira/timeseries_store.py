@@ -0,0 +1,456 @@
+import datetime as dt
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+import numpy as np
+import pandas as pd
+from osgeo import gdal
+
+from . import profiling
+from .rasters import (
+    RasterGrid,
+    get_dated_raster_filenames,
+    get_file_version,
+    parse_raster_timestamp,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class TimeseriesStore:
+    """Keeps the values of a set of daily rasters in a single memory-mapped file.
+
+    The rasters are the files "{prefix}-{date}.tif" (e.g.
+    "AIRA_DATA_HISTORICAL/daily_rain-2018-03-15.tif"), and they should all have
+    the same grid; a raster whose grid differs from the first one's is resampled to
+    it. The store is a directory in AIRA_TIMESERIES_CACHE_DIR that contains
+    "data.f32", a float32 matrix with one row per raster (in chronological order) and
+    one column per pixel, and "catalog.json", which describes the grid and the rasters
+    included in the matrix.
+
+    update() brings the store up to date. Rasters added after the last one in the
+    catalog have their rows appended to the matrix; if a raster has been modified or
+    removed, or a raster has been added before the last one, the store is rebuilt.
+    All other methods call update() before reading, so the time series of a point
+    always reflects the rasters currently on disk, but it is read from the matrix
+    without opening any raster.
+
+    When the store is rebuilt because rasters have been modified, the old rows of
+    these rasters are kept in the "replaced" subdirectory (and listed under
+    "replaced" in the catalog), so that get_changed_pixels() can compare the old
+    values with the new ones even if a reader has already updated the store.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        prefix_hash = hashlib.md5(prefix.encode()).hexdigest()[:12]
+        self.dirname = os.path.join(
+            settings.AIRA_TIMESERIES_CACHE_DIR,
+            "stores",
+            "{}-{}".format(os.path.basename(prefix), prefix_hash),
+        )
+        self.data_filename = os.path.join(self.dirname, "data.f32")
+        self.catalog_filename = os.path.join(self.dirname, "catalog.json")
+        self.replaced_dirname = os.path.join(self.dirname, "replaced")
+
+    def get(self, points, start_date=None, default_time=dt.time(0, 0)):
+        """Return the time series of many points.
+
+        The result is a tuple (index, values) like that of
+        rasters.extract_points_from_rasters().
+        """
+        catalog, data, data_version = self._get_matrix()
+        rows, index = self._get_rows(catalog, start_date, default_time)
+        if not rows:
+            return index, np.full((0, len(points)), np.nan)
+        pixels = self.get_pixels(catalog, points)
+        unique_pixels, inverse = np.unique(pixels, return_inverse=True)
+        columns = self._get_pixel_columns(data, data_version, unique_pixels, rows[0])
+        return index, columns[:, inverse]
+
+    def get_for_grid(self, grid, start_date=None, default_time=dt.time(0, 0)):
+        """Return the time series of all pixels of another grid, without reading them.
+
+        The result is a tuple (index, data, pixels). data is the part of the
+        memory-mapped matrix from start_date onwards (None if there are no rasters),
+        and pixels has one item for each pixel of grid (a rasters.RasterGrid), the
+        column of data that contains its center, or -1 if it is outside. The values
+        of the pixels of grid for which pixels >= 0 are data[:, pixels].
+        """
+        catalog, data = self.get_matrix()
+        rows, index = self._get_rows(catalog, start_date, default_time)
+        if not rows:
+            return index, None, np.full(grid.size[0] * grid.size[1], -1)
+        pixels = _grid_from_json(catalog["grid"]).get_pixels_of_grid(grid)
+        first_row = rows[0]
+        return index, data[first_row:], pixels
+
+    def _get_rows(self, catalog, start_date, default_time):
+        rasters = catalog["rasters"]
+        rows = [
+            i
+            for i, raster in enumerate(rasters)
+            if start_date is None or _parse_date(raster["date"]) >= start_date
+        ]
+        index = pd.DatetimeIndex(
+            [
+                parse_raster_timestamp(rasters[i]["timestamp"], default_time)
+                for i in rows
+            ]
+        )
+        return rows, index
+
+    def _get_pixel_columns(self, data, data_version, pixels, first_row):
+        """Return the values of the (unique) pixels from first_row onwards.
+
+        The result has one column per pixel (NaN for -1). The columns are taken from
+        pixel_series_cache if possible; the rest are read from the matrix at once
+        and added to the cache.
+        """
+        keys = [(self.dirname, data_version, pixel, first_row) for pixel in pixels]
+        result = np.full((data.shape[0] - first_row, len(pixels)), np.nan)
+        missing = []
+        for j, (pixel, key) in enumerate(zip(pixels, keys)):
+            if pixel < 0:
+                continue
+            cached = pixel_series_cache.get(key)
+            if cached is None:
+                missing.append(j)
+            else:
+                result[:, j] = cached
+        if missing:
+            result[:, missing] = data[first_row:, pixels[missing]]
+            for j in missing:
+                pixel_series_cache.set(keys[j], result[:, j].astype(np.float32))
+        return result
+
+    def get_series(self, point, default_time=dt.time(0, 0)):
+        """Return the time series of a point as a pandas Series.
+
+        The values of the series are a view of the memory-mapped matrix.
+        """
+        catalog, data = self.get_matrix()
+        index = pd.DatetimeIndex(
+            [
+                parse_raster_timestamp(raster["timestamp"], default_time)
+                for raster in catalog["rasters"]
+            ]
+        )
+        (pixel,) = self.get_pixels(catalog, [point])
+        if pixel < 0 or data is None:
+            return pd.Series(np.nan, index=index, dtype=np.float32)
+        return pd.Series(data[:, pixel], index=index, copy=False)
+
+    def get_matrix(self):
+        """Return a tuple (catalog, data), where data is the memory-mapped matrix.
+
+        data is None if there are no rasters.
+        """
+        catalog, data, data_version = self._get_matrix()
+        return catalog, data
+
+    def _get_matrix(self):
+        # Like get_matrix(), but also returns the number of rows and the version of
+        # the data file, which identify the contents of the matrix.
+        with self._lock():
+            catalog = self._update()
+            # The memory map must be created while holding the lock, because
+            # a rebuild by another process replaces the data file.
+            data = self._open_data(catalog)
+            data_version = (
+                len(catalog["rasters"]),
+                get_file_version(self.data_filename),
+            )
+            return catalog, data, data_version
+
+    def get_pixels(self, catalog, points):
+        """Return the column of each point in the matrix, or -1 if it's outside."""
+        if catalog["grid"] is None:
+            return np.full(len(points), -1)
+        grid = _grid_from_json(catalog["grid"])
+        rows, cols = grid.get_pixels(points)
+        return np.where(rows >= 0, rows * grid.size[1] + cols, -1)
+
+    def get_changed_pixels(self, versions):
+        """Find the pixels in which modified rasters differ from the stored values.
+
+        versions is a dictionary whose keys are the base names of rasters that have
+        been modified on disk, and whose values are the versions (see
+        rasters.get_file_version()) the rasters had before the modification. The
+        store is not updated; the current rasters are compared with the rows that
+        were stored for these versions, either in the matrix or, if the store has
+        been updated since, among the replaced rows.
+
+        Returns a tuple (grid, changed), where changed is a boolean array with one
+        item per pixel, or None if the changed pixels can't be determined; this
+        happens if the store doesn't have the old versions (e.g. because the raster
+        has been modified twice since) or if the grid has changed.
+        """
+        with self._lock():
+            catalog = self._read_catalog()
+            if catalog is None or not os.path.exists(self.data_filename):
+                return None
+            grid = None
+            changed = None
+            for filename, version in versions.items():
+                old = self._get_old_row(catalog, filename, version)
+                if old is None:
+                    return None
+                old_grid, old_values = old
+                new_grid, metadata, values = self._read_raster(filename)
+                grid = grid or old_grid
+                if old_grid != grid or new_grid != grid:
+                    return None
+                if changed is None:
+                    changed = np.zeros(len(values), dtype=bool)
+                changed |= ~(
+                    (old_values == values) | (np.isnan(old_values) & np.isnan(values))
+                )
+            return grid, changed
+
+    def _get_old_row(self, catalog, filename, version):
+        # Return (grid, values) of the given version of a raster, or None.
+        for i, raster in enumerate(catalog["rasters"]):
+            if raster["filename"] == filename and raster["version"] == version:
+                return _grid_from_json(catalog["grid"]), self._open_data(catalog)[i]
+        replaced = catalog.get("replaced", {}).get(filename)
+        if replaced is None or replaced["version"] != version:
+            return None
+        values = np.fromfile(
+            os.path.join(self.replaced_dirname, filename + ".f32"), dtype=np.float32
+        )
+        return _grid_from_json(replaced["grid"]), values
+
+    @property
+    def unit(self):
+        with self._lock():
+            return self._update()["unit"]
+
+    def update(self):
+        """Bring the store up to date with the rasters and return its catalog."""
+        with self._lock():
+            return self._update()
+
+    @contextmanager
+    def _lock(self):
+        os.makedirs(self.dirname, exist_ok=True)
+        with open(os.path.join(self.dirname, "lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _update(self):
+        catalog = self._read_catalog()
+        rasters = self._list_rasters()
+        if not self._can_append(catalog, rasters):
+            return self._rebuild(catalog, rasters)
+        nstored = len(catalog["rasters"])
+        new_rasters = rasters[nstored:]
+        if new_rasters:
+            self._append(catalog, new_rasters, self.data_filename)
+            self._write_catalog(catalog)
+        return catalog
+
+    def _rebuild(self, old_catalog, rasters):
+        catalog = {"grid": None, "unit": None, "rasters": []}
+        catalog["replaced"] = self._save_replaced_rows(old_catalog, rasters)
+        tmp_filename = self.data_filename + ".new"
+        open(tmp_filename, "wb").close()
+        self._append(catalog, rasters, tmp_filename)
+        # If we are interrupted between replacing the data and writing the catalog,
+        # the missing catalog will cause a rebuild next time.
+        if os.path.exists(self.catalog_filename):
+            os.remove(self.catalog_filename)
+        os.replace(tmp_filename, self.data_filename)
+        self._write_catalog(catalog)
+        return catalog
+
+    def _save_replaced_rows(self, old_catalog, rasters):
+        """Keep the rows of the rasters that have been modified since old_catalog.
+
+        Returns the "replaced" item of the new catalog. A raster modified again
+        replaces its previously kept row.
+        """
+        if old_catalog is None or not os.path.exists(self.data_filename):
+            return {}
+        replaced = old_catalog.get("replaced", {})
+        versions = {x["filename"]: x["version"] for x in rasters}
+        data = self._open_data(old_catalog)
+        for i, raster in enumerate(old_catalog["rasters"]):
+            filename = raster["filename"]
+            if versions.get(filename, raster["version"]) == raster["version"]:
+                continue
+            os.makedirs(self.replaced_dirname, exist_ok=True)
+            data[i].tofile(os.path.join(self.replaced_dirname, filename + ".f32"))
+            replaced[filename] = {
+                "version": raster["version"],
+                "grid": old_catalog["grid"],
+            }
+        return replaced
+
+    def _read_catalog(self):
+        try:
+            with open(self.catalog_filename) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_catalog(self, catalog):
+        tmp_filename = self.catalog_filename + ".new"
+        with open(tmp_filename, "w") as f:
+            json.dump(catalog, f)
+        os.replace(tmp_filename, self.catalog_filename)
+
+    def _list_rasters(self):
+        return [
+            {
+                "filename": os.path.basename(filename),
+                "date": date.isoformat(),
+                "version": list(get_file_version(filename) or ()),
+            }
+            for filename, date in get_dated_raster_filenames(self.prefix)
+        ]
+
+    def _can_append(self, catalog, rasters):
+        if catalog is None or not os.path.exists(self.data_filename):
+            return False
+        n = len(catalog["rasters"])
+        stored = [(x["filename"], x["date"], x["version"]) for x in catalog["rasters"]]
+        current = [(x["filename"], x["date"], x["version"]) for x in rasters[:n]]
+        return stored == current
+
+    def _append(self, catalog, rasters, data_filename):
+        with open(data_filename, "r+b") as f:
+            # Discard rows that may have been left over by an interrupted update
+            f.truncate(len(catalog["rasters"]) * self._row_size(catalog))
+            f.seek(0, os.SEEK_END)
+            for raster in rasters:
+                self._append_raster(catalog, raster, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _append_raster(self, catalog, raster, f):
+        grid, metadata, values = self._read_raster(raster["filename"])
+        if catalog["grid"] is None:
+            catalog["grid"] = _grid_to_json(grid)
+            catalog["unit"] = metadata.get("UNIT")
+        elif _grid_from_json(catalog["grid"]) != grid:
+            # Failing here would make every read of the store fail until the raster
+            # is fixed, so it is resampled to the grid of the store instead.
+            logger.warning(
+                f"{raster['filename']} has a different grid from the others; "
+                "resampling it"
+            )
+            pixels = grid.get_pixels_of_grid(_grid_from_json(catalog["grid"]))
+            values = np.where(pixels >= 0, values[pixels], np.nan).astype(np.float32)
+        f.write(values.tobytes())
+        catalog["rasters"].append({**raster, "timestamp": metadata["TIMESTAMP"]})
+
+    def _read_raster(self, basename):
+        """Return a tuple (grid, metadata, values) for a raster of the store.
+
+        values is a flat float32 array with one item per pixel; nodata is NaN.
+        """
+        filename = os.path.join(os.path.dirname(self.prefix), basename)
+        profiling.count("rasters_opened")
+        dataset = gdal.Open(filename)
+        if dataset is None:
+            raise RuntimeError(f"Could not open {filename}")
+        try:
+            band = dataset.GetRasterBand(1)
+            values = band.ReadAsArray(buf_type=gdal.GDT_Float32).astype(np.float32)
+            nodata = band.GetNoDataValue()
+            if nodata is not None:
+                values[values == np.float32(nodata)] = np.nan
+            return (
+                RasterGrid.from_dataset(dataset),
+                dataset.GetMetadata(),
+                values.ravel(),
+            )
+        finally:
+            dataset = None
+
+    def _row_size(self, catalog):
+        if catalog["grid"] is None:
+            return 0
+        height, width = catalog["grid"]["size"]
+        return height * width * np.dtype(np.float32).itemsize
+
+    def _open_data(self, catalog):
+        nrows = len(catalog["rasters"])
+        if not nrows:
+            return None
+        height, width = catalog["grid"]["size"]
+        return np.memmap(
+            self.data_filename,
+            dtype=np.float32,
+            mode="r",
+            shape=(nrows, height * width),
+        )
+
+
+class PixelSeriesCache:
+    """A bounded, thread-safe LRU cache of the time series of single pixels.
+
+    The keys identify a store and the version of its data, a pixel and the first row
+    (i.e. the start date), so fields that fall in the same pixel share one
+    extracted series, both when they are calculated together and when they are
+    calculated one by one in the same process.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+pixel_series_cache = PixelSeriesCache(maxsize=10000)
+
+
+def _grid_to_json(grid):
+    return {
+        "geotransform": list(grid.geotransform),
+        "projection": grid.projection,
+        "size": list(grid.size),
+    }
+
+
+def _grid_from_json(value):
+    return RasterGrid(
+        tuple(value["geotransform"]), value["projection"], tuple(value["size"])
+    )
+
+
+def _parse_date(isostring):
+    return dt.datetime.fromisoformat(isostring)
@@ -65,6 +65,16 @@ urlpatterns = [
         views.IrrigationPerformanceCsvView.as_view(),
         name="agrifield-irrigation-performance-download",
     ),
+    path(
+        "<str:username>/fields/<int:pk>/scenarios/",
+        views.IrrigationScenariosView.as_view(),
+        name="agrifield-irrigation-scenarios",
+    ),
+    path(
+        "<str:username>/fields/<int:pk>/sweep/",
+        views.IrrigationParameterSweepView.as_view(),
+        name="agrifield-irrigation-parameter-sweep",
+    ),
     path(
         "<str:username>/supervisees/remove/",
         views.remove_supervisee_from_user_list,
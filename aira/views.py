@@ -1,5 +1,7 @@
 import csv
 import datetime as dt
+import json
+import math
 import os
 from glob import glob
 
@@ -9,7 +11,14 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.models import User
 from django.contrib.gis.geos import Point
 from django.db.models import Q
-from django.http import FileResponse, Http404, HttpResponse, HttpResponseRedirect
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseRedirect,
+    JsonResponse,
+)
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse
 from django.utils.translation import ugettext_lazy as _
@@ -18,6 +27,8 @@ from django.views.generic.detail import DetailView
 from django.views.generic.edit import CreateView, DeleteView, UpdateView
 from django.views.generic.list import ListView
 
+import numpy as np
+
 from . import forms, models
 
 
@@ -59,7 +70,7 @@ class IrrigationPerformanceView(CheckUsernameMixin, DetailView):
         return self.context
 
     def _get_sum_applied_irrigation(self):
-        results = self.object.results
+        results = self.object.performance_results
         sum_applied_irrigation = results["timeseries"].assumed_total_irrigation.sum()
         self.context["sum_applied_irrigation"] = sum_applied_irrigation
         self.context["sum_applied_irrigation_cubic"] = (
@@ -67,7 +78,7 @@ class IrrigationPerformanceView(CheckUsernameMixin, DetailView):
         )
 
     def _get_percentage_diff(self):
-        results = self.object.results
+        results = self.object.performance_results
         sum_ifinal_theoretical = results["timeseries"].ifinal_theoretical.sum()
         sum_applied_irrigation = self.context["sum_applied_irrigation"]
         if sum_ifinal_theoretical >= 0.1:
@@ -97,7 +108,7 @@ class IrrigationPerformanceCsvView(CheckUsernameMixin, View):
             ]
         )
         writer.writerow(["", "amount (mm)", "amount (mm)", "amount (mm)"])
-        for date, row in f.results["timeseries"].iterrows():
+        for date, row in f.performance_results["timeseries"].iterrows():
             writer.writerow(
                 [
                     date,
@@ -109,6 +120,115 @@ class IrrigationPerformanceCsvView(CheckUsernameMixin, View):
         return response
 
 
+class IrrigationScenariosView(CheckUsernameMixin, LoginRequiredMixin, View):
+    """Evaluates hypothetical irrigation schedules (see evaluate_scenarios()).
+
+    The request body is JSON like {"scenarios": [[{"date": "2018-03-19",
+    "amount": 20}, ...], ...]}, where each scenario is a list of irrigations and
+    the amounts are in mm. There may be at most max_scenarios scenarios, each with at
+    most max_irrigations irrigations; otherwise the response is 400. The response
+    is JSON with "dates" and with "scenarios", which has, for each scenario, the
+    "theta" and "ks" of each date.
+
+    Like any POST, the request needs the CSRF token in the X-CSRFToken header (see
+    the README).
+    """
+
+    max_scenarios = 20
+    max_irrigations = 366
+
+    def post(self, *args, **kwargs):
+        agrifield = self.get_agrifield()
+        try:
+            scenarios = self._parse_scenarios(self.request.body)
+        except (ValueError, TypeError, KeyError) as e:
+            return HttpResponseBadRequest("Invalid scenarios: {}".format(e))
+        if not agrifield.results:
+            raise Http404
+        try:
+            result = agrifield.evaluate_scenarios(scenarios)
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        return JsonResponse(
+            {
+                "dates": [date.strftime("%Y-%m-%d") for date in result["index"]],
+                "scenarios": [
+                    {
+                        "theta": _to_json_list(result["theta"][:, j]),
+                        "ks": _to_json_list(result["ks"][:, j]),
+                    }
+                    for j in range(len(scenarios))
+                ],
+            }
+        )
+
+    def _parse_scenarios(self, body):
+        scenarios = json.loads(body)["scenarios"]
+        if not isinstance(scenarios, list) or not scenarios:
+            raise ValueError("there must be at least one scenario")
+        if len(scenarios) > self.max_scenarios:
+            raise ValueError("at most {} scenarios".format(self.max_scenarios))
+        result = []
+        for scenario in scenarios:
+            if not isinstance(scenario, list):
+                raise ValueError("each scenario must be a list of irrigations")
+            if len(scenario) > self.max_irrigations:
+                raise ValueError(
+                    "at most {} irrigations per scenario".format(self.max_irrigations)
+                )
+            schedule = {}
+            for irrigation in scenario:
+                date = dt.date.fromisoformat(irrigation["date"])
+                amount = float(irrigation["amount"])
+                if not (math.isfinite(amount) and amount >= 0):
+                    raise ValueError("amounts must be finite and non-negative")
+                schedule[date] = schedule.get(date, 0) + amount
+            result.append(schedule)
+        return result
+
+
+class IrrigationParameterSweepView(CheckUsernameMixin, LoginRequiredMixin, View):
+    """Evaluates irrigation optimizer settings (see sweep_irrigation_parameters()).
+
+    The irrigation optimizer values are given with one or more "mif" query
+    parameters, and optionally max allowed depletion values with "p" parameters.
+    The response is JSON with "results", the list returned by
+    sweep_irrigation_parameters().
+    """
+
+    max_values = 20
+
+    def get(self, *args, **kwargs):
+        agrifield = self.get_agrifield()
+        try:
+            mifs = self._get_values("mif", 0.1, 1.0)
+            ps = self._get_values("p", 0.0, 0.99) or None
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        if not mifs:
+            return HttpResponseBadRequest("At least one mif must be specified")
+        if not agrifield.results:
+            raise Http404
+        return JsonResponse(
+            {"results": agrifield.sweep_irrigation_parameters(mifs, ps)}
+        )
+
+    def _get_values(self, name, minimum, maximum):
+        values = [float(x) for x in self.request.GET.getlist(name)]
+        if len(values) > self.max_values:
+            raise ValueError("At most {} values of {}".format(self.max_values, name))
+        for value in values:
+            if not minimum <= value <= maximum:
+                raise ValueError(
+                    "{} must be between {} and {}".format(name, minimum, maximum)
+                )
+        return values
+
+
+def _to_json_list(values):
+    return [None if np.isnan(x) else float(x) for x in values]
+
+
 class DemoView(TemplateView):
     INITIAL_AGRIFIELDS = [
         {
@@ -252,7 +372,9 @@ class AgrifieldListView(LoginRequiredMixin, TemplateView):
             context["profile"] = None
         # Fetch models.Agrifield(User)
         try:
-            agrifields = models.Agrifield.objects.filter(owner=user).all()
+            agrifields = models.Agrifield.objects.filter(
+                owner=user
+            ).with_cached_results()
             context["agrifields"] = agrifields
             context["fields_count"] = len(agrifields)
         except models.Agrifield.DoesNotExist:
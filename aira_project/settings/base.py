@@ -103,9 +103,11 @@ AIRA_MAP_DEFAULT_ZOOM = 10
 AIRA_EMAIL_HEADER = ""
 AIRA_EMAIL_FOOTER = ""
 
-CELERY_TASK_SERIALIZER = "pickle"
-CELERY_ACCEPT_CONTENT = ["pickle"]
+CELERY_TASK_SERIALIZER = "json"
+CELERY_RESULT_SERIALIZER = "json"
+CELERY_ACCEPT_CONTENT = ["json"]
 AIRA_CELERY_SEND_TASK_ERROR_EMAILS = False
+AIRA_RECALCULATION_DEBOUNCE = 10
 
 if os.environ.get("SELENIUM_BROWSER", False):
     from selenium import webdriver